@@ -1,62 +1,149 @@
 import streamlit as st
+
+# Configure page; this has to be the first Streamlit command of the script
+st.set_page_config(
+    page_title="Personal Trainer App",
+    page_icon="💪",
+    layout="wide"
+)
+
 import os
 from dotenv import load_dotenv
-from supabase import create_client, Client
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+import io
 import json
+import time
+import uuid
+
+# The Supabase SDK (db.client, SupabaseRepository) and the SQLite backend
+# are imported in connect(), so the login page renders without them
+from db.adherence import (ADHERENCE_PERIODS, adherence_frame, adherence_window, by_client,
+                          by_template, by_week, overall)
+from db.bulk import WEEKDAYS, schedule_dates
+from db.cache import get_query_cache
+from db.changes import SessionChanges, apply_changes, get_change_feed, merge_rows, session_waker
+from db.catalog import CATALOG_KINDS, get_catalog, reference_body
+from db.completions import PendingCompletions, flush
+from db.export import EXPORT_FORMATS, EXPORT_WRITERS, export_file_name, history_rows
+from db.fetch import fetch_all
+from db.imports import IMPORT_TABLES, import_columns, import_schedule, import_templates, read_records
+from db.jobs import JOB_LABELS, JobRunner, get_job_executor
+from db.pagination import PAGE_SIZE, next_cursor
+from db.records import Profile, User, assignment_records
+from db.render import details_key, details_markdown, get_render_cache
+from db.repository import TEMPLATE_BODIES
+from db.schedule import (VIEWS, ScheduleCache, get_prefetch_executor, group_by_day, next_window,
+                         previous_window, window)
+from db.search import CLIENT_SEARCH_LIMIT
+from db.session import AuthSession, get_token_refresher
+from db.tracing import TracingRepository, annotate, export_trace, trace_rerun
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase client - check both env vars and Streamlit secrets
-SUPABASE_URL = os.getenv("SUPABASE_URL") or st.secrets.get("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY") or st.secrets.get("SUPABASE_KEY")
-
-if not SUPABASE_URL or not SUPABASE_KEY:
-    st.error("Please set SUPABASE_URL and SUPABASE_KEY in your .env file or Streamlit secrets")
-    st.info("For local development: Create a .env file with your Supabase credentials")
-    st.info("For Streamlit Cloud: Add credentials in the app settings under 'Secrets'")
-    st.stop()
-
-# Debug info (remove after fixing)
-if st.sidebar.button("🔍 Debug Info"):
-    st.sidebar.write(f"URL: {SUPABASE_URL}")
-    st.sidebar.write(f"Key starts with: {SUPABASE_KEY[:20]}...")
-    st.sidebar.write(f"Key length: {len(SUPABASE_KEY)}")
-
-try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    # Test the connection immediately
-    test_result = supabase.auth.get_session()
-    st.sidebar.success("✅ Supabase connected successfully")
-except Exception as e:
-    st.error(f"Failed to create Supabase client: {str(e)}")
-    st.error("Please check your SUPABASE_URL and SUPABASE_KEY in Streamlit secrets")
-    
-    # Show exact values for debugging
-    st.code(f"""
+# Data backend: "supabase" (default), or "sqlite" to run the data layer
+# offline against a local database (no Supabase Auth, so no sign in)
+DATA_BACKEND = os.getenv("DATA_BACKEND", "supabase")
+
+# Assignment change feed (db/changes.py): a direct Postgres connection
+# string to LISTEN on; without it only the SQLite backend publishes changes
+CHANGE_FEED_URL = os.getenv("CHANGE_FEED_URL")
+
+# Query cache shared by the app's workers (db/shared_cache.py): sqlite:///path,
+# redis://host:port/db or memory://; without it each worker caches on its own
+CACHE_URL = os.getenv("CACHE_URL")
+
+# Set by connect() on the reruns that need data
+supabase = None
+repo = None
+
+def connect():
+    """Create this rerun's Supabase client and repository
+
+    Called when someone signs in or up, and on every rerun once they have,
+    so an anonymous visitor gets the login page without the SDK or a
+    network round-trip.
+    """
+    global supabase, repo
+    if repo is not None:
+        return
+    if DATA_BACKEND == "sqlite":
+        from db.sqlite_repository import get_sqlite_repository
+        inner = get_sqlite_repository(os.getenv("SQLITE_PATH", ":memory:"))
+        # The SQLite triggers stand in for Postgres NOTIFY
+        get_change_feed(CHANGE_FEED_URL).attach(inner)
+        # Every repository call gets a span when the rerun is traced
+        repo = TracingRepository(inner)
+        return
+    
+    # Initialize Supabase client - check both env vars and Streamlit secrets
+    SUPABASE_URL = os.getenv("SUPABASE_URL") or st.secrets.get("SUPABASE_URL")
+    SUPABASE_KEY = os.getenv("SUPABASE_KEY") or st.secrets.get("SUPABASE_KEY")
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        st.error("Please set SUPABASE_URL and SUPABASE_KEY in your .env file or Streamlit secrets")
+        st.info("For local development: Create a .env file with your Supabase credentials")
+        st.info("For Streamlit Cloud: Add credentials in the app settings under 'Secrets'")
+        st.stop()
+
+    # Debug info (remove after fixing)
+    if st.sidebar.button("🔍 Debug Info"):
+        st.sidebar.write(f"URL: {SUPABASE_URL}")
+        st.sidebar.write(f"Key starts with: {SUPABASE_KEY[:20]}...")
+        st.sidebar.write(f"Key length: {len(SUPABASE_KEY)}")
+
+    from db.client import check_connection, get_client
+    from db.repository import SupabaseRepository
+    try:
+        # Health check runs once per process; the client is reused across reruns
+        check_connection(SUPABASE_URL, SUPABASE_KEY)
+        supabase = get_client(SUPABASE_URL, SUPABASE_KEY)
+        st.sidebar.success("✅ Supabase connected successfully")
+    except Exception as e:
+        st.error(f"Failed to create Supabase client: {str(e)}")
+        st.error("Please check your SUPABASE_URL and SUPABASE_KEY in Streamlit secrets")
+    
+        # Show exact values for debugging
+        st.code(f"""
 Current values:
 SUPABASE_URL = "{SUPABASE_URL}"
 SUPABASE_KEY = "{SUPABASE_KEY[:50]}..."
     """)
-    st.stop()
+        st.stop()
+    
+    # Every repository call gets a span when the rerun is traced
+    repo = TracingRepository(SupabaseRepository(supabase))
 
-# Configure page
-st.set_page_config(
-    page_title="Personal Trainer App",
-    page_icon="💪",
-    layout="wide"
-)
+# Request tracing: set TRACE_EXPORT to a file path to append every rerun's
+# spans to it, as JSON lines ("jsonl") or OpenTelemetry OTLP/JSON ("otlp")
+TRACE_EXPORT = os.getenv("TRACE_EXPORT")
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "jsonl")
 
 # Session state initialization
 if 'user' not in st.session_state:
     st.session_state.user = None
 if 'profile' not in st.session_state:
     st.session_state.profile = None
+if 'auth' not in st.session_state:
+    st.session_state.auth = None
+if 'checklist' not in st.session_state:
+    st.session_state.checklist = None
+if 'pending_completions' not in st.session_state:
+    st.session_state.pending_completions = PendingCompletions()
+if 'schedule' not in st.session_state:
+    st.session_state.schedule = ScheduleCache()
+if 'changes' not in st.session_state:
+    st.session_state.changes = SessionChanges()
+    st.session_state.changes_key = str(uuid.uuid4())
+if 'bulk_cohort' not in st.session_state:
+    st.session_state.bulk_cohort = {}
 
 # Authentication functions
 def sign_up(email, password, full_name, role):
     """Sign up a new user"""
+    connect()
+    if supabase is None:
+        return False, "Sign up needs Supabase Auth, which is not available with DATA_BACKEND=sqlite."
     try:
         # Create user in Supabase Auth
         response = supabase.auth.sign_up({
@@ -71,23 +158,25 @@ def sign_up(email, password, full_name, role):
         })
         
         if response.user:
+            # The signup trigger has created a new profile row
+            get_query_cache(CACHE_URL).invalidate('clients')
+            
             # If email confirmation is enabled, user needs to verify email
             if not response.session:
                 return True, "Account created! Please check your email and click the confirmation link to complete setup."
             
             # If no email confirmation required, update profile directly
-            supabase.table('profiles').update({
+            repo.update_profile(response.user.id, {
                 'full_name': full_name,
                 'role': role
-            }).eq('id', response.user.id).execute()
+            })
             
             return True, "Account created successfully!"
         else:
             return False, f"Failed to create account. Response: {response}"
     except Exception as e:
         error_msg = str(e)
-        st.write(f"DEBUG - Full error: {error_msg}")  # Temporary debug info
-        st.write(f"DEBUG - Error type: {type(e)}")  # Temporary debug info
+        annotate(sign_up_error=f"{type(e).__name__}: {error_msg}")
         
         if "Invalid API key" in error_msg:
             return False, "Authentication configuration error. Please check Supabase settings and API credentials."
@@ -100,6 +189,9 @@ def sign_up(email, password, full_name, role):
 
 def sign_in(email, password):
     """Sign in an existing user"""
+    connect()
+    if supabase is None:
+        return False, "Sign in needs Supabase Auth, which is not available with DATA_BACKEND=sqlite."
     try:
         response = supabase.auth.sign_in_with_password({
             "email": email,
@@ -107,22 +199,77 @@ def sign_in(email, password):
         })
         
         if response.user:
-            st.session_state.user = response.user
-            # Fetch user profile
-            profile_response = supabase.table('profiles').select('*').eq('id', response.user.id).execute()
-            if profile_response.data:
-                st.session_state.profile = profile_response.data[0]
+            st.session_state.user = User(id=response.user.id, email=response.user.email)
+            # Toggles kept from a sign out are only saved for the same user
+            pending = st.session_state.pending_completions
+            if pending.owner != response.user.id:
+                pending.clear()
+            pending.owner = None
+            # Tokens are refreshed in the background from now on; see db/session.py
+            st.session_state.auth = AuthSession(supabase.auth, response.session)
+            get_token_refresher().add(st.session_state.auth)
+            load_profile()
             return True, "Logged in successfully!"
         return False, "Invalid credentials"
     except Exception as e:
         return False, str(e)
 
-def sign_out():
-    """Sign out the current user"""
+def load_profile():
+    """Fetch the signed-in user's profile into the session; returns it or None"""
     try:
-        supabase.auth.sign_out()
-        st.session_state.user = None
+        st.session_state.profile = Profile.from_row(repo.get_profile(st.session_state.user.id))
+    except Exception as e:
+        st.error(f"Error loading profile: {e}")
+    return st.session_state.profile
+
+def refresh_session():
+    """Refresh the access token first if it would expire during this rerun
+    
+    The background refresher (db/session.py) normally gets there first.
+    Returns False if the session can no longer be refreshed.
+    """
+    auth = st.session_state.auth
+    if auth is None:
+        # The SQLite backend has no tokens
+        return True
+    try:
+        return auth.ensure_fresh()
+    except Exception as e:
+        st.warning(f"Could not refresh your session: {e}")
+        return not auth.rejected
+
+def sign_out(force=False):
+    """Sign out the current user
+    
+    Refuses while completion toggles cannot be saved, unless forced (e.g.
+    the session has expired); they are then kept for the same user's next
+    sign in. Returns whether the user was signed out.
+    """
+    try:
+        pending = st.session_state.pending_completions
+        saved = not pending or flush_completions()
+        if not saved and not force:
+            st.error("Your progress could not be saved, so you are still signed in. Please try again.")
+            return False
+        if supabase:
+            try:
+                supabase.auth.sign_out()
+            except Exception:
+                pass  # e.g. the token has expired; the local session is dropped anyway
+        if st.session_state.auth is not None:
+            get_token_refresher().discard(st.session_state.auth)
+        st.session_state.auth = None
+        get_change_feed(CHANGE_FEED_URL).unsubscribe(st.session_state.changes_key)
+        st.session_state.changes = SessionChanges()
         st.session_state.profile = None
+        st.session_state.checklist = None
+        if saved:
+            st.session_state.pending_completions = PendingCompletions()
+        elif st.session_state.user is not None:
+            pending.owner = st.session_state.user.id
+        st.session_state.user = None
+        st.session_state.schedule = ScheduleCache()
+        st.session_state.bulk_cohort = {}
         return True
     except Exception as e:
         st.error(f"Error signing out: {e}")
@@ -132,72 +279,255 @@ def sign_out():
 def create_workout(title, description, exercises):
     """Create a new workout"""
     try:
-        data = {
-            'trainer_id': st.session_state.user.id,
-            'title': title,
-            'description': description,
-            'exercises': exercises
-        }
-        response = supabase.table('workouts').insert(data).execute()
+        exercises = intern_body('workouts', exercises)
+        repo.create_template('workouts', st.session_state.user.id, title, description, exercises)
+        get_query_cache(CACHE_URL).invalidate('workouts', st.session_state.user.id)
         return True, "Workout created successfully!"
     except Exception as e:
         return False, str(e)
 
-def get_workouts():
-    """Get all workouts for the current trainer"""
+def get_workouts(after=None, limit=None):
+    """Get workout summaries for the current trainer, newest first
+    
+    Pass after (a next_cursor) and limit to fetch a single keyset page.
+    The exercises are not included; see get_workout_exercises.
+    """
     try:
-        response = supabase.table('workouts').select('*').eq('trainer_id', st.session_state.user.id).execute()
-        return response.data
+        trainer_id = st.session_state.user.id
+        return get_query_cache(CACHE_URL).get_or_load(
+            ('workouts', trainer_id, after, limit),
+            lambda: repo.list_templates('workouts', trainer_id, after=after, limit=limit)
+        )
     except Exception as e:
         st.error(f"Error fetching workouts: {e}")
         return []
 
-def delete_workout(workout_id):
-    """Delete a workout"""
+def get_workout_exercises(workout_id, version=None):
+    """Get the exercise list of a single workout, as of version if given"""
+    try:
+        return get_query_cache(CACHE_URL).get_or_load(
+            ('workout_exercises', st.session_state.user.id, workout_id, version),
+            lambda: expand_body('workouts', repo.get_template_body('workouts', workout_id, version))
+        )
+    except Exception as e:
+        st.error(f"Error fetching exercises: {e}")
+        return []
+
+def update_workout(workout_id, title, description, exercises):
+    """Save an edited workout as its next version"""
+    try:
+        exercises = intern_body('workouts', exercises)
+        version = repo.update_template('workouts', workout_id, title, description, exercises)
+        for name in ('workouts', 'workout_exercises', 'workout_versions'):
+            get_query_cache(CACHE_URL).invalidate(name, st.session_state.user.id)
+        return True, f"Workout saved as version {version}"
+    except Exception as e:
+        return False, str(e)
+
+def duplicate_workout(workout_id, title):
+    """Copy a workout; the copy shares the original's stored exercises"""
     try:
-        supabase.table('workouts').delete().eq('id', workout_id).execute()
-        return True, "Workout deleted successfully!"
+        repo.clone_template('workouts', workout_id, f"{title} (copy)")
+        get_query_cache(CACHE_URL).invalidate('workouts', st.session_state.user.id)
+        return True, "Workout duplicated!"
     except Exception as e:
         return False, str(e)
 
+def get_workout_versions(workout_id):
+    """Get the version history of a workout, newest first"""
+    try:
+        return get_query_cache(CACHE_URL).get_or_load(
+            ('workout_versions', st.session_state.user.id, workout_id),
+            lambda: repo.list_versions('workouts', workout_id)
+        )
+    except Exception as e:
+        st.error(f"Error fetching versions: {e}")
+        return []
+
+def archive_workout(workout_id):
+    """Archive a workout in the background, keeping its past assignments"""
+    return enqueue_job(
+        'archive_template',
+        {'table': 'workouts', 'template_id': workout_id, 'today': date.today().isoformat()},
+        "Archiving the workout in the background. Past assignments keep their history."
+    )
+
 # Meal plan functions
 def create_meal_plan(title, description, meals):
     """Create a new meal plan"""
     try:
-        data = {
-            'trainer_id': st.session_state.user.id,
-            'title': title,
-            'description': description,
-            'meals': meals
-        }
-        response = supabase.table('meal_plans').insert(data).execute()
+        meals = intern_body('meal_plans', meals)
+        repo.create_template('meal_plans', st.session_state.user.id, title, description, meals)
+        get_query_cache(CACHE_URL).invalidate('meal_plans', st.session_state.user.id)
         return True, "Meal plan created successfully!"
     except Exception as e:
         return False, str(e)
 
-def get_meal_plans():
-    """Get all meal plans for the current trainer"""
+def get_meal_plans(after=None, limit=None):
+    """Get meal plan summaries for the current trainer, newest first
+    
+    Pass after (a next_cursor) and limit to fetch a single keyset page.
+    The meals are not included; see get_meal_plan_meals.
+    """
     try:
-        response = supabase.table('meal_plans').select('*').eq('trainer_id', st.session_state.user.id).execute()
-        return response.data
+        trainer_id = st.session_state.user.id
+        return get_query_cache(CACHE_URL).get_or_load(
+            ('meal_plans', trainer_id, after, limit),
+            lambda: repo.list_templates('meal_plans', trainer_id, after=after, limit=limit)
+        )
     except Exception as e:
         st.error(f"Error fetching meal plans: {e}")
         return []
 
-def delete_meal_plan(meal_plan_id):
-    """Delete a meal plan"""
+def get_meal_plan_meals(meal_plan_id, version=None):
+    """Get the meal list of a single meal plan, as of version if given"""
+    try:
+        return get_query_cache(CACHE_URL).get_or_load(
+            ('meal_plan_meals', st.session_state.user.id, meal_plan_id, version),
+            lambda: expand_body('meal_plans', repo.get_template_body('meal_plans', meal_plan_id, version))
+        )
+    except Exception as e:
+        st.error(f"Error fetching meals: {e}")
+        return []
+
+def update_meal_plan(meal_plan_id, title, description, meals):
+    """Save an edited meal plan as its next version"""
+    try:
+        meals = intern_body('meal_plans', meals)
+        version = repo.update_template('meal_plans', meal_plan_id, title, description, meals)
+        for name in ('meal_plans', 'meal_plan_meals', 'meal_plan_versions'):
+            get_query_cache(CACHE_URL).invalidate(name, st.session_state.user.id)
+        return True, f"Meal plan saved as version {version}"
+    except Exception as e:
+        return False, str(e)
+
+def duplicate_meal_plan(meal_plan_id, title):
+    """Copy a meal plan; the copy shares the original's stored meals"""
     try:
-        supabase.table('meal_plans').delete().eq('id', meal_plan_id).execute()
-        return True, "Meal plan deleted successfully!"
+        repo.clone_template('meal_plans', meal_plan_id, f"{title} (copy)")
+        get_query_cache(CACHE_URL).invalidate('meal_plans', st.session_state.user.id)
+        return True, "Meal plan duplicated!"
     except Exception as e:
         return False, str(e)
 
+def get_meal_plan_versions(meal_plan_id):
+    """Get the version history of a meal plan, newest first"""
+    try:
+        return get_query_cache(CACHE_URL).get_or_load(
+            ('meal_plan_versions', st.session_state.user.id, meal_plan_id),
+            lambda: repo.list_versions('meal_plans', meal_plan_id)
+        )
+    except Exception as e:
+        st.error(f"Error fetching versions: {e}")
+        return []
+
+def archive_meal_plan(meal_plan_id):
+    """Archive a meal plan in the background, keeping its past assignments"""
+    return enqueue_job(
+        'archive_template',
+        {'table': 'meal_plans', 'template_id': meal_plan_id, 'today': date.today().isoformat()},
+        "Archiving the meal plan in the background. Past assignments keep their history."
+    )
+
+# Catalog functions
+def intern_body(table, body):
+    """Body with its exercise / meal names replaced by catalog ids, adding new names"""
+    kind = CATALOG_KINDS[table][0]
+    items = repo.intern_catalog_items(kind, [entry['name'] for entry in body])
+    get_catalog().add(items)
+    return reference_body(table, body, items)
+
+def expand_body(table, body):
+    """Body with names filled in from the catalog, fetching ids this process has not seen"""
+    try:
+        return expand_names(table, body)
+    except Exception as e:
+        st.error(f"Error fetching catalog names: {e}")
+        return get_catalog().expand(table, body)
+
+def expand_names(table, body):
+    """expand_body that raises if the catalog cannot be read"""
+    catalog = get_catalog()
+    missing = catalog.missing(table, body)
+    if missing:
+        catalog.add(repo.get_catalog_items(missing))
+    return catalog.expand(table, body)
+
+def prefetch_names(bodies):
+    """Look up in one request the catalog names of the (key, table, body) not rendered yet"""
+    catalog, render_cache = get_catalog(), get_render_cache()
+    missing = sorted({
+        item_id for key, table, body in bodies if not render_cache.get(key)[0]
+        for item_id in catalog.missing(table, body)
+    })
+    if missing:
+        try:
+            catalog.add(repo.get_catalog_items(missing))
+        except Exception as e:
+            st.error(f"Error fetching catalog names: {e}")
+
+def template_details(table, template_id, version, load_body, description=None):
+    """Show a template's exercises or meals as one markdown block
+
+    The markdown is shared by all sessions per (template, version) (see
+    db/render.py), so load_body() only runs the first time a version is
+    shown. It should raise rather than return a partial body, which would
+    be kept.
+    """
+    try:
+        render = lambda: details_markdown(table, load_body(), description)
+        if version is None:
+            markdown = render()
+        else:
+            markdown = get_render_cache().get_or_load(
+                details_key(table, template_id, version, description is not None), render
+            )
+    except Exception as e:
+        st.error(f"Error fetching {'exercises' if table == 'workouts' else 'meals'}: {e}")
+        return
+    st.markdown(markdown)
+
+def load_catalog(kind):
+    """The process-wide catalog with kind loaded in full"""
+    catalog = get_catalog()
+    if catalog.stale(kind):
+        catalog.load(kind, repo.list_catalog(kind))
+    return catalog
+
+def catalog_suggestions(kind, prefix):
+    """Catalog names of kind with a word starting with prefix"""
+    if not prefix.strip():
+        return []
+    try:
+        return load_catalog(kind).suggest(kind, prefix)
+    except Exception as e:
+        st.error(f"Error searching the catalog: {e}")
+        return []
+
+def get_templates_with_item(table, kind, name):
+    """The current trainer's workouts / meal plans that use the catalog item called name"""
+    try:
+        item = load_catalog(kind).find(kind, name)
+        if item is None:
+            return []
+        trainer_id = st.session_state.user.id
+        return get_query_cache(CACHE_URL).get_or_load(
+            (table, trainer_id, 'item', item['id']),
+            lambda: repo.templates_with_item(table, trainer_id, item['id'])
+        )
+    except Exception as e:
+        st.error(f"Error searching templates: {e}")
+        return []
+
 # Client functions
-def get_clients():
-    """Get all clients"""
+def get_clients(search='', limit=CLIENT_SEARCH_LIMIT):
+    """Get up to limit clients whose name or email contains search"""
     try:
-        response = supabase.table('profiles').select('*').eq('role', 'client').execute()
-        return response.data
+        search = search.strip().lower()
+        return get_query_cache(CACHE_URL).get_or_load(
+            ('clients', st.session_state.user.id, search, limit),
+            lambda: repo.search_clients(search, limit)
+        )
     except Exception as e:
         st.error(f"Error fetching clients: {e}")
         return []
@@ -211,7 +541,8 @@ def assign_workout(workout_id, client_id, assigned_date):
             'client_id': client_id,
             'assigned_date': assigned_date.isoformat()
         }
-        response = supabase.table('workout_assignments').insert(data).execute()
+        repo.insert_assignment('workout_assignments', data)
+        get_query_cache(CACHE_URL).invalidate('adherence', st.session_state.user.id)
         return True, "Workout assigned successfully!"
     except Exception as e:
         return False, str(e)
@@ -224,39 +555,253 @@ def assign_meal_plan(meal_plan_id, client_id, assigned_date):
             'client_id': client_id,
             'assigned_date': assigned_date.isoformat()
         }
-        response = supabase.table('meal_assignments').insert(data).execute()
+        repo.insert_assignment('meal_assignments', data)
+        get_query_cache(CACHE_URL).invalidate('adherence', st.session_state.user.id)
         return True, "Meal plan assigned successfully!"
     except Exception as e:
         return False, str(e)
 
-def get_today_assignments():
-    """Get today's assignments for the current client"""
+def bulk_assign_workout(workout_id, client_ids, start_date, end_date, weekdays):
+    """Assign a workout to many clients on the given weekdays of a date range, in the background"""
+    dates = schedule_dates(start_date, end_date, weekdays)
+    return enqueue_job(
+        'bulk_assign',
+        {'table': 'workout_assignments', 'template_id': workout_id, 'client_ids': client_ids,
+         'dates': [d.isoformat() for d in dates]},
+        f"Scheduling {len(client_ids) * len(dates)} workouts in the background"
+    )
+
+def bulk_assign_meal_plan(meal_plan_id, client_ids, start_date, end_date, weekdays):
+    """Assign a meal plan to many clients on the given weekdays of a date range, in the background"""
+    dates = schedule_dates(start_date, end_date, weekdays)
+    return enqueue_job(
+        'bulk_assign',
+        {'table': 'meal_assignments', 'template_id': meal_plan_id, 'client_ids': client_ids,
+         'dates': [d.isoformat() for d in dates]},
+        f"Scheduling {len(client_ids) * len(dates)} meal plans in the background"
+    )
+
+# Background job functions
+# Cached reads each job kind changes, dropped when a job finishes
+JOB_INVALIDATES = {
+    'bulk_assign': ('adherence',),
+    'archive_template': ('workouts', 'meal_plans', 'adherence'),
+}
+# Jobs listed in the sidebar panel
+JOB_LIST_LIMIT = 10
+
+def get_job_runner():
+    """The current trainer's job runner, created once per session (see db/jobs.py)"""
+    owner_id = st.session_state.user.id
+    runner = st.session_state.get('job_runner')
+    if runner is None or runner.owner_id != owner_id:
+        cache = get_query_cache(CACHE_URL)
+        
+        def job_done(job):
+            # Runs on the job thread: only the process-wide cache is touched
+            for name in JOB_INVALIDATES.get(job['kind'], ()):
+                cache.invalidate(name, owner_id)
+        
+        runner = JobRunner(repo, owner_id, get_job_executor(), on_done=job_done)
+        st.session_state.job_runner = runner
+    return runner
+
+def enqueue_job(kind, params, message):
+    """Queue a job for the current trainer and start running it"""
     try:
-        today = date.today().isoformat()
+        repo.enqueue_job(st.session_state.user.id, kind, params)
+        get_job_runner().kick()
+        return True, f"{message}. Follow it under 🧵 Background jobs in the sidebar."
+    except Exception as e:
+        return False, str(e)
+
+def get_jobs():
+    """The current trainer's latest jobs; also resumes any left unfinished"""
+    try:
+        get_job_runner().kick()
+        return repo.list_jobs(st.session_state.user.id, JOB_LIST_LIMIT)
+    except Exception as e:
+        st.error(f"Error fetching jobs: {e}")
+        return []
+
+# Export functions
+def export_history(client_id, fmt):
+    """Encode a client's full history as CSV or Parquet
+    
+    Assignments are fetched a page at a time and encoded as each page
+    arrives (see db/export.py); the chunks are written straight into one
+    buffer, so the file is held once rather than as chunks plus a copy.
+    """
+    try:
+        data = io.BytesIO()
+        for chunk in EXPORT_WRITERS[fmt](history_rows(repo, client_id)):
+            data.write(chunk)
+        return True, data
+    except Exception as e:
+        return False, str(e)
+
+# Import functions
+def import_file(table, uploaded_file, progress):
+    """Import workouts, meal plans or a schedule from an uploaded CSV or JSON file
+    
+    The file is read and written in batches (see db/imports.py); progress
+    is called with the fraction of the file read after each batch.
+    """
+    try:
+        trainer_id = st.session_state.user.id
+        fmt = 'json' if uploaded_file.name.lower().endswith(('.json', '.jsonl')) else 'csv'
+        uploaded_file.seek(0)
+        records = read_records(uploaded_file, fmt)
         
-        # Get workout assignments
-        workout_response = supabase.table('workout_assignments').select(
-            '*, workouts(*)'
-        ).eq('client_id', st.session_state.user.id).eq('assigned_date', today).execute()
+        def batch_done(report):
+            progress(min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0))
+        
+        if table in TEMPLATE_BODIES:
+            report = import_templates(repo, table, trainer_id, records, catalog=get_catalog(), progress=batch_done)
+            get_query_cache(CACHE_URL).invalidate(table, trainer_id)
+            reset_page_cursor(table)
+        else:
+            report = import_schedule(repo, table, trainer_id, records, progress=batch_done)
+            get_query_cache(CACHE_URL).invalidate('adherence', trainer_id)
+        return True, report
+    except Exception as e:
+        return False, str(e)
+
+# Analytics functions
+def get_adherence(weeks):
+    """Get the current trainer's adherence counts for the last weeks weeks
+    
+    Reads the pre-aggregated adherence_weekly table, so the cost follows
+    the number of clients, templates and weeks rather than the number of
+    assignments.
+    Clients tick items off in their own sessions; follow_changes()
+    invalidates the entry when the change feed reports it, otherwise the
+    query cache TTL picks those up.
+    """
+    try:
+        trainer_id = st.session_state.user.id
+        since, until = adherence_window(date.today(), weeks)
+        return get_query_cache(CACHE_URL).get_or_load(
+            ('adherence', trainer_id, since, until),
+            lambda: repo.get_adherence(trainer_id, since, until)
+        )
+    except Exception as e:
+        st.error(f"Error fetching adherence: {e}")
+        return []
+
+# Seconds the client checklist is reused before it is fetched again
+CHECKLIST_TTL_SECONDS = 60
+
+def get_today_assignments(refresh=False):
+    """Get today's assignments for the current client
+    
+    The checklist is kept in session state for CHECKLIST_TTL_SECONDS so
+    ticking items off does not refetch it on every rerun, or for the rest
+    of the day while the change feed keeps it current.
+    """
+    try:
+        today = date.today().isoformat()
+        cached = st.session_state.checklist
+        if (not refresh and cached and cached['date'] == today
+                and (st.session_state.schedule.live
+                     or time.time() - cached['fetched_at'] < CHECKLIST_TTL_SECONDS)):
+            return cached['workouts'], cached['meals']
         
-        # Get meal assignments
-        meal_response = supabase.table('meal_assignments').select(
-            '*, meal_plans(*)'
-        ).eq('client_id', st.session_state.user.id).eq('assigned_date', today).execute()
+        workouts, meals = assignment_records(*repo.get_checklist(st.session_state.user.id, today))
         
-        return workout_response.data, meal_response.data
+        st.session_state.checklist = {
+            'date': today,
+            'fetched_at': time.time(),
+            'workouts': workouts,
+            'meals': meals
+        }
+        return workouts, meals
     except Exception as e:
         st.error(f"Error fetching today's assignments: {e}")
         return [], []
 
+def load_schedule(client_id):
+    """Loader for the schedule cache; safe to run on a background thread"""
+    return lambda start, end: assignment_records(
+        *repo.get_schedule(client_id, start.isoformat(), end.isoformat())
+    )
+
+def get_schedule(start, end):
+    """Get the current client's assignments from start to end (inclusive)
+    
+    Whole windows are fetched in one range query and kept in the session's
+    ScheduleCache (see db/schedule.py).
+    """
+    try:
+        return st.session_state.schedule.get(start, end, load_schedule(st.session_state.user.id))
+    except Exception as e:
+        st.error(f"Error fetching your schedule: {e}")
+        return [], []
+
+def prefetch_schedule(start, end):
+    """Fetch a schedule window in the background for a later rerun"""
+    st.session_state.schedule.prefetch(
+        start, end, load_schedule(st.session_state.user.id), get_prefetch_executor()
+    )
+
+def follow_changes(wake=True):
+    """Apply the assignment changes the feed has for this session
+    
+    Subscribes the session to the process's change feed (db/changes.py).
+    For a client, what arrived since the last rerun is applied to the
+    cached checklist and schedule, fetching only the rows not seen yet in
+    one call; for a trainer, cached adherence is dropped. With wake the
+    feed reruns the session as soon as a change arrives. Returns whether
+    the feed is live; while it is not the caches expire on their TTLs.
+    """
+    feed = get_change_feed(CHANGE_FEED_URL)
+    user_id = st.session_state.user.id
+    inbox = st.session_state.changes
+    inbox.wake = session_waker() if wake else None
+    feed.subscribe(st.session_state.changes_key, user_id, inbox)
+    st.session_state.schedule.live = feed.live
+    changes, resync = inbox.drain()
+    if st.session_state.profile.get('role') == 'trainer':
+        if changes or resync:
+            get_query_cache(CACHE_URL).invalidate('adherence', user_id)
+        return feed.live
+    
+    schedule = st.session_state.schedule
+    if resync:
+        st.session_state.checklist = None
+        schedule.clear()
+    if not changes:
+        return feed.live
+    try:
+        checklist = st.session_state.checklist
+        fetch = {'workout_assignments': set(), 'meal_assignments': set()}
+        if checklist:
+            fetch = apply_changes(
+                {'workout_assignments': checklist['workouts'], 'meal_assignments': checklist['meals']},
+                changes,
+                lambda change: change['assigned_date'] == checklist['date']
+            )
+        ids = {table: rows | fetch[table] for table, rows in schedule.apply_changes(changes).items()}
+        if any(ids.values()):
+            workouts, meals = assignment_records(
+                *repo.get_assignments(ids['workout_assignments'], ids['meal_assignments'])
+            )
+            if checklist:
+                merge_rows(checklist['workouts'], workouts, fetch['workout_assignments'])
+                merge_rows(checklist['meals'], meals, fetch['meal_assignments'])
+            schedule.merge(workouts, meals)
+    except Exception as e:
+        # Reload both rather than show half-applied changes
+        st.session_state.checklist = None
+        schedule.clear()
+        st.warning(f"Could not apply schedule updates; reloading: {e}")
+    return feed.live
+
 def mark_workout_complete(assignment_id, completed):
     """Mark a workout assignment as complete or incomplete"""
     try:
-        data = {
-            'completed': completed,
-            'completed_at': datetime.now().isoformat() if completed else None
-        }
-        supabase.table('workout_assignments').update(data).eq('id', assignment_id).execute()
+        completed_at = datetime.now().isoformat() if completed else None
+        repo.set_completed('workout_assignments', assignment_id, completed, completed_at)
         return True
     except Exception as e:
         st.error(f"Error updating workout: {e}")
@@ -265,17 +810,115 @@ def mark_workout_complete(assignment_id, completed):
 def mark_meal_complete(assignment_id, completed):
     """Mark a meal assignment as complete or incomplete"""
     try:
-        data = {
-            'completed': completed,
-            'completed_at': datetime.now().isoformat() if completed else None
-        }
-        supabase.table('meal_assignments').update(data).eq('id', assignment_id).execute()
+        completed_at = datetime.now().isoformat() if completed else None
+        repo.set_completed('meal_assignments', assignment_id, completed, completed_at)
         return True
     except Exception as e:
         st.error(f"Error updating meal: {e}")
         return False
 
+def record_completion(kind, assignment_id, saved):
+    """Checkbox callback: apply a completion toggle to the session optimistically"""
+    completed = st.session_state[f"{kind}_{assignment_id}"]
+    st.session_state.pending_completions.set(kind, assignment_id, completed, saved)
+
+def completion_writer():
+    """Function writing a batch of completions; safe to call from another thread"""
+    inbox, writer = st.session_state.changes, repo
+    
+    def write(payload):
+        # Tell the change feed to expect the echo of this session's own write
+        inbox.expect('workout_assignments', payload['workouts'])
+        inbox.expect('meal_assignments', payload['meals'])
+        writer.set_completions(**payload)
+    return write
+
+def save_completions(payload):
+    """Write a batch of completions, telling the change feed to expect their echo"""
+    completion_writer()(payload)
+
+def flush_completions():
+    """Write pending completion toggles in one batched call"""
+    try:
+        written = flush(st.session_state.pending_completions, save_completions)
+    except Exception as e:
+        st.warning(f"Your progress could not be saved yet and will be retried: {e}")
+        return False
+    
+    # Keep the cached checklist and schedule in step with what was just saved
+    st.session_state.schedule.apply(written)
+    checklist = st.session_state.checklist
+    if checklist:
+        for kind, rows in (('workout', checklist['workouts']), ('meal', checklist['meals'])):
+            for row in rows:
+                change = written.get((kind, row['id']))
+                if change:
+                    row['completed'], row['completed_at'] = change
+    return True
+
 # UI Pages
+# Clients offered at once in the bulk scheduling picker
+BULK_CLIENT_LIMIT = 200
+
+def client_search(key, limit=CLIENT_SEARCH_LIMIT):
+    """Search box for clients; returns the top matches"""
+    search = st.text_input("Search clients", key=f"{key}_search", placeholder="Name or email")
+    clients = get_clients(search, limit)
+    if not clients:
+        st.info("No clients match your search.")
+    return clients
+
+def catalog_hint(kind, label):
+    """Search box listing catalog names, so new templates reuse existing spellings"""
+    search = st.text_input(label, key=f"catalog_hint_{kind}", placeholder="Start typing a name")
+    names = catalog_suggestions(kind, search)
+    if names:
+        st.caption("In the catalog: " + ", ".join(names))
+    elif search.strip():
+        st.caption("Not in the catalog yet; it is added when you save")
+
+def catalog_filter(table, label):
+    """Search box narrowing a template list to one catalog item
+
+    Returns the templates using the chosen item, or None when the box is empty.
+    """
+    kind = CATALOG_KINDS[table][0]
+    search = st.text_input(label, key=f"catalog_filter_{table}", placeholder="Start typing a name")
+    if not search.strip():
+        return None
+    names = catalog_suggestions(kind, search)
+    if not names:
+        st.info("Nothing in the catalog matches your search.")
+        return []
+    name = st.radio("Matches", names, horizontal=True, key=f"catalog_match_{table}")
+    return get_templates_with_item(table, kind, name)
+
+def get_page_cursor(key):
+    """Cursor of the page currently shown for a paged list"""
+    if f'{key}_cursors' not in st.session_state:
+        st.session_state[f'{key}_cursors'] = [None]
+    return st.session_state[f'{key}_cursors'][-1]
+
+def reset_page_cursor(key):
+    """Go back to the first page of a paged list"""
+    st.session_state[f'{key}_cursors'] = [None]
+
+def pagination_controls(key, rows):
+    """Show Previous/Next buttons for a list fetched with limit PAGE_SIZE + 1
+    
+    The extra row is only used to tell whether there is a next page.
+    """
+    cursors = st.session_state[f'{key}_cursors']
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(cursors) > 1 and st.button("← Previous", key=f"{key}_prev"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if len(rows) > PAGE_SIZE and st.button("Next →", key=f"{key}_next"):
+            cursors.append(next_cursor(rows[:PAGE_SIZE]))
+            st.rerun()
+
 def login_page():
     """Display login/signup page"""
     st.title("💪 Personal Trainer App")
@@ -323,12 +966,20 @@ def trainer_dashboard():
     """Display trainer dashboard"""
     st.title(f"👋 Welcome, {st.session_state.profile.get('full_name', 'Trainer')}")
     
-    if st.sidebar.button("Logout"):
-        sign_out()
+    if st.sidebar.button("Logout") and sign_out():
         st.rerun()
     
     # Navigation
-    page = st.sidebar.radio("Navigation", ["Workouts", "Meal Plans", "Assign to Clients"])
+    page = st.sidebar.radio("Navigation", ["Workouts", "Meal Plans", "Assign to Clients", "Adherence", "Import", "Export"])
+    annotate(page=page)
+    # Only the adherence page shows what clients change, so only it is rerun for them
+    follow_changes(wake=page == "Adherence")
+    
+    stats = get_query_cache(CACHE_URL).stats()
+    shared = f", {stats['shared_hits']} from the shared cache" if 'shared_hits' in stats else ""
+    st.sidebar.caption(f"Cache: {stats['hits']} hits / {stats['misses']} misses{shared}")
+    if st.sidebar.toggle("🧵 Background jobs", key="show_jobs"):
+        jobs_panel()
     
     if page == "Workouts":
         workout_management_page()
@@ -336,6 +987,34 @@ def trainer_dashboard():
         meal_plan_management_page()
     elif page == "Assign to Clients":
         assignment_page()
+    elif page == "Adherence":
+        adherence_page()
+    elif page == "Import":
+        import_page()
+    elif page == "Export":
+        export_page()
+
+def jobs_panel():
+    """Sidebar list of the trainer's background jobs with their progress"""
+    with st.sidebar.expander("Background jobs", expanded=True):
+        st.button("🔄 Refresh", key="refresh_jobs")
+        jobs = get_jobs()
+        if not jobs:
+            st.caption("No background jobs yet.")
+        for job in jobs:
+            label = JOB_LABELS.get(job['kind'], job['kind'])
+            if job['status'] == 'done':
+                result = job.get('result') or {}
+                detail = f"{result['inserted']} added, {result['skipped']} already scheduled" if 'inserted' in result else "done"
+                st.write(f"✅ {label}: {detail}")
+            elif job['status'] == 'failed':
+                st.write(f"❌ {label} failed after {job['attempts']} attempts")
+                st.caption(job.get('error') or '')
+            else:
+                total = job.get('total') or 0
+                waiting = job['status'] == 'queued' and job['attempts'] > 0
+                text = f"{label}: {job['done']}/{total}" if total else f"{label}: {job['status']}"
+                st.progress(job['done'] / total if total else 0.0, text=text + (" (retrying)" if waiting else ""))
 
 def workout_management_page():
     """Workout management page for trainers"""
@@ -343,6 +1022,7 @@ def workout_management_page():
     
     # Create new workout
     with st.expander("➕ Create New Workout", expanded=False):
+        catalog_hint('exercise', "🔎 Look up an exercise")
         with st.form("create_workout_form"):
             title = st.text_input("Workout Title")
             description = st.text_area("Description")
@@ -375,6 +1055,7 @@ def workout_management_page():
                     success, message = create_workout(title, description, exercises)
                     if success:
                         st.success(message)
+                        reset_page_cursor('workouts')
                         st.rerun()
                     else:
                         st.error(message)
@@ -383,26 +1064,114 @@ def workout_management_page():
     
     # Display existing workouts
     st.subheader("Existing Workouts")
-    workouts = get_workouts()
+    matches = catalog_filter('workouts', "🔎 Find workouts by exercise")
+    if matches is None:
+        workouts = get_workouts(after=get_page_cursor('workouts'), limit=PAGE_SIZE + 1)
+        shown = workouts[:PAGE_SIZE]
+    else:
+        shown = matches
     
-    if workouts:
-        for workout in workouts:
+    if shown:
+        for workout in shown:
             with st.expander(f"📋 {workout['title']}"):
+                st.caption(f"Version {workout.get('version', 1)}")
                 st.write(f"**Description:** {workout.get('description', 'N/A')}")
-                st.write("**Exercises:**")
-                exercises = workout.get('exercises', [])
-                for i, ex in enumerate(exercises, 1):
-                    st.write(f"{i}. {ex.get('name', 'N/A')} - {ex.get('sets', 'N/A')} sets x {ex.get('reps', 'N/A')} reps")
+                if st.toggle("Show exercises", key=f"show_exercises_{workout['id']}"):
+                    template_details('workouts', workout['id'], workout.get('version'), lambda: expand_names(
+                        'workouts', repo.get_template_body('workouts', workout['id'], workout.get('version'))
+                    ))
+                if st.toggle("✏️ Edit", key=f"edit_workout_{workout['id']}"):
+                    edit_workout_form(workout)
+                if st.toggle("🕘 History", key=f"history_workout_{workout['id']}"):
+                    version_history(get_workout_versions(workout['id']))
                 
-                if st.button(f"Delete", key=f"delete_workout_{workout['id']}"):
-                    success, message = delete_workout(workout['id'])
+                col1, col2 = st.columns(2)
+                with col1:
+                    duplicate = st.button("📄 Duplicate", key=f"duplicate_workout_{workout['id']}")
+                with col2:
+                    archive = st.button("Archive", key=f"archive_workout_{workout['id']}")
+                if duplicate or archive:
+                    if duplicate:
+                        success, message = duplicate_workout(workout['id'], workout['title'])
+                    else:
+                        success, message = archive_workout(workout['id'])
                     if success:
                         st.success(message)
                         st.rerun()
                     else:
                         st.error(message)
-    else:
+    elif matches is not None:
+        st.info("No workouts use this exercise.")
+    elif get_page_cursor('workouts') is None:
         st.info("No workouts created yet. Create your first workout above!")
+    if matches is None:
+        pagination_controls('workouts', workouts)
+
+def version_history(versions):
+    """List the saved versions of a workout or meal plan"""
+    for v in versions:
+        st.write(f"**v{v['version']}** · {v['title']} · saved {str(v.get('created_at', ''))[:16].replace('T', ' ')}")
+
+def edit_workout_form(workout):
+    """Form that saves changes to a workout as its next version"""
+    workout_id = workout['id']
+    current = get_workout_exercises(workout_id)
+    with st.form(f"edit_workout_form_{workout_id}"):
+        title = st.text_input("Workout Title", value=workout['title'], key=f"edit_title_{workout_id}")
+        description = st.text_area("Description", value=workout.get('description') or '', key=f"edit_description_{workout_id}")
+        exercises = []
+        # Existing exercises plus one blank row to add another; clear a name to remove it
+        for i, ex in enumerate(current + [{}]):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                ex_name = st.text_input("Exercise name", value=ex.get('name', ''), key=f"edit_ex_name_{workout_id}_{i}")
+            with col2:
+                ex_sets = st.text_input("Sets/Duration", value=ex.get('sets', ''), key=f"edit_ex_sets_{workout_id}_{i}")
+            with col3:
+                ex_reps = st.text_input("Reps/Notes", value=ex.get('reps', ''), key=f"edit_ex_reps_{workout_id}_{i}")
+            if ex_name:
+                exercises.append({"name": ex_name, "sets": ex_sets, "reps": ex_reps})
+        
+        if st.form_submit_button("Save Changes"):
+            if title and exercises:
+                success, message = update_workout(workout_id, title, description, exercises)
+                if success:
+                    st.success(message)
+                    st.rerun()
+                else:
+                    st.error(message)
+            else:
+                st.error("Please provide a title and at least one exercise")
+
+def edit_meal_plan_form(plan):
+    """Form that saves changes to a meal plan as its next version"""
+    plan_id = plan['id']
+    current = get_meal_plan_meals(plan_id)
+    with st.form(f"edit_meal_form_{plan_id}"):
+        title = st.text_input("Meal Plan Title", value=plan['title'], key=f"edit_meal_title_{plan_id}")
+        description = st.text_area("Description", value=plan.get('description') or '', key=f"edit_meal_description_{plan_id}")
+        meals = []
+        # Existing meals plus one blank row to add another; clear a name to remove it
+        for i, meal in enumerate(current + [{}]):
+            col1, col2 = st.columns(2)
+            with col1:
+                meal_name = st.text_input("Meal name", value=meal.get('name', ''), key=f"edit_meal_name_{plan_id}_{i}")
+            with col2:
+                meal_time = st.text_input("Time", value=meal.get('time', ''), key=f"edit_meal_time_{plan_id}_{i}")
+            meal_items = st.text_area("Items/Instructions", value=meal.get('items', ''), key=f"edit_meal_items_{plan_id}_{i}")
+            if meal_name:
+                meals.append({"name": meal_name, "time": meal_time, "items": meal_items})
+        
+        if st.form_submit_button("Save Changes"):
+            if title and meals:
+                success, message = update_meal_plan(plan_id, title, description, meals)
+                if success:
+                    st.success(message)
+                    st.rerun()
+                else:
+                    st.error(message)
+            else:
+                st.error("Please provide a title and at least one meal")
 
 def meal_plan_management_page():
     """Meal plan management page for trainers"""
@@ -410,6 +1179,7 @@ def meal_plan_management_page():
     
     # Create new meal plan
     with st.expander("➕ Create New Meal Plan", expanded=False):
+        catalog_hint('food', "🔎 Look up a meal")
         with st.form("create_meal_form"):
             title = st.text_input("Meal Plan Title")
             description = st.text_area("Description")
@@ -441,6 +1211,7 @@ def meal_plan_management_page():
                     success, message = create_meal_plan(title, description, meals)
                     if success:
                         st.success(message)
+                        reset_page_cursor('meal_plans')
                         st.rerun()
                     else:
                         st.error(message)
@@ -449,41 +1220,73 @@ def meal_plan_management_page():
     
     # Display existing meal plans
     st.subheader("Existing Meal Plans")
-    meal_plans = get_meal_plans()
+    matches = catalog_filter('meal_plans', "🔎 Find meal plans by meal")
+    if matches is None:
+        meal_plans = get_meal_plans(after=get_page_cursor('meal_plans'), limit=PAGE_SIZE + 1)
+        shown = meal_plans[:PAGE_SIZE]
+    else:
+        shown = matches
     
-    if meal_plans:
-        for plan in meal_plans:
+    if shown:
+        for plan in shown:
             with st.expander(f"🍽️ {plan['title']}"):
+                st.caption(f"Version {plan.get('version', 1)}")
                 st.write(f"**Description:** {plan.get('description', 'N/A')}")
-                st.write("**Meals:**")
-                meals = plan.get('meals', [])
-                for i, meal in enumerate(meals, 1):
-                    st.write(f"{i}. **{meal.get('name', 'N/A')}** ({meal.get('time', 'N/A')})")
-                    st.write(f"   {meal.get('items', 'N/A')}")
+                if st.toggle("Show meals", key=f"show_meals_{plan['id']}"):
+                    template_details('meal_plans', plan['id'], plan.get('version'), lambda: expand_names(
+                        'meal_plans', repo.get_template_body('meal_plans', plan['id'], plan.get('version'))
+                    ))
+                if st.toggle("✏️ Edit", key=f"edit_meal_{plan['id']}"):
+                    edit_meal_plan_form(plan)
+                if st.toggle("🕘 History", key=f"history_meal_{plan['id']}"):
+                    version_history(get_meal_plan_versions(plan['id']))
                 
-                if st.button(f"Delete", key=f"delete_meal_{plan['id']}"):
-                    success, message = delete_meal_plan(plan['id'])
+                col1, col2 = st.columns(2)
+                with col1:
+                    duplicate = st.button("📄 Duplicate", key=f"duplicate_meal_{plan['id']}")
+                with col2:
+                    archive = st.button("Archive", key=f"archive_meal_{plan['id']}")
+                if duplicate or archive:
+                    if duplicate:
+                        success, message = duplicate_meal_plan(plan['id'], plan['title'])
+                    else:
+                        success, message = archive_meal_plan(plan['id'])
                     if success:
                         st.success(message)
                         st.rerun()
                     else:
                         st.error(message)
-    else:
+    elif matches is not None:
+        st.info("No meal plans use this meal.")
+    elif get_page_cursor('meal_plans') is None:
         st.info("No meal plans created yet. Create your first meal plan above!")
+    if matches is None:
+        pagination_controls('meal_plans', meal_plans)
 
 def assignment_page():
     """Assignment page for trainers to assign workouts and meal plans to clients"""
     st.header("📅 Assign to Clients")
     
-    clients = get_clients()
-    workouts = get_workouts()
-    meal_plans = get_meal_plans()
+    # The reads below do not depend on each other, so fetch them together.
+    # The client lists are the ones each tab's search box will ask for, which
+    # leaves client_search() a query cache hit.
+    searches = {
+        (st.session_state.get(f"{key}_search", '').strip().lower(), limit)
+        for key, limit in (("workout_client", CLIENT_SEARCH_LIMIT), ("meal_client", CLIENT_SEARCH_LIMIT),
+                           ("bulk_client", BULK_CLIENT_LIMIT))
+    }
+    workouts, meal_plans, any_clients, *_ = fetch_all(
+        get_workouts,
+        get_meal_plans,
+        lambda: get_clients(limit=1),
+        *(lambda search=search, limit=limit: get_clients(search, limit) for search, limit in searches)
+    )
     
-    if not clients:
+    if not any_clients:
         st.warning("No clients registered yet.")
         return
     
-    tab1, tab2 = st.tabs(["Assign Workout", "Assign Meal Plan"])
+    tab1, tab2, tab3 = st.tabs(["Assign Workout", "Assign Meal Plan", "Bulk Schedule"])
     
     with tab1:
         st.subheader("Assign Workout to Client")
@@ -491,27 +1294,29 @@ def assignment_page():
         if not workouts:
             st.info("No workouts available. Create workouts first!")
         else:
-            with st.form("assign_workout_form"):
-                client = st.selectbox(
-                    "Select Client",
-                    options=clients,
-                    format_func=lambda x: f"{x.get('full_name', 'N/A')} ({x.get('email', 'N/A')})"
-                )
-                workout = st.selectbox(
-                    "Select Workout",
-                    options=workouts,
-                    format_func=lambda x: x.get('title', 'N/A')
-                )
-                assigned_date = st.date_input("Date", value=date.today())
-                
-                submit = st.form_submit_button("Assign Workout")
-                
-                if submit and client and workout:
-                    success, message = assign_workout(workout['id'], client['id'], assigned_date)
-                    if success:
-                        st.success(message)
-                    else:
-                        st.error(message)
+            clients = client_search("workout_client")
+            if clients:
+                with st.form("assign_workout_form"):
+                    client = st.selectbox(
+                        "Select Client",
+                        options=clients,
+                        format_func=lambda x: f"{x.get('full_name', 'N/A')} ({x.get('email', 'N/A')})"
+                    )
+                    workout = st.selectbox(
+                        "Select Workout",
+                        options=workouts,
+                        format_func=lambda x: x.get('title', 'N/A')
+                    )
+                    assigned_date = st.date_input("Date", value=date.today())
+                    
+                    submit = st.form_submit_button("Assign Workout")
+                    
+                    if submit and client and workout:
+                        success, message = assign_workout(workout['id'], client['id'], assigned_date)
+                        if success:
+                            st.success(message)
+                        else:
+                            st.error(message)
     
     with tab2:
         st.subheader("Assign Meal Plan to Client")
@@ -519,63 +1324,294 @@ def assignment_page():
         if not meal_plans:
             st.info("No meal plans available. Create meal plans first!")
         else:
-            with st.form("assign_meal_form"):
-                client = st.selectbox(
-                    "Select Client",
-                    options=clients,
-                    format_func=lambda x: f"{x.get('full_name', 'N/A')} ({x.get('email', 'N/A')})",
-                    key="meal_client_select"
-                )
-                meal_plan = st.selectbox(
-                    "Select Meal Plan",
-                    options=meal_plans,
-                    format_func=lambda x: x.get('title', 'N/A')
+            clients = client_search("meal_client")
+            if clients:
+                with st.form("assign_meal_form"):
+                    client = st.selectbox(
+                        "Select Client",
+                        options=clients,
+                        format_func=lambda x: f"{x.get('full_name', 'N/A')} ({x.get('email', 'N/A')})",
+                        key="meal_client_select"
+                    )
+                    meal_plan = st.selectbox(
+                        "Select Meal Plan",
+                        options=meal_plans,
+                        format_func=lambda x: x.get('title', 'N/A')
+                    )
+                    assigned_date = st.date_input("Date", value=date.today(), key="meal_date_input")
+                    
+                    submit = st.form_submit_button("Assign Meal Plan")
+                    
+                    if submit and client and meal_plan:
+                        success, message = assign_meal_plan(meal_plan['id'], client['id'], assigned_date)
+                        if success:
+                            st.success(message)
+                        else:
+                            st.error(message)
+    
+    with tab3:
+        st.subheader("Schedule a Program for Many Clients")
+        
+        kind = st.radio("Assign", ["Workout", "Meal Plan"], horizontal=True, key="bulk_kind")
+        templates = workouts if kind == "Workout" else meal_plans
+        
+        if not templates:
+            st.info(f"No {kind.lower()}s available. Create one first!")
+        else:
+            # The options follow the search box, so the clients picked so far
+            # are kept in session state and offered alongside each search's
+            # matches; a cohort can be built up over several searches.
+            cohort = st.session_state.bulk_cohort
+            clients = client_search("bulk_client", limit=BULK_CLIENT_LIMIT)
+            known = {**cohort, **{c['id']: c for c in clients}}
+            
+            def keep_cohort():
+                st.session_state.bulk_cohort = {i: known[i] for i in st.session_state.bulk_clients}
+            
+            if known:
+                selected_ids = st.multiselect(
+                    "Select Clients",
+                    options=list(known),
+                    default=list(cohort),
+                    format_func=lambda i: f"{known[i].get('full_name', 'N/A')} ({known[i].get('email', 'N/A')})",
+                    key="bulk_clients",
+                    on_change=keep_cohort
                 )
-                assigned_date = st.date_input("Date", value=date.today(), key="meal_date_input")
-                
-                submit = st.form_submit_button("Assign Meal Plan")
-                
-                if submit and client and meal_plan:
-                    success, message = assign_meal_plan(meal_plan['id'], client['id'], assigned_date)
-                    if success:
-                        st.success(message)
-                    else:
-                        st.error(message)
+                st.caption(f"{len(selected_ids)} client(s) selected")
+                with st.form("bulk_assign_form"):
+                    template = st.selectbox(
+                        f"Select {kind}",
+                        options=templates,
+                        format_func=lambda x: x.get('title', 'N/A')
+                    )
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        start_date = st.date_input("Start date", value=date.today(), key="bulk_start_date")
+                    with col2:
+                        end_date = st.date_input("End date", value=date.today(), key="bulk_end_date")
+                    weekdays = st.multiselect("Repeat on", options=WEEKDAYS, default=["Mon", "Wed", "Fri"])
+                    
+                    submit = st.form_submit_button("Schedule")
+                    
+                    if submit:
+                        if not selected_ids or not weekdays:
+                            st.error("Please select at least one client and one weekday")
+                        elif end_date < start_date:
+                            st.error("End date must be on or after the start date")
+                        else:
+                            client_ids = list(selected_ids)
+                            if kind == "Workout":
+                                success, message = bulk_assign_workout(template['id'], client_ids, start_date, end_date, weekdays)
+                            else:
+                                success, message = bulk_assign_meal_plan(template['id'], client_ids, start_date, end_date, weekdays)
+                            if success:
+                                st.success(message)
+                            else:
+                                st.error(message)
+
+def adherence_page():
+    """Client adherence page for trainers"""
+    st.header("📈 Client Adherence")
+    
+    weeks = st.selectbox(
+        "Period",
+        ADHERENCE_PERIODS,
+        index=1,
+        format_func=lambda w: f"Last {w} weeks"
+    )
+    frame = adherence_frame(get_adherence(weeks))
+    if frame.empty:
+        st.info("No assignments in this period yet.")
+        return
+    
+    def percent(value):
+        return "–" if value is None else f"{value:.0f}%"
+    
+    totals = overall(frame)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Overall completion", percent(totals['all']))
+    col2.metric("Workouts", percent(totals.get('workout')))
+    col3.metric("Meal plans", percent(totals.get('meal')))
+    
+    st.subheader("By week")
+    st.line_chart(by_week(frame))
+    
+    percent_column = st.column_config.ProgressColumn("Completion", format="%.0f%%", min_value=0, max_value=100)
+    
+    st.subheader("By client")
+    st.dataframe(
+        by_client(frame)[['name', 'assigned', 'completed', 'completion_pct']],
+        column_config={
+            'name': "Client",
+            'assigned': "Assigned",
+            'completed': "Completed",
+            'completion_pct': percent_column
+        },
+        hide_index=True,
+        use_container_width=True
+    )
+    
+    st.subheader("By workout and meal plan")
+    st.dataframe(
+        by_template(frame)[['name', 'kind', 'assigned', 'completed', 'completion_pct']],
+        column_config={
+            'name': "Template",
+            'kind': "Type",
+            'assigned': "Assigned",
+            'completed': "Completed",
+            'completion_pct': percent_column
+        },
+        hide_index=True,
+        use_container_width=True
+    )
+
+def import_page():
+    """Page for trainers to load workouts, meal plans and schedules from files"""
+    st.header("📥 Import")
+    
+    what = st.radio("What to import", list(IMPORT_TABLES), horizontal=True)
+    table = IMPORT_TABLES[what]
+    st.caption(f"CSV columns: {', '.join(import_columns(table))}")
+    if table in TEMPLATE_BODIES:
+        st.caption(
+            f"Put each {import_columns(table)[2]} on its own row; rows with the same or a blank title "
+            f"continue the template above. JSON files hold one object per line (or an array) with "
+            f"title, description and a list of {TEMPLATE_BODIES[table]}."
+        )
+    else:
+        st.caption("Clients are matched by email and templates by title; dates are YYYY-MM-DD. "
+                   "JSON files hold one object per line (or an array) with the same fields.")
+    
+    uploaded_file = st.file_uploader("CSV or JSON file", type=['csv', 'json', 'jsonl'], key=f"import_{table}")
+    if uploaded_file is not None and st.button("📥 Import", key="import_start"):
+        bar = st.progress(0.0, text="Importing...")
+        success, result = import_file(table, uploaded_file, lambda fraction: bar.progress(fraction, text="Importing..."))
+        bar.empty()
+        if not success:
+            st.error(result)
+            return
+        message = f"Imported {result['imported']} {what.lower() if table in TEMPLATE_BODIES else 'assignments'}"
+        if result['skipped']:
+            message += f", {result['skipped']} already scheduled"
+        st.success(message)
+        if result['errors']:
+            st.warning(f"{len(result['errors'])} row(s) could not be imported:")
+            st.dataframe(result['errors'], hide_index=True, use_container_width=True)
+
+def export_page():
+    """Page for trainers to download a client's history"""
+    st.header("📤 Export Client History")
+    st.caption("Every workout and meal plan you assigned to the client, oldest first, with completion.")
+    
+    clients = client_search("export_client")
+    if clients:
+        client = st.selectbox(
+            "Select Client",
+            options=clients,
+            format_func=lambda x: f"{x.get('full_name', 'N/A')} ({x.get('email', 'N/A')})",
+            key="export_client"
+        )
+        history_export(client, "trainer_export")
+
+def history_export(client, key):
+    """Format picker, export button and download for one client's history"""
+    fmt = st.radio("Format", list(EXPORT_FORMATS), horizontal=True, key=f"{key}_format")
+    if not st.button("📤 Prepare export", key=f"{key}_prepare"):
+        return
+    
+    with st.spinner("Exporting history..."):
+        success, result = export_history(client['id'], fmt)
+    if not success:
+        st.error(result)
+        return
+    # The file is only rendered into this run's button, never kept in
+    # session state: Streamlit keeps a download's file for one run after
+    # its button is gone, long enough for the click (and its rerun) to
+    # fetch it, and then drops it.
+    file_name = export_file_name(client.get('full_name') or '', fmt, date.today())
+    st.download_button(
+        f"⬇️ Download {file_name}",
+        data=result,
+        file_name=file_name,
+        mime=EXPORT_FORMATS[fmt][1],
+        key=f"{key}_download"
+    )
 
 def client_dashboard():
     """Display client dashboard"""
     st.title(f"👋 Welcome, {st.session_state.profile.get('full_name', 'Client')}")
     
-    if st.sidebar.button("Logout"):
-        sign_out()
+    if st.sidebar.button("Logout") and sign_out():
         st.rerun()
     
+    view = st.sidebar.radio("View", ["Today", "Calendar"])
+    refresh = st.sidebar.button("🔄 Refresh")
+    with st.sidebar.expander("📤 Export my history"):
+        history_export({'id': st.session_state.user.id, **st.session_state.profile}, "client_export")
+    if refresh:
+        st.session_state.schedule.clear()
+    else:
+        # Changes to the client's assignments since the last rerun; see db/changes.py
+        follow_changes()
+    pending = st.session_state.pending_completions
+    
+    if view == "Calendar":
+        schedule_calendar(pending)
+    else:
+        today_checklist(pending, refresh)
+    
+    # Toggles are saved in batches; see db/completions.py
+    if pending.due():
+        flush_completions()
+    elif pending:
+        # Rerun when they fall due even if the client does nothing more
+        wake = session_waker()
+        if wake is not None:
+            pending.flush_later(wake, completion_writer())
+    if pending:
+        st.caption(f"{len(pending)} change(s) not saved yet")
+        if st.button("💾 Save progress"):
+            flush_completions()
+            st.rerun()
+
+def today_checklist(pending, refresh):
+    """Today's workouts and meal plans with completion checkboxes"""
     st.header("📅 Today's Checklist")
     st.write(f"**Date:** {date.today().strftime('%A, %B %d, %Y')}")
     
-    workout_assignments, meal_assignments = get_today_assignments()
+    workout_assignments, meal_assignments = get_today_assignments(refresh=refresh)
+    # Names for both lists at once; items already rendered need none
+    prefetch_names([
+        (details_key(table, a.get(column), a.get('version'), True), table, (a.get(table) or {}).get(body))
+        for assignments, table, column, body in (
+            (workout_assignments, 'workouts', 'workout_id', 'exercises'),
+            (meal_assignments, 'meal_plans', 'meal_plan_id', 'meals')
+        )
+        for a in assignments
+    ])
     
     # Display workouts
     st.subheader("💪 Workouts")
     if workout_assignments:
         for assignment in workout_assignments:
             workout = assignment.get('workouts', {})
-            with st.expander(f"{'✅' if assignment.get('completed') else '⬜'} {workout.get('title', 'N/A')}", expanded=not assignment.get('completed')):
-                st.write(f"**Description:** {workout.get('description', 'N/A')}")
-                st.write("**Exercises:**")
-                exercises = workout.get('exercises', [])
-                for i, ex in enumerate(exercises, 1):
-                    st.write(f"{i}. {ex.get('name', 'N/A')} - {ex.get('sets', 'N/A')} sets x {ex.get('reps', 'N/A')} reps")
+            saved = assignment.get('completed', False)
+            done = pending.value('workout', assignment['id'], saved)
+            with st.expander(f"{'✅' if done else '⬜'} {workout.get('title', 'N/A')}", expanded=not done):
+                # The body is embedded; names are only looked up if this version is not rendered yet
+                template_details(
+                    'workouts', assignment.get('workout_id'), assignment.get('version'),
+                    lambda: expand_names('workouts', workout.get('exercises') or []),
+                    description=workout.get('description')
+                )
                 
-                completed = st.checkbox(
+                st.checkbox(
                     "Mark as complete",
-                    value=assignment.get('completed', False),
-                    key=f"workout_{assignment['id']}"
+                    value=done,
+                    key=f"workout_{assignment['id']}",
+                    on_change=record_completion,
+                    args=('workout', assignment['id'], saved)
                 )
-                
-                if completed != assignment.get('completed', False):
-                    if mark_workout_complete(assignment['id'], completed):
-                        st.rerun()
     else:
         st.info("No workouts assigned for today.")
     
@@ -584,48 +1620,161 @@ def client_dashboard():
     if meal_assignments:
         for assignment in meal_assignments:
             meal_plan = assignment.get('meal_plans', {})
-            with st.expander(f"{'✅' if assignment.get('completed') else '⬜'} {meal_plan.get('title', 'N/A')}", expanded=not assignment.get('completed')):
-                st.write(f"**Description:** {meal_plan.get('description', 'N/A')}")
-                st.write("**Meals:**")
-                meals = meal_plan.get('meals', [])
-                for i, meal in enumerate(meals, 1):
-                    st.write(f"{i}. **{meal.get('name', 'N/A')}** ({meal.get('time', 'N/A')})")
-                    st.write(f"   {meal.get('items', 'N/A')}")
+            saved = assignment.get('completed', False)
+            done = pending.value('meal', assignment['id'], saved)
+            with st.expander(f"{'✅' if done else '⬜'} {meal_plan.get('title', 'N/A')}", expanded=not done):
+                template_details(
+                    'meal_plans', assignment.get('meal_plan_id'), assignment.get('version'),
+                    lambda: expand_names('meal_plans', meal_plan.get('meals') or []),
+                    description=meal_plan.get('description')
+                )
                 
-                completed = st.checkbox(
+                st.checkbox(
                     "Mark as complete",
-                    value=assignment.get('completed', False),
-                    key=f"meal_{assignment['id']}"
+                    value=done,
+                    key=f"meal_{assignment['id']}",
+                    on_change=record_completion,
+                    args=('meal', assignment['id'], saved)
                 )
-                
-                if completed != assignment.get('completed', False):
-                    if mark_meal_complete(assignment['id'], completed):
-                        st.rerun()
     else:
         st.info("No meal plans assigned for today.")
 
+def schedule_calendar(pending):
+    """Week or month calendar of the client's assignments"""
+    st.header("🗓️ My Schedule")
+    
+    col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
+    with col1:
+        view = st.radio("Show", VIEWS, horizontal=True, key="schedule_view")
+    if 'schedule_anchor' not in st.session_state:
+        st.session_state.schedule_anchor = date.today()
+    start, end = window(view, st.session_state.schedule_anchor)
+    with col2:
+        if st.button("◀ Previous"):
+            start, end = previous_window(view, start)
+    with col3:
+        if st.button("Today"):
+            start, end = window(view, date.today())
+    with col4:
+        if st.button("Next ▶"):
+            start, end = next_window(view, start)
+    # A week's Thursday decides its month (as in ISO weeks) when switching views
+    st.session_state.schedule_anchor = start + timedelta(days=3) if view == "Week" else start
+    
+    workouts, meals = get_schedule(start, end)
+    days = group_by_day(workouts, meals)
+    
+    st.write(f"**{start.strftime('%B %d')} – {end.strftime('%B %d, %Y')}**")
+    
+    # Calendar grid, one row per week
+    first_monday = start - timedelta(days=start.weekday())
+    week_starts = range(0, (end - first_monday).days + 1, 7)
+    for header, column in zip(WEEKDAYS, st.columns(7)):
+        column.markdown(f"**{header}**")
+    for offset in week_starts:
+        for weekday, column in enumerate(st.columns(7)):
+            day = first_monday + timedelta(days=offset + weekday)
+            if day < start or day > end:
+                continue
+            with column:
+                label = f"**{day.day}**" if day == date.today() else str(day.day)
+                st.markdown(label)
+                entries = days.get(day.isoformat(), {'workouts': [], 'meals': []})
+                for kind, rows, embed, icon in (
+                    ('workout', entries['workouts'], 'workouts', '💪'),
+                    ('meal', entries['meals'], 'meal_plans', '🍽️')
+                ):
+                    for row in rows:
+                        done = pending.value(kind, row['id'], row.get('completed', False))
+                        title = (row.get(embed) or {}).get('title', 'N/A')
+                        st.caption(f"{'✅' if done else '⬜'} {icon} {title}")
+    
+    # Details of one day, with template bodies loaded on demand
+    scheduled = {date.fromisoformat(d).strftime('%A, %B %d'): d for d in sorted(days)}
+    if scheduled:
+        selected = scheduled[st.selectbox("Day details", list(scheduled))]
+        for row in days[selected]['workouts']:
+            workout = row.get('workouts') or {}
+            with st.expander(f"💪 {workout.get('title', 'N/A')}"):
+                template_details(
+                    'workouts', row['workout_id'], row.get('version'),
+                    lambda: expand_names('workouts', repo.get_template_body('workouts', row['workout_id'], row.get('version'))),
+                    description=workout.get('description')
+                )
+        for row in days[selected]['meals']:
+            meal_plan = row.get('meal_plans') or {}
+            with st.expander(f"🍽️ {meal_plan.get('title', 'N/A')}"):
+                template_details(
+                    'meal_plans', row['meal_plan_id'], row.get('version'),
+                    lambda: expand_names('meal_plans', repo.get_template_body('meal_plans', row['meal_plan_id'], row.get('version'))),
+                    description=meal_plan.get('description')
+                )
+    else:
+        st.info("Nothing scheduled in this period.")
+    
+    # Paging forward is the common move, so have the next window ready
+    prefetch_schedule(*next_window(view, start))
+
 # Main app
 def main():
     """Main application entry point"""
     if not st.session_state.user:
         login_page()
     else:
-        # Check if we have profile data
-        if not st.session_state.profile:
+        connect()
+        if not refresh_session():
+            sign_out(force=True)
+            login_page()
+            st.info("Your session has expired. Please sign in again.")
+            return
+        # The profile is loaded at sign in; try again if that failed
+        if not st.session_state.profile and not load_profile():
             st.error("Error loading profile. Please try logging in again.")
-            sign_out()
+            sign_out(force=True)
             st.rerun()
             return
         
         # Route based on user role
         role = st.session_state.profile.get('role')
+        annotate(role=role)
         if role == 'trainer':
             trainer_dashboard()
         elif role == 'client':
             client_dashboard()
         else:
             st.error("Invalid user role")
-            sign_out()
+            sign_out(force=True)
+
+def trace_panel(trace):
+    """Sidebar panel with the span tree of this rerun"""
+    requests = trace.requests()
+    label = f"📡 {len(requests)} requests, {trace.root.duration_ms:.0f} ms"
+    with st.sidebar.expander(label, expanded=True):
+        lines = []
+        for depth, span in trace.walk():
+            attributes = span.attributes
+            details = [f"{span.duration_ms:.1f} ms"]
+            if 'http.status' in attributes:
+                details.append(str(attributes['http.status']))
+            if attributes.get('rows') is not None:
+                details.append(f"{attributes['rows']} rows")
+            if 'bytes' in attributes:
+                details.append(f"{attributes['bytes']} B")
+            lines.append(f"{'  ' * depth}{span.name} ({', '.join(details)})")
+            if attributes.get('query'):
+                lines.append(f"{'  ' * (depth + 1)}?{attributes['query']}")
+        st.code("\n".join(lines), language=None)
 
 if __name__ == "__main__":
-    main()
+    if TRACE_EXPORT or st.session_state.get('show_trace'):
+        with trace_rerun() as trace:
+            try:
+                main()
+            finally:
+                if TRACE_EXPORT:
+                    export_trace(trace, TRACE_EXPORT, TRACE_FORMAT)
+        if st.session_state.get('show_trace'):
+            trace_panel(trace)
+    else:
+        main()
+    st.sidebar.toggle("🔍 Show request trace", key="show_trace")
@@ -0,0 +1 @@
+"""Performance checks for the Personal Trainer App"""
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Latency, round-trip and payload benchmarks for the data functions and pages
+
+Seeds a SQLite stand-in for the Supabase database (db/sqlite_repository.py)
+at a configurable scale, then measures:
+
+- the repository calls behind get_workouts, get_workout_exercises (and
+  the exercise filter), get_clients,
+  get_today_assignments, get_schedule, get_adherence, assign_workout and
+  the completion toggles
+- full trainer_dashboard / client_dashboard renders through Streamlit's
+  AppTest harness, cold (empty caches) and warm (rerun in the same session)
+
+Every repository call counts as one round-trip, which is what each call
+costs against Supabase. Page renders also report waits: the round-trips
+left once the loaders of each fetch_all run side by side (see
+db/fetch.py), i.e. how many network latencies a rerun sits through. To
+make that visible against a local database, every call in a page render
+is delayed by --rtt-ms. Payload bytes are the JSON size of the arguments
+plus the returned rows. Results are compared with the entry for the chosen
+--scale in benchmarks/app_baseline.json and the script fails if round-trips
+or waits grow, payloads grow by more than PAYLOAD_TOLERANCE or p95 latency
+grows by more than LATENCY_TOLERANCE. Latencies depend on the machine, so refresh the
+baseline with --update-baseline where the check runs.
+
+Usage:
+    python benchmarks/app_bench.py [--scale small|full] [--db PATH] [--rtt-ms MS] [--update-baseline]
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import local_script_runner
+
+from db import sqlite_repository
+from db.adherence import ADHERENCE_PERIODS, adherence_window
+from db.catalog import CATALOG_KINDS, catalog_key, reference_body
+from db.completions import MAX_PENDING
+from db.fetch import current_loader
+from db.pagination import PAGE_SIZE
+from db.records import Profile, User
+from db.schedule import window
+from db.search import CLIENT_SEARCH_LIMIT
+from db.sqlite_repository import SQLiteRepository
+
+APP_PATH = os.path.join(ROOT, 'app.py')
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'app_baseline.json')
+
+# 'full' is the production-sized target; 'small' keeps a local run under a minute
+SCALES = {
+    'small': {'trainers': 20, 'clients': 2000, 'assignments': 120000},
+    'full': {'trainers': 1000, 'clients': 100000, 'assignments': 10000000},
+}
+TEMPLATES_PER_TRAINER = 25
+SEED_BATCH_SIZE = 50000
+
+# Allowed growth over the baseline before the check fails
+LATENCY_TOLERANCE = 0.5
+LATENCY_FLOOR_MS = 1.0
+PAYLOAD_TOLERANCE = 0.1
+
+# Seeded rows get predictable UUIDs: kind in the high bits, number in the low
+PROFILE, WORKOUT, MEAL_PLAN, WORKOUT_ASSIGNMENT, MEAL_ASSIGNMENT = range(1, 6)
+
+
+def seed_id(kind, n):
+    """Deterministic UUID text for the nth seeded row of a kind"""
+    return str(uuid.UUID(int=(kind << 96) | n))
+
+
+def trainer_id(n):
+    return seed_id(PROFILE, n)
+
+
+def client_id(n, sizes):
+    return seed_id(PROFILE, sizes['trainers'] + n)
+
+
+def timestamp(seconds_ago):
+    """Fixed-width ISO timestamp, matching db.sqlite_repository.now_iso()"""
+    moment = datetime(2024, 1, 1, tzinfo=timezone.utc) - timedelta(seconds=seconds_ago)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%f+00:00')
+
+
+def seeded_days(sizes):
+    """Days of history per client needed for the requested assignment count"""
+    return max(1, sizes['assignments'] // (2 * sizes['clients']))
+
+
+def seed(repo, sizes):
+    """Fill an empty repository; returns False if it already holds these sizes
+
+    Client n is looked after by trainer n % trainers and gets one workout and
+    one meal plan from that trainer on each of the last `days` days, so
+    assignments = clients * days * 2.
+    """
+    connection = repo.connection
+    connection.execute("CREATE TABLE IF NOT EXISTS benchmark_meta (sizes TEXT)")
+    row = connection.execute("SELECT sizes FROM benchmark_meta").fetchone()
+    if row is not None:
+        if json.loads(row[0]) != sizes:
+            raise SystemExit("✗ --db was seeded with different sizes; use a new file")
+        return False
+
+    n_trainers, n_clients = sizes['trainers'], sizes['clients']
+    days = seeded_days(sizes)
+    today = date.today()
+    created = timestamp(0)
+
+    def chunks(rows):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == SEED_BATCH_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def insert(sql, rows):
+        for chunk in chunks(rows):
+            connection.executemany(sql, chunk)
+
+    def template_number(trainer, k):
+        return trainer * TEMPLATES_PER_TRAINER + k
+
+    with connection:
+        insert(
+            "INSERT INTO profiles (id, email, full_name, role, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            ((trainer_id(n), f"trainer{n}@example.com", f"Trainer {n}", 'trainer', created, created)
+             for n in range(n_trainers))
+        )
+        insert(
+            "INSERT INTO profiles (id, email, full_name, role, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            ((client_id(n, sizes), f"client{n}@example.com", f"Client {n}", 'client', created, created)
+             for n in range(n_clients))
+        )
+        for table, kind, column, body in (
+            ('workouts', WORKOUT, 'exercises', [
+                {'name': name, 'sets': '3', 'reps': '10'}
+                for name in ('Squat', 'Bench press', 'Deadlift', 'Overhead press', 'Barbell row')
+            ]),
+            ('meal_plans', MEAL_PLAN, 'meals', [
+                {'name': name, 'time': '8:00', 'items': 'Oats'}
+                for name in ('Breakfast', 'Lunch', 'Dinner', 'Snack')
+            ]),
+        ):
+            catalog_kind = CATALOG_KINDS[table][0]
+            items = [
+                dict(zip(('id', 'kind', 'name'), connection.execute(
+                    "INSERT INTO catalog_items (kind, name, name_key, created_at) VALUES (?, ?, ?, ?) "
+                    "RETURNING id, kind, name",
+                    (catalog_kind, entry['name'], catalog_key(entry['name']), created)
+                ).fetchone()))
+                for entry in body
+            ]
+            body = json.dumps(reference_body(table, body, items))
+            insert(
+                f"INSERT INTO {table} (id, trainer_id, title, description, {column}, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((seed_id(kind, template_number(t, k)), trainer_id(t), f"{table} {k}", 'Seeded template',
+                  body, timestamp(k), timestamp(k))
+                 for t in range(n_trainers) for k in range(TEMPLATES_PER_TRAINER))
+            )
+        for table, kind, column, template_kind in (
+            ('workout_assignments', WORKOUT_ASSIGNMENT, 'workout_id', WORKOUT),
+            ('meal_assignments', MEAL_ASSIGNMENT, 'meal_plan_id', MEAL_PLAN),
+        ):
+            insert(
+                f"INSERT INTO {table} (id, {column}, client_id, assigned_date, created_at) VALUES (?, ?, ?, ?, ?)",
+                ((seed_id(kind, n * days + d),
+                  seed_id(template_kind, template_number(n % n_trainers, d % TEMPLATES_PER_TRAINER)),
+                  client_id(n, sizes), (today - timedelta(days=d)).isoformat(), created)
+                 for n in range(n_clients) for d in range(days))
+            )
+        connection.execute("INSERT INTO benchmark_meta (sizes) VALUES (?)", (json.dumps(sizes),))
+    connection.execute("ANALYZE")
+    return True
+
+
+def payload_size(*values):
+    """Bytes of the values serialised as JSON"""
+    return sum(len(json.dumps(value, default=str)) for value in values)
+
+
+class CountingRepository:
+    """Wraps a repository and records (method, start, end, bytes, loader) per call
+
+    loader is the (batch, index) of the fetch_all loader that made the
+    call (db.fetch.current_loader), or None outside fetch_all.
+
+    rtt seconds are slept before each call, outside the repository's lock,
+    standing in for the network round-trip.
+    """
+
+    def __init__(self, inner, rtt=0.0):
+        self.inner = inner
+        self.rtt = rtt
+        self.calls = []
+
+    def __getattr__(self, name):
+        attr = getattr(self.inner, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            if self.rtt:
+                time.sleep(self.rtt)
+            result = attr(*args, **kwargs)
+            self.calls.append((name, start, time.perf_counter(), payload_size([args, kwargs], result),
+                               current_loader.get()))
+            return result
+        return call
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def waits(calls):
+    """Number of round-trips left once the loaders of each fetch_all run side by side
+
+    Calls outside fetch_all are one wait each; a fetch_all batch costs as
+    many as its busiest loader. Counted from where calls were made rather
+    than when their threads got to run, so it does not vary between runs.
+    """
+    count, batches = 0, {}
+    for *_, loader in calls:
+        if loader is None:
+            count += 1
+        else:
+            batch, index = loader
+            per_loader = batches.setdefault(batch, {})
+            per_loader[index] = per_loader.get(index, 0) + 1
+    return count + sum(max(per_loader.values()) for per_loader in batches.values())
+
+
+def summarize(durations, calls, serial):
+    """Metrics for one benchmark from per-iteration seconds, recorded calls and waits"""
+    iterations = len(durations)
+    return {
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+        'round_trips': math.ceil(len(calls) / iterations),
+        'waits': math.ceil(sum(serial) / iterations),
+        'bytes': math.ceil(sum(call[3] for call in calls) / iterations)
+    }
+
+
+def measure(repo, iterations, action, prepare=None):
+    """Time action() iterations times and summarise the repository calls it made
+
+    As in timeit, garbage is collected before and not during each timed
+    call, so a collection of what earlier renders left behind does not land
+    in one sample's time.
+    """
+    durations = []
+    calls = []
+    serial = []
+    for i in range(iterations):
+        state = prepare(i) if prepare else None
+        repo.calls = []
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            action(i, state)
+            durations.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+        calls += repo.calls
+        serial.append(waits(repo.calls))
+    return summarize(durations, calls, serial)
+
+
+def data_benchmarks(repo, sizes, iterations):
+    """The repository calls each data function in app.py makes"""
+    trainer = trainer_id(0)
+    client = client_id(0, sizes)
+    today = date.today().isoformat()
+    far_future = date.today() + timedelta(days=3650)
+    # Client 0's workouts on the last MAX_PENDING days, one full flush batch
+    pending_ids = [seed_id(WORKOUT_ASSIGNMENT, d) for d in range(min(seeded_days(sizes), MAX_PENDING))]
+
+    def toggles(i):
+        return [{'id': id, 'completed': i % 2 == 0, 'completed_at': None} for id in pending_ids]
+
+    return {
+        'get_workouts': measure(repo, iterations, lambda i, _: repo.list_templates(
+            'workouts', trainer, limit=PAGE_SIZE + 1)),
+        'get_workout_exercises': measure(repo, iterations, lambda i, _: repo.get_template_body(
+            'workouts', seed_id(WORKOUT, 0))),
+        'get_workout_version': measure(repo, iterations, lambda i, _: repo.get_template_body(
+            'workouts', seed_id(WORKOUT, 0), 1)),
+        'get_workouts_by_exercise': measure(repo, iterations, lambda i, _: repo.templates_with_item(
+            'workouts', trainer, repo.inner.list_catalog('exercise')[0]['id'])),
+        'get_clients': measure(repo, iterations, lambda i, _: repo.search_clients(
+            '', CLIENT_SEARCH_LIMIT)),
+        'get_clients_search': measure(repo, iterations, lambda i, _: repo.search_clients(
+            "client 1", CLIENT_SEARCH_LIMIT)),
+        'get_today_assignments': measure(repo, iterations, lambda i, _: repo.get_checklist(
+            client, today)),
+        'get_schedule_month': measure(repo, iterations, lambda i, _: repo.get_schedule(
+            client, *(day.isoformat() for day in window('Month', date.today())))),
+        'get_adherence': measure(repo, iterations, lambda i, _: repo.get_adherence(
+            trainer, *adherence_window(date.today(), ADHERENCE_PERIODS[1]))),
+        'assign_workout': measure(repo, iterations, lambda i, _: repo.insert_assignment(
+            'workout_assignments', {
+                'workout_id': seed_id(WORKOUT, 0),
+                'client_id': client,
+                'assigned_date': (far_future + timedelta(days=i)).isoformat()
+            })),
+        'mark_workout_complete': measure(repo, iterations, lambda i, _: repo.set_completed(
+            'workout_assignments', pending_ids[0], i % 2 == 0, None)),
+        'flush_completions': measure(repo, iterations, lambda i, _: repo.set_completions(
+            workouts=toggles(i), meals=[])),
+    }
+
+
+def new_session(user_id, repo):
+    """An AppTest for app.py logged in as user_id"""
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.session_state.user = User(id=user_id, email='')
+    at.session_state.profile = Profile.from_row(repo.inner.get_profile(user_id))
+    return at
+
+
+def wait_for_script(runner, timeout=3):
+    """Wait for the script thread to exit; replaces AppTest's require_widgets_deltas
+
+    AppTest polls for a SCRIPT_STOPPED event in 100 ms sleeps, which would
+    round every page timing up to the next tick, and returns at the first
+    stop, which after st.rerun() is the stop *for* the rerun; reading the
+    run's results then races the rerun still executing on the script
+    thread. Joining the thread ends the wait as soon as the runs are done.
+    """
+    runner._script_thread.join(timeout)
+    if runner._script_thread.is_alive():
+        runner.request_stop()
+        runner.join()
+        raise RuntimeError(f"AppTest script run timed out after {timeout}s")
+
+
+def check_render(at):
+    if at.exception:
+        raise RuntimeError(f"app.py raised: {at.exception[0].value}")
+    return at
+
+
+def flip(at):
+    """Tick or untick the first checklist item, whichever changes it"""
+    checkbox = at.checkbox[0]
+    return check_render(checkbox.set_value(not checkbox.value).run())
+
+
+def save_button(at):
+    return next(button for button in at.button if button.label == "💾 Save progress")
+
+
+def page_benchmarks(repo, sizes, iterations):
+    """Full page renders through AppTest"""
+    trainer = trainer_id(0)
+    client = client_id(0, sizes)
+
+    def cold(user_id, page=None):
+        def prepare(i):
+            st.cache_resource.clear()
+            return new_session(user_id, repo)
+
+        def action(i, at):
+            check_render(at.run())
+            if page:
+                check_render(at.sidebar.radio[0].set_value(page).run())
+        return prepare, action
+
+    def warm(user_id):
+        at = check_render(new_session(user_id, repo).run())
+        return lambda i, _: check_render(at.run())
+
+    def toggle(i):
+        st.cache_resource.clear()
+        return check_render(new_session(client, repo).run())
+
+    def save(i):
+        return flip(toggle(i))
+
+    results = {}
+    prepare, action = cold(trainer)
+    results['trainer_dashboard_cold'] = measure(repo, iterations, action, prepare)
+    results['trainer_dashboard_warm'] = measure(repo, iterations, warm(trainer))
+    prepare, action = cold(trainer, 'Assign to Clients')
+    results['trainer_assign_page_cold'] = measure(repo, iterations, action, prepare)
+    prepare, action = cold(trainer, 'Adherence')
+    results['trainer_adherence_page_cold'] = measure(repo, iterations, action, prepare)
+    prepare, action = cold(client)
+    results['client_dashboard_cold'] = measure(repo, iterations, action, prepare)
+    results['client_dashboard_warm'] = measure(repo, iterations, warm(client))
+    prepare, action = cold(client, 'Calendar')
+    results['client_calendar_cold'] = measure(repo, iterations, action, prepare)
+    results['client_toggle'] = measure(
+        repo, iterations, lambda i, at: flip(at), toggle)
+    results['client_save'] = measure(
+        repo, iterations, lambda i, at: check_render(save_button(at).click().run()), save)
+    return results
+
+
+def compare(results, baseline):
+    """List the benchmarks that regressed against the baseline"""
+    failures = []
+    for name, metrics in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if metrics['round_trips'] > expected['round_trips']:
+            failures.append(f"{name}: {metrics['round_trips']} round-trips (baseline {expected['round_trips']})")
+        if metrics.get('waits', 0) > expected.get('waits', metrics.get('waits', 0)):
+            failures.append(f"{name}: {metrics['waits']} waits (baseline {expected['waits']})")
+        if metrics['bytes'] > expected['bytes'] * (1 + PAYLOAD_TOLERANCE):
+            failures.append(f"{name}: {metrics['bytes']} bytes (baseline {expected['bytes']})")
+        allowed = max(expected['p95_ms'] * (1 + LATENCY_TOLERANCE), expected['p95_ms'] + LATENCY_FLOOR_MS)
+        if metrics['p95_ms'] > allowed:
+            failures.append(f"{name}: p95 {metrics['p95_ms']} ms (baseline {expected['p95_ms']} ms)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--trainers', type=int, help="Override the scale's trainer count")
+    parser.add_argument('--clients', type=int, help="Override the scale's client count")
+    parser.add_argument('--assignments', type=int, help="Override the scale's assignment count")
+    parser.add_argument('--db', default=':memory:',
+                        help="SQLite file to seed (and reuse on later runs with the same sizes)")
+    parser.add_argument('--iterations', type=int, default=50, help="Samples per data function")
+    parser.add_argument('--page-iterations', type=int, default=10, help="Samples per page render")
+    parser.add_argument('--rtt-ms', type=float, default=5.0,
+                        help="Simulated network round-trip added to each call in page renders")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="Write the measured numbers to app_baseline.json")
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+
+    repo = CountingRepository(SQLiteRepository(args.db))
+    start = time.perf_counter()
+    if seed(repo.inner, sizes):
+        print(f"Seeded {sizes} in {time.perf_counter() - start:.1f}s")
+
+    results = data_benchmarks(repo, sizes, args.iterations)
+    os.environ['DATA_BACKEND'] = 'sqlite'
+    with mock.patch.object(sqlite_repository, 'get_sqlite_repository', lambda path: repo), \
+            mock.patch.object(local_script_runner, 'require_widgets_deltas', wait_for_script):
+        repo.rtt = args.rtt_ms / 1000
+        results.update(page_benchmarks(repo, sizes, args.page_iterations))
+        repo.rtt = 0.0
+
+    print(f"{'benchmark':<28} {'p50 ms':>9} {'p95 ms':>9} {'trips':>6} {'waits':>6} {'bytes':>9}")
+    for name, m in results.items():
+        print(f"{name:<28} {m['p50_ms']:>9} {m['p95_ms']:>9} {m['round_trips']:>6} {m['waits']:>6} {m['bytes']:>9}")
+
+    # One baseline per scale
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, 'r') as f:
+            baselines = json.load(f)
+
+    if args.update_baseline:
+        baselines[args.scale] = {'sizes': sizes, 'rtt_ms': args.rtt_ms, 'benchmarks': results}
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f"✓ Baseline for --scale {args.scale} written to {BASELINE_PATH}")
+        return 0
+
+    baseline = baselines.get(args.scale)
+    if baseline is None:
+        print(f"✗ No baseline for --scale {args.scale} yet; run with --update-baseline")
+        return 1
+    if baseline['sizes'] != sizes:
+        print("✗ Seed sizes differ from the baseline; drop the size overrides")
+        return 1
+    if baseline.get('rtt_ms', args.rtt_ms) != args.rtt_ms:
+        print(f"✗ The baseline was measured with --rtt-ms {baseline['rtt_ms']}")
+        return 1
+
+    failures = compare(results, baseline['benchmarks'])
+    for failure in failures:
+        print(f"✗ {failure}")
+    if not failures:
+        print("✓ Benchmarks within baseline")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
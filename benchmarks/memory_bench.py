@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Per-session memory of the rows a client session keeps
+
+A signed-in client's session holds its profile, today's checklist and the
+schedule windows the calendar has shown (see db/schedule.py) for as long
+as the tab is open. This seeds the SQLite backend (benchmarks/app_bench.py)
+with --sessions clients, each with two months of assignments from a
+handful of templates, loads that state for every client, as the repository
+returns it (dicts) and as the app keeps it (db/records.py), and reports
+the memory retained per session, measured with tracemalloc. The check
+fails if the records take more than --max-ratio of the dicts' memory.
+
+Usage:
+    python benchmarks/memory_bench.py [--sessions N] [--max-ratio R]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.app_bench import client_id, seed
+from db.records import Profile, assignment_records, interned_templates
+from db.schedule import window
+from db.sqlite_repository import SQLiteRepository
+
+TRAINERS = 20
+# Days of history per client: today's month and the one before
+DAYS = 60
+# Records may use at most this share of the dicts' memory
+MAX_RATIO = 0.5
+
+
+def sizes_for(sessions):
+    return {'trainers': TRAINERS, 'clients': sessions, 'assignments': sessions * DAYS * 2}
+
+
+def session_state(repo, user_id, as_records):
+    """What a client session holds after its dashboard and two months of calendar"""
+    today = date.today()
+    convert = assignment_records if as_records else lambda workouts, meals: (workouts, meals)
+    profile = repo.get_profile(user_id)
+    windows = {}
+    for start, end in (window('Month', today), window('Month', today.replace(day=1) - timedelta(days=1))):
+        windows[(start, end)] = convert(*repo.get_schedule(user_id, start.isoformat(), end.isoformat()))
+    workouts, meals = convert(*repo.get_checklist(user_id, today.isoformat()))
+    return {
+        'profile': Profile.from_row(profile) if as_records else profile,
+        'checklist': {'date': today.isoformat(), 'workouts': workouts, 'meals': meals},
+        'schedule': windows,
+    }
+
+
+def retained_bytes(repo, user_ids, as_records):
+    """(bytes still held after loading every session's state, templates interned meanwhile)"""
+    # Warm up the connection's statement cache outside the measurement
+    session_state(repo, user_ids[0], as_records)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # Held until measured, as open tabs hold them
+    sessions = [session_state(repo, user_id, as_records) for user_id in user_ids]
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return retained, interned_templates()
+
+
+def check(dicts, records, max_ratio):
+    """List the ways the records missed the target"""
+    if records > dicts * max_ratio:
+        return [f"records take {records / dicts:.0%} of the dicts' memory (target {max_ratio:.0%})"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--max-ratio', type=float, default=MAX_RATIO)
+    args = parser.parse_args()
+
+    sizes = sizes_for(args.sessions)
+    repo = SQLiteRepository()
+    seed(repo, sizes)
+    user_ids = [client_id(n, sizes) for n in range(args.sessions)]
+
+    dicts, _ = retained_bytes(repo, user_ids, as_records=False)
+    records, templates = retained_bytes(repo, user_ids, as_records=True)
+    dicts, records = dicts / args.sessions, records / args.sessions
+    print(f"{args.sessions} client sessions, per session: "
+          f"dicts {dicts / 1024:.1f} KiB, records {records / 1024:.1f} KiB "
+          f"({records / dicts - 1:+.0%}), {templates} templates interned")
+    failures = check(dicts, records, args.max_ratio)
+    for failure in failures:
+        print(f"✗ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✓ Session state within memory target")
+
+
+if __name__ == '__main__':
+    main()
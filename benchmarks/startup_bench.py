@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for the login page
+
+A new server process pays for app.py's imports on its first rerun, so on a
+freshly scaled-up container they are part of the first visitor's wait.
+This runs app.py once through Streamlit's AppTest harness in a fresh
+interpreter under `python -X importtime`, as that first anonymous visit
+would, and adds up the self time of every module the script imports
+beyond streamlit and the harness. The check fails if the total is over
+--budget-ms or if any of LAZY_MODULES was imported: the login page renders
+before any data client exists (see connect() in app.py), so the Supabase
+SDK stack must not load until someone signs in.
+
+Usage:
+    python benchmarks/startup_bench.py [--budget-ms MS] [--top N]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, 'app.py')
+
+# Import time app.py may add to the first rerun of a process
+IMPORT_BUDGET_MS = 100
+# Top-level packages only imported once a data client is needed
+LAZY_MODULES = ('supabase', 'gotrue', 'postgrest', 'realtime', 'storage3', 'supafunc', 'httpx', 'psycopg2', 'redis')
+# Title of login_page()
+LOGIN_TITLE = "💪 Personal Trainer App"
+# Written to stderr between the harness's imports and the app's
+MARKER = '-- app.py --'
+
+
+def parse_importtime(lines):
+    """(module, self us, cumulative us, depth) for each `-X importtime` line"""
+    modules = []
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            # The header line
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def app_imports(stderr):
+    """parse_importtime() of the lines after MARKER"""
+    lines = stderr.splitlines()
+    return parse_importtime(lines[lines.index(MARKER) + 1:] if MARKER in lines else lines)
+
+
+def run_child():
+    """Render the login page once and print what was loaded as JSON"""
+    from streamlit.testing.v1 import AppTest
+
+    # As under `streamlit run app.py`, the db package is imported from the app's directory
+    sys.path.insert(0, ROOT)
+    print(MARKER, file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    at = AppTest.from_file(APP_PATH, default_timeout=60).run()
+    render_ms = (time.perf_counter() - start) * 1000
+    print(json.dumps({
+        'render_ms': round(render_ms, 1),
+        'exception': at.exception[0].value if at.exception else None,
+        'titles': [title.value for title in at.title],
+        'lazy_loaded': sorted(name for name in LAZY_MODULES if name in sys.modules),
+    }))
+
+
+def measure():
+    """Run the child in a fresh interpreter; returns (result, app imports)"""
+    env = {**os.environ, 'DATA_BACKEND': 'supabase', 'PYTHONDONTWRITEBYTECODE': '1'}
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', __file__, '--child'],
+        capture_output=True, text=True, env=env, cwd=ROOT, check=True
+    )
+    return json.loads(process.stdout.splitlines()[-1]), app_imports(process.stderr)
+
+
+def check(result, modules, budget_ms):
+    """List the ways the login page broke the budget"""
+    failures = []
+    if result['exception']:
+        failures.append(f"app.py raised: {result['exception']}")
+    elif LOGIN_TITLE not in result['titles']:
+        failures.append("the login page was not rendered")
+    if result['lazy_loaded']:
+        failures.append(f"imported before sign in: {', '.join(result['lazy_loaded'])}")
+    total_ms = sum(self_us for _, self_us, _, _ in modules) / 1000
+    if total_ms > budget_ms:
+        failures.append(f"imports took {total_ms:.1f} ms (budget {budget_ms} ms)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--top', type=int, default=10, help="slowest top-level imports to list")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child()
+        return
+
+    result, modules = measure()
+    total_ms = sum(self_us for _, self_us, _, _ in modules) / 1000
+    print(f"login page: {result['render_ms']} ms first rerun, {total_ms:.1f} ms in {len(modules)} imports")
+    top_level = sorted((m for m in modules if m[3] == 0), key=lambda m: -m[2])
+    for name, _, cumulative_us, _ in top_level[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+    failures = check(result, modules, args.budget_ms)
+    for failure in failures:
+        print(f"✗ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✓ Login page within import budget")
+
+
+if __name__ == '__main__':
+    main()
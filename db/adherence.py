@@ -0,0 +1,75 @@
+"""
+Adherence rollups for the trainer dashboard
+
+Repository.get_adherence returns counts from the adherence_weekly aggregate
+at two grains: per client and week ('client') and per workout / meal plan
+and week ('template'). The dashboard's tables and charts are pandas
+group-bys over those rows, so a page view costs one read of
+O((clients + templates) x weeks) rows however many assignments sit behind
+them. pandas ships with Streamlit.
+"""
+
+from datetime import timedelta
+
+import pandas as pd
+
+ADHERENCE_COLUMNS = ['grain', 'id', 'name', 'kind', 'week_start', 'assigned', 'completed']
+
+# Periods offered on the dashboard, in weeks
+ADHERENCE_PERIODS = [4, 8, 12, 26]
+
+
+def adherence_window(today, weeks):
+    """(since, until) ISO dates covering the last `weeks` weeks up to today"""
+    return (today - timedelta(weeks=weeks)).isoformat(), today.isoformat()
+
+
+def adherence_frame(rows):
+    """DataFrame of adherence rows with typed columns"""
+    frame = pd.DataFrame(rows, columns=ADHERENCE_COLUMNS)
+    frame['week_start'] = pd.to_datetime(frame['week_start'])
+    frame[['assigned', 'completed']] = frame[['assigned', 'completed']].astype('int64')
+    frame['name'] = frame['name'].fillna('(deleted)')
+    return frame
+
+
+def rollup(frame, by):
+    """Sum assigned/completed over the given columns and add completion_pct"""
+    totals = frame.groupby(by, as_index=False, sort=False)[['assigned', 'completed']].sum()
+    assigned = totals['assigned'].where(totals['assigned'] > 0)
+    totals['completion_pct'] = (totals['completed'] / assigned * 100).round(1)
+    return totals
+
+
+def clients(frame):
+    return frame[frame['grain'] == 'client']
+
+
+def by_client(frame):
+    """One row per client, least adherent first"""
+    totals = rollup(clients(frame), ['id', 'name'])
+    return totals.sort_values(['completion_pct', 'name'], na_position='last')
+
+
+def by_week(frame):
+    """Completion % per week, one column per kind (workout / meal)"""
+    totals = rollup(clients(frame), ['week_start', 'kind'])
+    return totals.pivot(index='week_start', columns='kind', values='completion_pct').sort_index()
+
+
+def by_template(frame):
+    """One row per workout / meal plan, least adherent first"""
+    totals = rollup(frame[frame['grain'] == 'template'], ['kind', 'id', 'name'])
+    return totals.sort_values(['completion_pct', 'name'], na_position='last')
+
+
+def overall(frame):
+    """Completion % across everything and per kind; None where nothing is assigned"""
+    frame = clients(frame)
+    totals = {'all': frame[['assigned', 'completed']].sum()}
+    for kind, group in frame.groupby('kind'):
+        totals[kind] = group[['assigned', 'completed']].sum()
+    return {
+        name: round(sums['completed'] / sums['assigned'] * 100, 1) if sums['assigned'] else None
+        for name, sums in totals.items()
+    }
@@ -0,0 +1,64 @@
+"""
+Bulk assignment helpers
+
+Builds workout/meal assignment rows for many clients over a date range in
+memory, so they can be written in a few multi-row upserts instead of one
+insert per client per day.
+"""
+
+from datetime import timedelta
+from itertools import islice
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# Rows per upsert request; keeps request bodies well under PostgREST limits
+BATCH_SIZE = 500
+
+
+def schedule_dates(start_date, end_date, weekdays):
+    """Dates between start_date and end_date (inclusive) falling on weekdays
+
+    weekdays is a collection of names from WEEKDAYS, e.g. ["Mon", "Wed", "Fri"].
+    """
+    wanted = {WEEKDAYS.index(day) for day in weekdays}
+    dates = []
+    current = start_date
+    while current <= end_date:
+        if current.weekday() in wanted:
+            dates.append(current)
+        current += timedelta(days=1)
+    return dates
+
+
+def build_assignment_rows(template_column, template_id, client_ids, dates):
+    """One assignment row per (client, date), without duplicates
+
+    template_column is 'workout_id' or 'meal_plan_id'.
+    """
+    rows = []
+    seen = set()
+    for client_id in client_ids:
+        for assigned_date in dates:
+            key = (client_id, assigned_date)
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append({
+                template_column: template_id,
+                'client_id': client_id,
+                'assigned_date': assigned_date.isoformat()
+            })
+    return rows
+
+
+def batches(rows, size=BATCH_SIZE):
+    """Split rows into lists of at most size rows"""
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def chunked(rows, size=BATCH_SIZE):
+    """Split an iterator of rows into lists of at most size rows, reading it lazily"""
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
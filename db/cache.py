@@ -0,0 +1,110 @@
+"""
+Read-through query cache
+
+Results of the trainer-facing readers (workouts, meal plans, clients) are
+kept per user for a short TTL so reruns that only toggle a tab do not go back
+to Supabase. Entries are evicted least-recently-used once the cache is full,
+and the write functions in app.py invalidate exactly the entries they change.
+db/shared_cache.py extends it to several app workers.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_SECONDS = 300
+
+
+class QueryCache:
+    """Bounded TTL cache with LRU eviction and hit/miss counters
+
+    Keys are (name, owner_id, ...) tuples, e.g. ('workouts', trainer_id)
+    or ('workouts', trainer_id, cursor, limit) for one page of a list.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL_SECONDS, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (found, value) for a key, counting a hit or a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries if full"""
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss
+
+        Exceptions raised by the loader propagate and nothing is cached.
+        """
+        found, value = self.get(key)
+        if found:
+            return value
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def invalidate(self, name, owner_id=None):
+        """Drop one owner's entries for name, or every entry for name"""
+        with self._lock:
+            stale = [
+                k for k in self._entries
+                if k[0] == name and (owner_id is None or k[1] == owner_id)
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop every entry and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Snapshot of the cache counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+@st.cache_resource
+def get_query_cache(url=None):
+    """Process-wide query cache shared by all sessions
+
+    With a url, the cache is also shared with the other workers through the
+    store at url (see db/shared_cache.py).
+    """
+    if url:
+        from db.shared_cache import open_shared_cache
+        return open_shared_cache(url)
+    return QueryCache()
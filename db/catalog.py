@@ -0,0 +1,166 @@
+"""
+Exercise and food catalog
+
+Workout and meal plan bodies reference shared catalog_items rows by id
+instead of each template carrying its own copy of the names:
+
+    exercises: [{'exercise_id': 12, 'sets': '3', 'reps': '10'}]
+    meals:     [{'food_id': 4, 'time': '8:00 AM', 'items': '...'}]
+
+Names are interned on save (Repository.intern_catalog_items), so
+'Bench press' and ' bench  Press' share one row, and expanded back for
+display from a process-wide Catalog. The Catalog also indexes every name in
+a PrefixTrie per kind for the suggestions on the creation forms.
+
+Bodies saved before the catalog existed still hold 'name' entries; they are
+passed through unchanged.
+"""
+
+import threading
+import time
+
+import streamlit as st
+
+# Template table -> (catalog kind, id key in body entries)
+CATALOG_KINDS = {
+    'workouts': ('exercise', 'exercise_id'),
+    'meal_plans': ('food', 'food_id'),
+}
+
+# Seconds before a kind is reloaded, to pick up names other processes added
+CATALOG_TTL_SECONDS = 600
+SUGGESTION_LIMIT = 8
+
+
+def catalog_key(name):
+    """Case- and whitespace-insensitive key of a name, like catalog_key() in schema.sql"""
+    return ' '.join(name.split()).lower()
+
+
+class PrefixTrie:
+    """Catalog items by name prefix
+
+    Every word start of a name is indexed, so 'press' finds 'Bench press'.
+    """
+
+    def __init__(self):
+        self._root = {}
+
+    def insert(self, key, item):
+        starts = [0] + [i + 1 for i, ch in enumerate(key) if ch == ' ']
+        for start in starts:
+            node = self._root
+            for ch in key[start:]:
+                node = node.setdefault(ch, {})
+            # '' cannot collide with a one-character edge
+            node.setdefault('', {})[item['id']] = item
+
+    def search(self, prefix, limit=SUGGESTION_LIMIT):
+        """Up to limit items with a word starting with prefix, shortest names first"""
+        node = self._root
+        for ch in catalog_key(prefix):
+            node = node.get(ch)
+            if node is None:
+                return []
+        found = {}
+        level = [node]
+        # Breadth first: shorter completions before longer ones
+        while level and len(found) < limit:
+            next_level = []
+            for current in level:
+                for edge in sorted(current):
+                    if edge == '':
+                        for item_id, item in current[''].items():
+                            found.setdefault(item_id, item)
+                    else:
+                        next_level.append(current[edge])
+            level = next_level
+        return sorted(found.values(), key=lambda item: (len(item['name']), catalog_key(item['name'])))[:limit]
+
+
+class Catalog:
+    """In-memory copy of catalog_items: by id, and a PrefixTrie per kind"""
+
+    def __init__(self, ttl=CATALOG_TTL_SECONDS, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._items = {}
+        self._keys = {}  # (kind, catalog_key) -> item
+        self._tries = {}
+        self._loaded_at = {}
+        self._lock = threading.Lock()
+
+    def add(self, items):
+        """Add {id, kind, name} rows"""
+        with self._lock:
+            for item in items:
+                item = {'id': item['id'], 'kind': item['kind'], 'name': item['name']}
+                self._items[item['id']] = item
+                self._keys[(item['kind'], catalog_key(item['name']))] = item
+                self._tries.setdefault(item['kind'], PrefixTrie()).insert(catalog_key(item['name']), item)
+
+    def load(self, kind, items):
+        """Replace the rows of one kind with a full listing"""
+        with self._lock:
+            self._items = {i: item for i, item in self._items.items() if item['kind'] != kind}
+            self._keys = {key: item for key, item in self._keys.items() if key[0] != kind}
+            self._tries[kind] = PrefixTrie()
+            self._loaded_at[kind] = self._clock()
+        self.add(items)
+
+    def stale(self, kind):
+        """Whether the kind has not been loaded in full within the TTL"""
+        loaded_at = self._loaded_at.get(kind)
+        return loaded_at is None or self._clock() - loaded_at >= self.ttl
+
+    def suggest(self, kind, prefix, limit=SUGGESTION_LIMIT):
+        """Names of kind with a word starting with prefix"""
+        trie = self._tries.get(kind)
+        if trie is None or not prefix.strip():
+            return []
+        return [item['name'] for item in trie.search(prefix, limit)]
+
+    def find(self, kind, name):
+        """The item of kind named name (up to case and spacing), or None"""
+        return self._keys.get((kind, catalog_key(name)))
+
+    def missing(self, table, body):
+        """Ids referenced by body that are not loaded"""
+        id_key = CATALOG_KINDS[table][1]
+        return sorted({
+            entry[id_key] for entry in body or []
+            if entry.get(id_key) is not None and entry[id_key] not in self._items
+        })
+
+    def expand(self, table, body):
+        """Body entries with 'name' filled in from the catalog"""
+        id_key = CATALOG_KINDS[table][1]
+        expanded = []
+        for entry in body or []:
+            item = self._items.get(entry.get(id_key))
+            if item is not None:
+                entry = {**entry, 'name': item['name']}
+            expanded.append(entry)
+        return expanded
+
+
+def reference_body(table, body, items):
+    """Body entries with their 'name' replaced by the id of the matching catalog item
+
+    Entries whose name has no item (e.g. blank) keep their name.
+    """
+    kind, id_key = CATALOG_KINDS[table]
+    ids = {catalog_key(item['name']): item['id'] for item in items if item['kind'] == kind}
+    referenced = []
+    for entry in body:
+        item_id = ids.get(catalog_key(entry.get('name') or ''))
+        if item_id is not None:
+            entry = {id_key: item_id, **{k: v for k, v in entry.items() if k != 'name'}}
+        referenced.append(entry)
+    return referenced
+
+
+@st.cache_resource
+def get_catalog():
+    """Process-wide catalog shared by all sessions"""
+    return Catalog()
@@ -0,0 +1,278 @@
+"""
+Assignment change feed
+
+Open dashboards learn about writes to the assignment tables from a change
+feed instead of refetching on a timer. Postgres announces every write on
+the assignment_changes channel (NOTIFY, see schema.sql); a PostgresListener
+thread per process LISTENs on it and a ChangeFeed hands each row to the
+sessions it concerns: the client it is assigned to and the trainer who owns
+the template. The SQLite backend mirrors the triggers and reports the same
+rows in process (SQLiteRepository.on_change), so the feed can be exercised
+offline. The app applies the rows to the session's cached checklist and
+schedule windows (apply_changes) on its next rerun, fetching only rows it
+has not seen, and the feed asks Streamlit for that rerun at once.
+
+Changes reach sessions on the listener's thread, so SessionChanges only
+collects them; nothing here touches st.session_state. While the listener
+is down, or a session has fallen too far behind, sessions are told to
+resync: they drop their caches and load them once as before.
+"""
+
+import json
+import logging
+import select
+import threading
+
+import streamlit as st
+
+CHANGE_CHANNEL = 'assignment_changes'
+# Changes a session holds before it is told to reload instead
+MAX_PENDING_CHANGES = 500
+# Seconds the listener waits for a notification before checking it should stop
+LISTEN_POLL_SECONDS = 5
+# Seconds between attempts to reconnect a dropped listener
+RECONNECT_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def parse_notification(payload):
+    """The change dicts of one assignment_changes payload, one per row"""
+    message = json.loads(payload)
+    return [{'table': message['table'], 'op': message['op'], **row} for row in message['rows']]
+
+
+def session_waker():
+    """Function asking Streamlit to rerun the current session, from any thread
+
+    Returns None outside `streamlit run` (e.g. under AppTest). The function
+    returns False once the session has gone away.
+    """
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    if ctx is None or not Runtime.exists():
+        return None
+    # Not a public API: missing where the runtime is stubbed out
+    session_mgr = getattr(Runtime.instance(), '_session_mgr', None)
+    if session_mgr is None:
+        return None
+    session_id = ctx.session_id
+
+    def wake():
+        info = session_mgr.get_active_session_info(session_id)
+        if info is None:
+            return False
+        # No client state: the rerun keeps the session's widget values
+        info.session.request_rerun(None)
+        return True
+    return wake
+
+
+class SessionChanges:
+    """Changes waiting for one session's next rerun
+
+    push() runs on the feed's thread and drain() on the session's. Writes
+    the session made itself can be announced with expect() first, so their
+    echo from the feed neither queues a change nor reruns the session.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING_CHANGES):
+        self.max_pending = max_pending
+        self.wake = None
+        self._changes = []
+        self._expected = {}  # (table, id) -> completed
+        self._resync = False
+        self._lock = threading.Lock()
+
+    def expect(self, table, changes):
+        """Completion changes ({id, completed}) about to be written by this session"""
+        with self._lock:
+            for change in changes:
+                self._expected[(table, change['id'])] = change['completed']
+
+    def _wake(self):
+        return self.wake is None or self.wake() is not False
+
+    def push(self, change):
+        """Queue a change and wake the session; returns False if the session is gone"""
+        with self._lock:
+            key = (change['table'], change['id'])
+            if change['op'] == 'UPDATE' and key in self._expected:
+                if self._expected.pop(key) == change['completed']:
+                    return True
+            if not self._resync:
+                if len(self._changes) < self.max_pending:
+                    self._changes.append(change)
+                else:
+                    # Reloading is cheaper than applying this many
+                    self._changes.clear()
+                    self._resync = True
+        return self._wake()
+
+    def reset(self):
+        """Drop queued changes and have the session reload; returns False if it is gone"""
+        with self._lock:
+            self._changes.clear()
+            self._expected.clear()
+            self._resync = True
+        return self._wake()
+
+    def drain(self):
+        """(changes, resync) since the last drain"""
+        with self._lock:
+            changes, resync = self._changes, self._resync
+            self._changes, self._resync = [], False
+            return changes, resync
+
+
+class ChangeFeed:
+    """Hands assignment changes to the sessions of the users they concern
+
+    live tells whether a source is publishing; while it is not, sessions
+    keep refetching on their TTLs.
+    """
+
+    def __init__(self):
+        self.live = False
+        self._sessions = {}  # session key -> (user id, SessionChanges)
+        self._lock = threading.Lock()
+
+    def subscribe(self, key, user_id, inbox):
+        with self._lock:
+            self._sessions[key] = (user_id, inbox)
+
+    def unsubscribe(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def _deliver(self, send):
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for key, (user_id, inbox) in sessions:
+            # Runs inside whoever published, e.g. another session's write
+            try:
+                gone = send(user_id, inbox) is False
+            except Exception:
+                logger.exception("Could not deliver a change to session %s", key)
+                gone = True
+            if gone:
+                self.unsubscribe(key)
+
+    def publish(self, change):
+        """Queue a change for the sessions of its client and trainer"""
+        users = (change.get('client_id'), change.get('trainer_id'))
+        self._deliver(lambda user_id, inbox: inbox.push(change) if user_id in users else None)
+
+    def resync(self):
+        """Have every session reload, e.g. after changes may have been missed"""
+        self._deliver(lambda user_id, inbox: inbox.reset())
+
+    def attach(self, repository):
+        """Publish the changes an in-process repository reports (the SQLite backend)"""
+        repository.on_change = self.publish
+        self.live = True
+
+
+class PostgresListener:
+    """Thread LISTENing on CHANGE_CHANNEL and publishing to a ChangeFeed
+
+    psycopg2 is imported when the thread starts, so it is only needed where
+    the feed is configured.
+    """
+
+    def __init__(self, dsn, feed):
+        self.dsn = dsn
+        self.feed = feed
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='change-feed', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def connect(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        connection = psycopg2.connect(self.dsn)
+        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANGE_CHANNEL}")
+        return connection
+
+    def deliver(self, connection):
+        """Publish the notifications connection has received"""
+        connection.poll()
+        while connection.notifies:
+            notification = connection.notifies.pop(0)
+            for change in parse_notification(notification.payload):
+                self.feed.publish(change)
+
+    def run(self):
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = self.connect()
+                self.feed.live = True
+                # Anything written while not listening was missed
+                self.feed.resync()
+                while not self._stop.is_set():
+                    if select.select([connection], [], [], LISTEN_POLL_SECONDS) != ([], [], []):
+                        self.deliver(connection)
+            except Exception:
+                logger.exception("Change feed listener failed; reconnecting")
+            finally:
+                self.feed.live = False
+                if connection is not None:
+                    connection.close()
+            self._stop.wait(RECONNECT_SECONDS)
+
+
+@st.cache_resource
+def get_change_feed(dsn=None):
+    """Process-wide change feed, listening to Postgres at dsn if given"""
+    feed = ChangeFeed()
+    if dsn:
+        PostgresListener(dsn, feed).start()
+    return feed
+
+
+def apply_changes(lists, changes, wanted):
+    """Apply changes to cached assignment rows in place; returns the ids to fetch
+
+    lists maps assignment tables to cached rows (dicts with id,
+    assigned_date, version and completed). A completion update patches its
+    row; rows deleted, or moved out of what wanted(change) says the lists
+    cover, are dropped. New rows, and rows whose date or pinned version
+    changed, need their template embedded, so their ids are returned as
+    {table: set of ids} to be fetched and merged with merge_rows.
+    """
+    fetch = {table: set() for table in lists}
+    for change in changes:
+        rows = lists.get(change['table'])
+        if rows is None:
+            continue
+        index = next((i for i, row in enumerate(rows) if row['id'] == change['id']), None)
+        if (change['op'] == 'UPDATE' and index is not None
+                and rows[index].get('version') == change['version']
+                and rows[index]['assigned_date'] == change['assigned_date']):
+            rows[index]['completed'] = change['completed']
+            rows[index]['completed_at'] = change['completed_at']
+            continue
+        if index is not None:
+            del rows[index]
+        fetch[change['table']].discard(change['id'])
+        if change['op'] != 'DELETE' and wanted(change):
+            fetch[change['table']].add(change['id'])
+    return fetch
+
+
+def merge_rows(rows, fetched, ids):
+    """Add the fetched rows whose id is in ids, keeping (date, created_at) order"""
+    rows.extend(row for row in fetched if row['id'] in ids)
+    rows.sort(key=lambda row: (row['assigned_date'], row.get('created_at') or ''))
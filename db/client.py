@@ -0,0 +1,141 @@
+"""
+Supabase connection handling
+
+Streamlit re-executes app.py on every widget interaction, so anything created
+at module level is rebuilt on each rerun. The HTTP transport (and with it the
+keep-alive connection pool) is created once per process and shared by every
+session, while each browser session keeps its own Client so auth state never
+leaks between users. Requests go through a TracingTransport, which records
+them in the rerun's trace (db/tracing.py).
+
+Access tokens are kept fresh by the session's AuthSession (db/session.py),
+so gotrue's own refresh timer is switched off.
+
+Importing this module loads the Supabase SDK, which is most of the app's
+import time, so app.py only imports it in connect(), after the login page.
+"""
+
+import httpx
+import streamlit as st
+from gotrue import SyncMemoryStorage
+from postgrest import SyncPostgrestClient
+from postgrest.utils import SyncClient as PostgrestSession
+from supabase import Client
+from supabase.lib.auth_client import SupabaseAuthClient, SyncClient as AuthSession
+from supabase.lib.client_options import ClientOptions
+
+from db.tracing import current_trace, request_attributes, row_count, span
+
+# Connection pool sizing for the shared transport
+POOL_LIMITS = httpx.Limits(
+    max_connections=100,
+    max_keepalive_connections=20,
+    keepalive_expiry=30.0
+)
+
+HEALTH_CHECK_TIMEOUT = 5.0
+
+
+class TracingTransport(httpx.BaseTransport):
+    """HTTP transport that records a span per request when a trace is active"""
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def handle_request(self, request):
+        if current_trace() is None:
+            return self.transport.handle_request(request)
+        attributes = request_attributes(request)
+        with span(f"{request.method} {attributes['target']}", **attributes) as request_span:
+            response = self.transport.handle_request(request)
+            response.read()
+            request_span.attributes.update({
+                'http.status': response.status_code,
+                'rows': row_count(response),
+                'bytes': len(response.content),
+            })
+            return response
+
+    def close(self):
+        self.transport.close()
+
+
+@st.cache_resource
+def get_transport():
+    """Process-wide HTTP transport holding the keep-alive connection pool
+
+    Wrapped in a TracingTransport so requests made inside a traced rerun
+    are recorded (see db/tracing.py).
+    """
+    return TracingTransport(httpx.HTTPTransport(limits=POOL_LIMITS, retries=1))
+
+
+@st.cache_resource(show_spinner=False)
+def check_connection(url, key):
+    """Ping the Supabase auth health endpoint once per process
+
+    Raises on failure; since st.cache_resource does not cache exceptions the
+    check is retried on the next rerun.
+    """
+    session = httpx.Client(transport=get_transport(), timeout=HEALTH_CHECK_TIMEOUT)
+    response = session.get(f"{url}/auth/v1/health", headers={"apikey": key})
+    response.raise_for_status()
+    return True
+
+
+class PooledPostgrestClient(SyncPostgrestClient):
+    """PostgREST client whose session runs over a shared transport"""
+
+    def __init__(self, base_url, transport, **kwargs):
+        self._transport = transport
+        super().__init__(base_url, **kwargs)
+
+    def create_session(self, base_url, headers, timeout):
+        return PostgrestSession(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            transport=self._transport
+        )
+
+
+class PooledClient(Client):
+    """Supabase client with per-session auth state over a pooled transport"""
+
+    def __init__(self, supabase_url, supabase_key, transport):
+        self._transport = transport
+        # A fresh ClientOptions per client: the library default is a shared
+        # instance, which would make every session share one auth storage.
+        # Tokens are refreshed by db/session.py rather than a timer per client
+        super().__init__(
+            supabase_url,
+            supabase_key,
+            options=ClientOptions(storage=SyncMemoryStorage(), auto_refresh_token=False)
+        )
+
+    def _init_supabase_auth_client(self, auth_url, client_options):
+        return SupabaseAuthClient(
+            url=auth_url,
+            auto_refresh_token=client_options.auto_refresh_token,
+            persist_session=client_options.persist_session,
+            storage=client_options.storage,
+            headers=client_options.headers,
+            http_client=AuthSession(transport=self._transport),
+            flow_type=client_options.flow_type,
+        )
+
+    def _init_postgrest_client(self, rest_url, headers, schema, timeout):
+        return PooledPostgrestClient(
+            rest_url,
+            self._transport,
+            headers=headers,
+            schema=schema,
+            timeout=timeout
+        )
+
+
+def get_client(url, key):
+    """Get the Supabase client for the current browser session"""
+    if st.session_state.get('supabase_client') is None:
+        st.session_state.supabase_client = PooledClient(url, key, get_transport())
+    return st.session_state.supabase_client
@@ -0,0 +1,162 @@
+"""
+Optimistic completion toggles
+
+Ticking a workout or meal on the client dashboard is applied to the
+session's PendingCompletions straight away and rendered from there. The
+changes are written later in a single Repository.set_completions call
+(one RPC on Supabase), once a few have accumulated or the oldest has
+waited long enough. A timer (flush_later) reruns the session when that
+wait is up, so a client who ticks one item and stops does not have to
+interact again; if the tab has been closed by then the timer writes the
+changes itself.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+# Flush once the oldest pending change is this old...
+FLUSH_DELAY_SECONDS = 5.0
+# ...or once this many changes are waiting
+MAX_PENDING = 10
+
+FLUSH_ATTEMPTS = 3
+FLUSH_BACKOFF_SECONDS = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+class PendingCompletions:
+    """Completion changes not yet written to the database
+
+    Changes are keyed by ('workout' | 'meal', assignment_id). Toggling an
+    item back to its saved state cancels the pending change. owner is the
+    user the changes belong to once they have outlived a sign out.
+
+    The script thread and the flush_later timer can both use it, so
+    changes are only touched under a lock; read them through snapshot().
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self.changes = {}
+        self.first_change_at = None
+        self.owner = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.changes)
+
+    def set(self, kind, assignment_id, completed, saved):
+        """Record a toggle; saved is the value currently in the database"""
+        key = (kind, assignment_id)
+        with self._lock:
+            if completed == saved:
+                self.changes.pop(key, None)
+            else:
+                completed_at = datetime.fromtimestamp(self._clock()).astimezone().isoformat() if completed else None
+                self.changes[key] = (completed, completed_at)
+            if not self.changes:
+                self.first_change_at = None
+            elif self.first_change_at is None:
+                self.first_change_at = self._clock()
+
+    def value(self, kind, assignment_id, saved):
+        """Completion state to display for an assignment"""
+        change = self.changes.get((kind, assignment_id))
+        return saved if change is None else change[0]
+
+    def due(self):
+        """Whether the pending changes should be written now"""
+        with self._lock:
+            if not self.changes:
+                return False
+            waited = self._clock() - self.first_change_at
+            return len(self.changes) >= MAX_PENDING or waited >= FLUSH_DELAY_SECONDS
+
+    def flush_later(self, wake, send):
+        """Call wake() when the changes fall due, once per batch
+
+        wake reruns the session (db.changes.session_waker). If it reports
+        the session gone, the changes are written with send from the
+        timer's thread instead.
+        """
+        def fire():
+            with self._lock:
+                if self._timer is timer:
+                    self._timer = None
+            if wake() is False:
+                try:
+                    flush(self, send)
+                except Exception as e:
+                    logger.warning("Could not save the completions of a closed session: %s", str(e))
+
+        with self._lock:
+            if self._timer is not None or not self.changes:
+                return
+            delay = max(0.0, self.first_change_at + FLUSH_DELAY_SECONDS - self._clock())
+            timer = self._timer = threading.Timer(delay, fire)
+            timer.daemon = True
+            timer.start()
+
+    def snapshot(self):
+        """Copy of the pending changes"""
+        with self._lock:
+            return dict(self.changes)
+
+    def payload(self, changes=None):
+        """Keyword arguments for Repository.set_completions, for changes or all pending ones"""
+        rows = {'workout': [], 'meal': []}
+        for (kind, assignment_id), (completed, completed_at) in (changes or self.snapshot()).items():
+            rows[kind].append({
+                'id': assignment_id,
+                'completed': completed,
+                'completed_at': completed_at
+            })
+        return {'workouts': rows['workout'], 'meals': rows['meal']}
+
+    def discard(self, written):
+        """Drop the written changes, keeping any toggled again since they were read"""
+        with self._lock:
+            for key, change in written.items():
+                if self.changes.get(key) == change:
+                    del self.changes[key]
+            if not self.changes:
+                self._reset()
+
+    def clear(self):
+        """Forget all pending changes"""
+        with self._lock:
+            self.changes = {}
+            self._reset()
+
+    def _reset(self):
+        self.first_change_at = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+def flush(pending, send, attempts=FLUSH_ATTEMPTS, backoff=FLUSH_BACKOFF_SECONDS, sleep=time.sleep):
+    """Write pending changes with send(payload), retrying with backoff
+
+    Returns the changes that were written and drops them from pending;
+    toggles recorded meanwhile stay pending. On repeated failure the last
+    exception is raised and the changes stay pending.
+    """
+    changes = pending.snapshot()
+    if not changes:
+        return {}
+    payload = pending.payload(changes)
+    for attempt in range(attempts):
+        try:
+            send(payload)
+            break
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            sleep(backoff * 2 ** attempt)
+    pending.discard(changes)
+    return changes
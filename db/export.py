@@ -0,0 +1,146 @@
+"""
+History export
+
+A client's history can run to years of daily workouts and meals, so an
+export never holds it all: history_rows pages through each assignment
+table oldest first with an (assigned_date, id) keyset cursor
+(Repository.get_history_page), merges the two tables by date as the pages
+arrive, and the writers encode every EXPORT_PAGE_SIZE rows into a chunk of
+CSV or Parquet bytes before the next page is fetched. Fetching and
+encoding then hold no more than a page of rows, however long the history.
+
+The encoded file itself still grows with the history: Streamlit's
+download button takes the whole file, so the app (export_history) writes
+the chunks into one buffer and hands that to the button for a single run.
+"""
+
+import csv
+import heapq
+import io
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from db.bulk import chunked
+from db.pagination import EXPORT_PAGE_SIZE, next_cursor
+from db.repository import ASSIGNMENT_TABLES, VERSION_TABLES
+
+# Cursor columns of Repository.get_history_page
+HISTORY_CURSOR = ('assigned_date', 'id')
+
+EXPORT_SCHEMA = pa.schema([
+    ('date', pa.date32()),
+    ('type', pa.string()),
+    ('title', pa.string()),
+    ('version', pa.int32()),
+    ('completed', pa.bool_()),
+    ('completed_at', pa.string()),
+])
+
+# Format label -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+# Assignment table -> value of the export's type column
+EXPORT_TYPES = {
+    'workout_assignments': 'workout',
+    'meal_assignments': 'meal',
+}
+
+
+def table_rows(repo, table, client_id, page_size=EXPORT_PAGE_SIZE):
+    """Yield a client's rows of one assignment table oldest first, a page at a time"""
+    versions = VERSION_TABLES[ASSIGNMENT_TABLES[table][1]][0]
+    after = None
+    while True:
+        page = repo.get_history_page(table, client_id, after=after, limit=page_size)
+        for row in page:
+            version = row.get(versions) or {}
+            yield {
+                'date': row['assigned_date'],
+                'type': EXPORT_TYPES[table],
+                'title': version.get('title'),
+                'version': row['version'],
+                'completed': row['completed'],
+                'completed_at': row['completed_at'],
+            }
+        if len(page) < page_size:
+            return
+        after = next_cursor(page, HISTORY_CURSOR)
+
+
+def history_rows(repo, client_id, page_size=EXPORT_PAGE_SIZE):
+    """Yield a client's workouts and meals in date order, workouts first on each day"""
+    return heapq.merge(
+        *(table_rows(repo, table, client_id, page_size) for table in EXPORT_TYPES),
+        key=lambda row: row['date']
+    )
+
+
+def csv_chunks(rows, size=EXPORT_PAGE_SIZE):
+    """Encode rows as CSV, yielding the header and then bytes for every size rows"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_SCHEMA.names)
+    writer.writeheader()
+    yield buffer.getvalue().encode()
+    for chunk in chunked(rows, size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode()
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file handing out what was written since the last take()
+
+    tell() keeps counting across takes, as the Parquet writer records
+    column chunk offsets from it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(rows, size=EXPORT_PAGE_SIZE):
+    """Encode rows as Parquet, one row group per size rows, yielding bytes as they are written"""
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, EXPORT_SCHEMA) as writer:
+        for chunk in chunked(rows, size):
+            for row in chunk:
+                row['date'] = date.fromisoformat(row['date'])
+            writer.write_table(pa.Table.from_pylist(chunk, schema=EXPORT_SCHEMA))
+            yield sink.take()
+    yield sink.take()
+
+
+EXPORT_WRITERS = {
+    'CSV': csv_chunks,
+    'Parquet': parquet_chunks,
+}
+
+
+def export_file_name(name, fmt, today):
+    """File name for an export of name's history made on today"""
+    slug = '-'.join(''.join(c if c.isalnum() else ' ' for c in name.lower()).split()) or 'client'
+    return f"{slug}-history-{today.isoformat()}.{EXPORT_FORMATS[fmt][0]}"
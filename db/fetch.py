@@ -0,0 +1,96 @@
+"""
+Concurrent page fetches
+
+Pages that need several independent reads (the assign page's workouts,
+meal plans and client lists; the client checklist's exercise and meal
+names) pass them to fetch_all, which runs them together on a process-wide
+thread pool and returns their results in order. A rerun then waits for the
+slowest query instead of the sum of all of them; the Supabase client is
+synchronous, so threads rather than asyncio are what lets its HTTP requests
+overlap over the shared connection pool (db/client.py).
+
+Unlike the schedule prefetch (db/schedule.py), these loaders are awaited
+within the same rerun, so each one runs with the caller's script run
+context and a copy of its context variables: st.session_state, st.error
+and the active request trace (db/tracing.py) work inside them as they do
+on the script thread. current_loader tells code running in a loader which
+batch and loader it is in; benchmarks/app_bench.py counts waits with it.
+"""
+
+import contextvars
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+
+from db.tracing import span
+
+# Loaders running at once across all sessions
+FETCH_WORKERS = 16
+
+_on_fetch_thread = threading.local()
+_batches = itertools.count()
+
+# (batch, loader index) of the fetch_all loader running in this context, or None
+current_loader = contextvars.ContextVar('current_loader', default=None)
+
+
+@st.cache_resource
+def get_fetch_executor():
+    """Process-wide thread pool for concurrent page fetches"""
+    return ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='page-fetch')
+
+
+def run_loader(loader, script_ctx, context, slot=None):
+    """Run loader on a pool thread as if it were on the script thread"""
+    thread = threading.current_thread()
+    add_script_run_ctx(thread, script_ctx)
+    _on_fetch_thread.active = True
+    try:
+        context.run(current_loader.set, slot)
+        return context.run(loader)
+    finally:
+        # Pool threads are shared by all sessions; never leave one attached
+        setattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+        _on_fetch_thread.active = False
+
+
+def fetch_all(*loaders, executor=None):
+    """Call every loader concurrently and return their results in order
+
+    The first loader runs on the calling thread. If a loader raises, the
+    others still finish and the first exception is re-raised. Calls made
+    from inside a loader run their loaders one after another, so a full
+    pool cannot deadlock on itself.
+    """
+    if len(loaders) < 2 or getattr(_on_fetch_thread, 'active', False):
+        return [loader() for loader in loaders]
+    executor = executor or get_fetch_executor()
+    with span('fetch_all', loaders=len(loaders)):
+        script_ctx = get_script_run_ctx()
+        batch = next(_batches)
+        futures = [
+            executor.submit(run_loader, loader, script_ctx, contextvars.copy_context(), (batch, i))
+            for i, loader in enumerate(loaders[1:], 1)
+        ]
+        results, error = [], None
+        token = current_loader.set((batch, 0))
+        try:
+            results.append(loaders[0]())
+        except Exception as e:
+            results.append(None)
+            error = e
+        finally:
+            current_loader.reset(token)
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return results
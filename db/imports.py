@@ -0,0 +1,292 @@
+"""
+Bulk import
+
+Trainers onboarding a gym load workouts, meal plans and schedules from CSV
+or JSON files instead of typing them into the creation forms one at a time.
+Files are read a record at a time (read_records) and validated and written
+IMPORT_BATCH_SIZE records per batch: each batch of templates is one catalog
+intern and one multi-row insert, each batch of schedule rows one client
+lookup, one template lookup and one upsert. A record that cannot be
+imported is reported with its row number and the reason; the others still
+load.
+
+CSV files have one row per exercise or meal, and consecutive rows with the
+same (or a blank) title belong to one template:
+
+    title,description,exercise,sets,reps
+    Leg day,Lower body,Back squat,5,5
+    ,,Romanian deadlift,3,8
+
+JSON files hold one object per template with the entries nested, either one
+object per line (JSON Lines, read line by line) or as an array:
+
+    {"title": "Leg day", "exercises": [{"name": "Back squat", "sets": "5", "reps": "5"}]}
+
+Schedules have email, title and date columns: the client's email, the title
+of one of the trainer's workouts or meal plans, and an ISO date.
+"""
+
+import csv
+import io
+import json
+from datetime import date
+from itertools import islice
+
+from db.bulk import chunked
+from db.catalog import CATALOG_KINDS, reference_body
+from db.repository import ASSIGNMENT_TABLES, TEMPLATE_BODIES
+
+# Records validated and written together
+IMPORT_BATCH_SIZE = 500
+# Emails or titles looked up per request, keeping in.(...) filters short
+LOOKUP_BATCH_SIZE = 100
+
+# What to import -> table written
+IMPORT_TABLES = {
+    'Workouts': 'workouts',
+    'Meal plans': 'meal_plans',
+    'Workout schedule': 'workout_assignments',
+    'Meal plan schedule': 'meal_assignments',
+}
+
+# Template table -> (CSV column naming an entry, the entry's other columns)
+TEMPLATE_IMPORTS = {
+    'workouts': ('exercise', ('sets', 'reps')),
+    'meal_plans': ('meal', ('time', 'items')),
+}
+SCHEDULE_COLUMNS = ('email', 'title', 'date')
+
+
+def import_columns(table):
+    """CSV header expected when importing into table"""
+    if table in TEMPLATE_IMPORTS:
+        entry, details = TEMPLATE_IMPORTS[table]
+        return ('title', 'description', entry) + details
+    return SCHEDULE_COLUMNS
+
+
+def read_records(file, fmt):
+    """Yield (row, record, error) for each record of a CSV or JSON file
+
+    row is the line the record ends on, or its position in a JSON array.
+    A record that cannot be parsed comes back as None with an error.
+    """
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        yield from (csv_records(text) if fmt == 'csv' else json_records(text))
+    finally:
+        # Leave the caller's file open; the wrapper would close it
+        text.detach()
+
+
+def csv_records(text):
+    """read_records() for CSV text; column names are lower-cased and values stripped"""
+    reader = csv.DictReader(text)
+    for record in reader:
+        yield reader.line_num, {
+            key.strip().lower(): (value or '').strip()
+            for key, value in record.items() if key
+        }, None
+
+
+def json_records(text):
+    """read_records() for JSON Lines text, or a JSON array"""
+    first = True
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        if first and line.lstrip().startswith('['):
+            # A JSON array cannot be read a record at a time
+            try:
+                records = json.loads(line + text.read())
+            except ValueError as e:
+                yield line_number, None, f"Invalid JSON: {e}"
+                return
+            for position, record in enumerate(records, 1):
+                yield (position, record, None) if isinstance(record, dict) else (position, None, "Expected an object")
+            return
+        first = False
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        yield (line_number, record, None) if isinstance(record, dict) else (line_number, None, "Expected an object")
+
+
+def template_records(records, table):
+    """Yield (row, template, error), grouping CSV entry rows into templates
+
+    Records that already nest their entries under 'exercises' / 'meals'
+    are templates on their own.
+    """
+    entry_column, details = TEMPLATE_IMPORTS[table]
+    body_key = TEMPLATE_BODIES[table]
+    current = None
+    for row, record, error in records:
+        if error is None and body_key not in record:
+            title = str(record.get('title') or '').strip()
+            entry = {'name': record.get(entry_column, ''), **{key: record.get(key, '') for key in details}}
+            if current is not None and (not title or title == current[1]['title']):
+                current[1]['body'].append(entry)
+                continue
+            if current is not None:
+                yield current
+            current = (row, {'title': title, 'description': record.get('description', ''), 'body': [entry]}, None)
+            continue
+        if current is not None:
+            yield current
+            current = None
+        if error is not None:
+            yield row, None, error
+        else:
+            yield row, {
+                'title': str(record.get('title') or '').strip(),
+                'description': record.get('description', ''),
+                'body': record[body_key],
+            }, None
+    if current is not None:
+        yield current
+
+
+def clean_template(table, template):
+    """(template with string fields and no blank entries, error)"""
+    _, details = TEMPLATE_IMPORTS[table]
+    if not template['title']:
+        return None, "Missing title"
+    if not isinstance(template['body'], list) or not all(isinstance(entry, dict) for entry in template['body']):
+        return None, f"'{TEMPLATE_BODIES[table]}' must be a list of objects"
+    body = [
+        {key: str(entry.get(key) or '').strip() for key in ('name',) + details}
+        for entry in template['body']
+    ]
+    body = [entry for entry in body if entry['name']]
+    if not body:
+        return None, f"No {TEMPLATE_IMPORTS[table][0]} names"
+    return {'title': template['title'], 'description': str(template['description'] or ''), 'body': body}, None
+
+
+def clean_schedule_row(record):
+    """((email, title, ISO date), error) for one schedule record"""
+    email, title, day = (str(record.get(column) or '').strip() for column in SCHEDULE_COLUMNS)
+    if '@' not in email:
+        return None, "Missing or invalid email"
+    if not title:
+        return None, "Missing title"
+    try:
+        day = date.fromisoformat(day).isoformat()
+    except ValueError:
+        return None, f"Invalid date {day!r} (expected YYYY-MM-DD)"
+    return (email.lower(), title, day), None
+
+
+def new_report():
+    """Counts and per-row errors of an import"""
+    return {'imported': 0, 'skipped': 0, 'errors': []}
+
+
+def import_templates(repo, table, trainer_id, records, catalog=None, progress=None, batch_size=IMPORT_BATCH_SIZE):
+    """Create workouts or meal plans from read_records() output; returns the report
+
+    Names are interned into the catalog a batch at a time (and added to
+    catalog when given). progress(report) is called after each batch.
+    """
+    kind = CATALOG_KINDS[table][0]
+    report = new_report()
+    for batch in chunked(template_records(records, table), batch_size):
+        valid = []
+        for row, template, error in batch:
+            if error is None:
+                template, error = clean_template(table, template)
+            if error is not None:
+                report['errors'].append({'row': row, 'error': error})
+            else:
+                valid.append((row, template))
+        if valid:
+            items = repo.intern_catalog_items(kind, [entry['name'] for _, t in valid for entry in t['body']])
+            if catalog is not None:
+                catalog.add(items)
+            # Reference the whole batch at once, then cut it back into bodies
+            entries = iter(reference_body(table, [entry for _, t in valid for entry in t['body']], items))
+            templates = [{**t, 'body': list(islice(entries, len(t['body'])))} for _, t in valid]
+            try:
+                report['imported'] += repo.create_templates(table, trainer_id, templates)
+            except Exception:
+                # Insert the batch one template at a time to find the rows at fault
+                for (row, _), template in zip(valid, templates):
+                    try:
+                        report['imported'] += repo.create_templates(table, trainer_id, [template])
+                    except Exception as e:
+                        report['errors'].append({'row': row, 'error': str(e)})
+        if progress is not None:
+            progress(report)
+    report['errors'].sort(key=lambda error: error['row'])
+    return report
+
+
+def lookup(known, keys, find, key):
+    """Add to known the ids find() returns for the keys not looked up yet
+
+    Keys that match nothing are recorded as None so they are not asked for
+    again. The first row returned for a key wins.
+    """
+    missing = sorted({k for k in keys if k not in known})
+    for chunk in chunked(missing, LOOKUP_BATCH_SIZE):
+        for row in find(chunk):
+            known.setdefault(key(row), row['id'])
+        for k in chunk:
+            known.setdefault(k, None)
+
+
+def import_schedule(repo, table, trainer_id, records, progress=None, batch_size=IMPORT_BATCH_SIZE):
+    """Assign templates to clients from read_records() output; returns the report
+
+    Rows already scheduled are counted as skipped. progress(report) is
+    called after each batch.
+    """
+    template_column, template_table, _ = ASSIGNMENT_TABLES[table]
+    label = 'workout' if template_table == 'workouts' else 'meal plan'
+    # email -> client id and title -> template id, kept across batches
+    clients, templates = {}, {}
+    report = new_report()
+    for batch in chunked(records, batch_size):
+        valid = []
+        for row, record, error in batch:
+            if error is None:
+                record, error = clean_schedule_row(record)
+            if error is not None:
+                report['errors'].append({'row': row, 'error': error})
+            else:
+                valid.append((row, record))
+        lookup(clients, (email for _, (email, _, _) in valid), repo.find_clients,
+               lambda client: client['email'].lower())
+        # find_templates lists newest first, so a repeated title means the latest template
+        lookup(templates, (title for _, (_, title, _) in valid),
+               lambda titles: repo.find_templates(template_table, trainer_id, titles),
+               lambda template: template['title'])
+        rows = []
+        for row, (email, title, day) in valid:
+            if clients[email] is None:
+                report['errors'].append({'row': row, 'error': f"No client with email {email}"})
+            elif templates[title] is None:
+                report['errors'].append({'row': row, 'error': f"No {label} titled {title!r}"})
+            else:
+                rows.append((row, {template_column: templates[title], 'client_id': clients[email], 'assigned_date': day}))
+        if rows:
+            try:
+                inserted, skipped = repo.upsert_assignments(table, [assignment for _, assignment in rows])
+            except Exception:
+                inserted = skipped = 0
+                for row, assignment in rows:
+                    try:
+                        added, existing = repo.upsert_assignments(table, [assignment])
+                        inserted += added
+                        skipped += existing
+                    except Exception as e:
+                        report['errors'].append({'row': row, 'error': str(e)})
+            report['imported'] += inserted
+            report['skipped'] += skipped
+        if progress is not None:
+            progress(report)
+    report['errors'].sort(key=lambda error: error['row'])
+    return report
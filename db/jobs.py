@@ -0,0 +1,153 @@
+"""
+Background jobs
+
+Trainer operations whose cost grows with the data (bulk scheduling many
+clients, archiving a template with many future assignments) are not run
+inside the rerun that asks for them. They are added to the jobs table
+(Repository.enqueue_job) and run by a JobRunner on a process-wide thread
+pool, so the page returns at once whatever the size of the job. The table
+is the queue, so no broker is needed, and jobs survive a restart: a job
+left 'running' by a process that died is claimed again once its lease
+expires.
+
+Each trainer session has one JobRunner, which drains that trainer's jobs
+with the session's repository (on Supabase, the trainer's own client, so
+Row Level Security applies to the job as it does to the page). A job that
+raises is queued again after retry_delay() until it has used max_attempts.
+Handlers report progress as (done, total), which also extends the lease;
+the sidebar's jobs panel polls it from the table.
+
+Handlers may run more than once for the same job, so they must be
+idempotent: bulk scheduling upserts ignoring duplicates, and archiving only
+deletes what is still there.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import streamlit as st
+
+from db.bulk import batches, build_assignment_rows
+from db.repository import ASSIGNMENT_TABLES
+
+# Jobs running at once across all sessions
+JOB_WORKERS = 4
+# Seconds a claimed job is leased to its worker; progress renews it
+JOB_LEASE_SECONDS = 60
+# Seconds before the first retry, doubled for each further attempt
+JOB_RETRY_SECONDS = 5
+
+JOB_LABELS = {
+    'bulk_assign': "Bulk schedule",
+    'archive_template': "Archive",
+}
+
+
+@st.cache_resource
+def get_job_executor():
+    """Process-wide thread pool running background jobs"""
+    return ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='jobs')
+
+
+def run_bulk_assign(repo, params, progress):
+    """Insert assignment rows for clients x dates, one batch per request"""
+    table = params['table']
+    template_column = ASSIGNMENT_TABLES[table][0]
+    dates = [date.fromisoformat(day) for day in params['dates']]
+    rows = build_assignment_rows(template_column, params['template_id'], params['client_ids'], dates)
+    inserted = done = 0
+    progress(0, len(rows))
+    for batch in batches(rows):
+        inserted += repo.upsert_assignments(table, batch)[0]
+        done += len(batch)
+        progress(done, len(rows))
+    return {'inserted': inserted, 'skipped': len(rows) - inserted}
+
+
+def run_archive_template(repo, params, progress):
+    """Archive a template and drop its open future assignments"""
+    progress(0, 1)
+    repo.archive_template(params['table'], params['template_id'], params['today'])
+    progress(1, 1)
+    return {}
+
+
+JOB_HANDLERS = {
+    'bulk_assign': run_bulk_assign,
+    'archive_template': run_archive_template,
+}
+
+
+def retry_delay(attempts, base=JOB_RETRY_SECONDS):
+    """Seconds to wait before running a job again after its attempts-th failure"""
+    return base * 2 ** (attempts - 1)
+
+
+class JobRunner:
+    """Runs one owner's queued jobs on a shared thread pool
+
+    kick() starts draining the owner's queue unless a drain is already
+    under way. on_done(job) is called on the pool thread after each job
+    that finishes, e.g. to invalidate cached reads; it must not touch
+    st.session_state.
+    """
+
+    def __init__(self, repo, owner_id, executor, on_done=None, handlers=JOB_HANDLERS,
+                 lease=JOB_LEASE_SECONDS, retry_base=JOB_RETRY_SECONDS):
+        self.repo = repo
+        self.owner_id = owner_id
+        self.executor = executor
+        self.on_done = on_done
+        self.handlers = handlers
+        self.lease = lease
+        self.retry_base = retry_base
+        self._future = None
+        self._lock = threading.Lock()
+
+    def kick(self):
+        """Drain the queue in the background; returns the drain's Future"""
+        with self._lock:
+            if self._future is None or self._future.done():
+                self._future = self.executor.submit(self.drain)
+            return self._future
+
+    def drain(self):
+        """Run jobs until none is runnable; returns how many were claimed"""
+        claimed = 0
+        while True:
+            job = self.repo.claim_job(self.owner_id, self.lease)
+            if job is None:
+                return claimed
+            claimed += 1
+            self.run(job)
+
+    def run(self, job):
+        """Run one claimed job and record its outcome"""
+        if job['attempts'] > job['max_attempts']:
+            # Claimed again after its lease expired on the last attempt
+            self.repo.fail_job(job['id'], job.get('error') or "The worker running this job stopped")
+            return
+        handler = self.handlers.get(job['kind'])
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind {job['kind']!r}")
+            result = handler(
+                self.repo, job['params'],
+                lambda done, total: self.repo.set_job_progress(job['id'], done, total, self.lease)
+            )
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job['attempts'] >= job['max_attempts']:
+                self.repo.fail_job(job['id'], error)
+                return
+            delay = retry_delay(job['attempts'], self.retry_base)
+            self.repo.fail_job(job['id'], error, retry_in=delay)
+            # Nothing else is runnable until then; come back for it
+            timer = threading.Timer(delay, self.kick)
+            timer.daemon = True
+            timer.start()
+            return
+        self.repo.finish_job(job['id'], result)
+        if self.on_done is not None:
+            self.on_done(job)
@@ -0,0 +1,60 @@
+"""
+Keyset pagination helpers
+
+Template libraries are listed newest first and paged on (created_at, id),
+so each page is an index range scan regardless of how deep the trainer
+has paged, unlike OFFSET which re-reads every skipped row. History exports page a
+client's assignments oldest first on (assigned_date, id) the same way.
+"""
+
+PAGE_SIZE = 20
+# Assignment rows fetched per request when exporting a history
+EXPORT_PAGE_SIZE = 500
+
+
+def page_query(query, after=None, limit=None):
+    """Apply newest-first keyset ordering, cursor filter and limit to a query
+
+    after is the (created_at, id) cursor of the last row of the previous
+    page, or None for the first page.
+    """
+    # postgrest-py has no or_() and repeated order() calls are sent as
+    # separate params, so both are added as raw PostgREST query params
+    if after is not None:
+        created_at, row_id = after
+        query.params = query.params.add(
+            'or',
+            f'(created_at.lt."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.lt.{row_id}))'
+        )
+    query.params = query.params.add('order', 'created_at.desc,id.desc')
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def history_page_query(query, after=None, limit=None):
+    """Apply oldest-first (assigned_date, id) keyset ordering, cursor filter and limit
+
+    after is the (assigned_date, id) cursor of the last row of the previous
+    page, or None for the first page.
+    """
+    if after is not None:
+        assigned_date, row_id = after
+        query.params = query.params.add(
+            'or',
+            f'(assigned_date.gt.{assigned_date},'
+            f'and(assigned_date.eq.{assigned_date},id.gt.{row_id}))'
+        )
+    query.params = query.params.add('order', 'assigned_date.asc,id.asc')
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def next_cursor(rows, columns=('created_at', 'id')):
+    """Cursor pointing just past the last row of a page"""
+    if not rows:
+        return None
+    last = rows[-1]
+    return tuple(last[column] for column in columns)
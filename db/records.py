@@ -0,0 +1,177 @@
+"""
+Compact rows for session state
+
+Each browser session keeps its profile, today's checklist and the calendar
+windows it has shown (db/schedule.py) in st.session_state for as long as
+the tab is open. Kept as the dicts the repositories return, every
+assignment carries its own copy of its template, the checklist's including
+the whole body, and every dict its own hash table, so a month of the same
+few workouts holds dozens of copies of each.
+
+The rows are turned into the records here as they enter session state.
+Records keep their fields in __slots__ and read like the dicts they
+replace (row['id'], row.get('version'), **profile), so the pages do not
+change. Assignments can still be updated in place (completion); embedded
+templates are read-only and interned, so every session in the process
+shares one Workout or MealPlan per distinct row. A template is only shared
+with sessions that read exactly the same row themselves, so nobody sees
+anything new. benchmarks/memory_bench.py measures a session both ways.
+
+Query cache entries stay plain dicts: they may live in a shared store
+(db/shared_cache.py), which holds JSON.
+"""
+
+import json
+import sys
+import threading
+import weakref
+from collections.abc import Mapping
+
+# Field value of a row that did not have the column
+_MISSING = object()
+# Fields whose values repeat across a session's rows (and sessions)
+_SHARED_STRINGS = ('client_id', 'workout_id', 'meal_plan_id', 'assigned_date')
+
+
+class Record(Mapping):
+    """Read-only mapping over a row's fields, kept in __slots__
+
+    Subclasses list their fields; columns a row has beyond those are
+    dropped, and fields it does not have are missing, as in the dict.
+    """
+
+    __slots__ = ()
+    fields = ()
+
+    def __init__(self, **values):
+        for name in self.fields:
+            value = values.get(name, _MISSING)
+            if name in _SHARED_STRINGS and type(value) is str:
+                value = sys.intern(value)
+            object.__setattr__(self, name, value)
+
+    @classmethod
+    def from_row(cls, row):
+        """Record of a row dict, or None for None"""
+        return None if row is None else cls(**row)
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return value
+        raise KeyError(key)
+
+    def __iter__(self):
+        return (name for name in self.fields if getattr(self, name) is not _MISSING)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        # Copies and pickles are rebuilt from the row, so templates stay interned
+        return type(self).from_row, (dict(self),)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class User(Record):
+    """The signed-in user; only the id and email of gotrue's User are used"""
+
+    fields = ('id', 'email')
+    __slots__ = fields
+
+
+class Profile(Record):
+    fields = ('id', 'email', 'full_name', 'role', 'created_at', 'updated_at')
+    __slots__ = fields
+
+
+class Template(Record):
+    """Workout or meal plan embedded in assignments; immutable and interned
+
+    The body (exercises or meals) is a tuple, and is only present in rows
+    that embed it (the checklist); schedule rows embed a summary.
+    """
+
+    __slots__ = ('__weakref__',)
+    body = None
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    @classmethod
+    def from_row(cls, row):
+        """The process's shared template equal to row, or None for None"""
+        if row is None:
+            return None
+        row = dict(row)
+        if isinstance(row.get(cls.body), list):
+            row[cls.body] = tuple(row[cls.body])
+        key = (cls, json.dumps([row.get(name, '\0') for name in cls.fields], sort_keys=True, default=str))
+        with _templates_lock:
+            template = _templates.get(key)
+            if template is None:
+                template = _templates[key] = cls(**row)
+            return template
+
+
+class Workout(Template):
+    fields = ('id', 'title', 'description', 'exercises')
+    __slots__ = fields
+    body = 'exercises'
+
+
+class MealPlan(Template):
+    fields = ('id', 'title', 'description', 'meals')
+    __slots__ = fields
+    body = 'meals'
+
+
+# Interned templates; dropped once no session holds them
+_templates = weakref.WeakValueDictionary()
+_templates_lock = threading.Lock()
+
+
+class Assignment(Record):
+    """Assignment row with its template; completion can be updated in place"""
+
+    __slots__ = ()
+    template = None
+
+    def __init__(self, **values):
+        embed = self.fields[-1]
+        if embed in values:
+            values[embed] = self.template.from_row(values[embed])
+        super().__init__(**values)
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError(key)
+        object.__setattr__(self, key, value)
+
+
+class WorkoutAssignment(Assignment):
+    fields = ('id', 'workout_id', 'client_id', 'assigned_date', 'version',
+              'completed', 'completed_at', 'created_at', 'workouts')
+    __slots__ = fields
+    template = Workout
+
+
+class MealAssignment(Assignment):
+    fields = ('id', 'meal_plan_id', 'client_id', 'assigned_date', 'version',
+              'completed', 'completed_at', 'created_at', 'meal_plans')
+    __slots__ = fields
+    template = MealPlan
+
+
+def assignment_records(workouts, meals):
+    """(workout assignments, meal assignments) rows as records"""
+    return ([WorkoutAssignment.from_row(row) for row in workouts],
+            [MealAssignment.from_row(row) for row in meals])
+
+
+def interned_templates():
+    """Number of templates currently shared across sessions"""
+    return len(_templates)
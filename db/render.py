@@ -0,0 +1,52 @@
+"""
+Rendered workout and meal plan details
+
+A workout's or meal plan's details are shown as one markdown block rather
+than one st.write per exercise or meal, so an expander costs one element
+delta on each rerun instead of one per line.
+
+Since templates are versioned (schema.sql), what a (template, version)
+renders to never changes, so the markdown is memoized process-wide under
+that key: an item is rendered, and its body fetched and its names looked
+up, only the first time any session shows that version, and an edit is
+picked up simply because it comes with a new version. Keys are only ever
+built from rows the session was allowed to read, so sharing the entries
+across sessions shows nobody anything new.
+"""
+
+import streamlit as st
+
+from db.cache import QueryCache
+
+RENDER_CACHE_SIZE = 4096
+# Entries never go stale; the TTL only frees versions nobody shows any more
+RENDER_TTL_SECONDS = 24 * 3600
+
+
+@st.cache_resource
+def get_render_cache():
+    """Process-wide cache of rendered details shared by all sessions"""
+    return QueryCache(max_entries=RENDER_CACHE_SIZE, ttl=RENDER_TTL_SECONDS)
+
+
+def details_key(table, template_id, version, with_description):
+    """Render cache key of a template's details"""
+    return (table, template_id, version, with_description)
+
+
+def details_markdown(table, body, description=None):
+    """Markdown for a workout's exercises or a meal plan's meals, optionally after its description"""
+    lines = []
+    if description is not None:
+        lines += [f"**Description:** {description or 'N/A'}", ""]
+    if table == 'workouts':
+        lines += ["**Exercises:**", ""]
+        for i, ex in enumerate(body, 1):
+            lines.append(f"{i}. {ex.get('name', 'N/A')} - {ex.get('sets', 'N/A')} sets x {ex.get('reps', 'N/A')} reps")
+    else:
+        lines += ["**Meals:**", ""]
+        for i, meal in enumerate(body, 1):
+            # Trailing double spaces break the line inside the list item
+            items = str(meal.get('items', 'N/A')).replace('\n', '  \n   ')
+            lines.append(f"{i}. **{meal.get('name', 'N/A')}** ({meal.get('time', 'N/A')})  \n   {items}")
+    return '\n'.join(lines)
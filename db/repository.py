@@ -0,0 +1,470 @@
+"""
+Repository layer for the app's tables
+
+All reads and writes of profiles, workouts and meal_plans (and their
+versions), the two assignment tables, the exercise/food catalog, the
+adherence aggregates and the background job queue go through a Repository. SupabaseRepository talks to
+PostgREST; SQLiteRepository (db/sqlite_repository.py) mirrors schema.sql in a
+local SQLite database so the data layer can be exercised and benchmarked
+without a Supabase project.
+
+Repository methods raise on failure; surfacing errors to the user is left
+to the Streamlit functions in app.py.
+"""
+
+import json
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+
+from db.bulk import batches
+from db.catalog import CATALOG_KINDS
+from db.pagination import EXPORT_PAGE_SIZE, history_page_query, page_query
+from db.search import CLIENT_COLUMNS, CLIENT_SEARCH_LIMIT, apply_search
+
+# Columns shown in template lists; the exercises/meals JSONB is loaded on demand
+TEMPLATE_SUMMARY_COLUMNS = 'id, title, description, version, created_at'
+
+# Assignment table -> (template column, template table, embed key)
+ASSIGNMENT_TABLES = {
+    'workout_assignments': ('workout_id', 'workouts', 'workouts'),
+    'meal_assignments': ('meal_plan_id', 'meal_plans', 'meal_plans'),
+}
+
+CATALOG_COLUMNS = 'id, kind, name'
+
+# Template table -> (versions table, its template column)
+VERSION_TABLES = {
+    'workouts': ('workout_versions', 'workout_id'),
+    'meal_plans': ('meal_plan_versions', 'meal_plan_id'),
+}
+VERSION_COLUMNS = 'version, title, description, body_hash, created_at'
+# Assignment columns written to history exports; the pinned version's
+# title is embedded under the versions table name
+HISTORY_COLUMNS = 'id, assigned_date, version, completed, completed_at'
+
+# Attempts a job gets before it is marked failed (see db/jobs.py)
+JOB_MAX_ATTEMPTS = 3
+
+# Template table -> column holding its JSONB body
+TEMPLATE_BODIES = {
+    'workouts': 'exercises',
+    'meal_plans': 'meals',
+}
+
+
+def utc_iso(seconds=0):
+    """ISO timestamp seconds from now, in UTC"""
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+class Repository(ABC):
+    """Data access interface shared by the backends
+
+    Templates are 'workouts' or 'meal_plans'; assignment tables are
+    'workout_assignments' or 'meal_assignments'. Rows are plain dicts shaped
+    like the PostgREST responses. A backend must implement every method
+    before it can be created.
+    """
+
+    # Profiles
+    @abstractmethod
+    def get_profile(self, user_id):
+        """Profile row for a user, or None"""
+
+    @abstractmethod
+    def update_profile(self, user_id, fields):
+        """Update columns of a user's profile"""
+
+    @abstractmethod
+    def search_clients(self, search='', limit=CLIENT_SEARCH_LIMIT):
+        """Up to limit clients whose name or email contains search"""
+
+    @abstractmethod
+    def find_clients(self, emails):
+        """Clients whose email is one of emails (compared as stored, lower case)"""
+
+    # Templates
+    @abstractmethod
+    def create_template(self, table, trainer_id, title, description, body):
+        """Insert a workout or meal plan and return the new row"""
+
+    @abstractmethod
+    def create_templates(self, table, trainer_id, templates):
+        """Insert {title, description, body} dicts with multi-row inserts
+
+        Returns the number of templates inserted.
+        """
+
+    @abstractmethod
+    def list_templates(self, table, trainer_id, after=None, limit=None):
+        """Summaries of a trainer's templates that are not archived, newest first, keyset paged"""
+
+    @abstractmethod
+    def get_template_body(self, table, template_id, version=None):
+        """The exercises or meals list of one template, as of version if given"""
+
+    @abstractmethod
+    def update_template(self, table, template_id, title, description, body):
+        """Edit a template; returns its version number after the edit
+
+        A new version is recorded only if something changed (see schema.sql).
+        """
+
+    @abstractmethod
+    def clone_template(self, table, template_id, title):
+        """Copy a template under a new title and return the new row"""
+
+    @abstractmethod
+    def list_versions(self, table, template_id):
+        """Versions of a template ({version, title, description, body_hash, created_at}), newest first"""
+
+    @abstractmethod
+    def archive_template(self, table, template_id, today):
+        """Hide a template and drop its open assignments from today on
+
+        Past and completed assignments keep the version they were given.
+        """
+
+    @abstractmethod
+    def delete_template(self, table, template_id):
+        """Delete a template (and, by cascade, its assignments and versions)"""
+
+    @abstractmethod
+    def templates_with_item(self, table, trainer_id, item_id):
+        """Summaries of a trainer's templates whose body references a catalog item"""
+
+    @abstractmethod
+    def find_templates(self, table, trainer_id, titles):
+        """Summaries of a trainer's templates that are not archived and have one of titles"""
+
+    # Catalog
+    @abstractmethod
+    def list_catalog(self, kind):
+        """All catalog items ({id, kind, name}) of kind 'exercise' or 'food'"""
+
+    @abstractmethod
+    def get_catalog_items(self, ids):
+        """Catalog items with the given ids"""
+
+    @abstractmethod
+    def intern_catalog_items(self, kind, names):
+        """Catalog items for names, adding the ones not in the catalog yet
+
+        Names equal up to case and spacing map to one item (see db/catalog.py).
+        """
+
+    # Assignments
+    @abstractmethod
+    def insert_assignment(self, table, row):
+        """Insert a single assignment row"""
+
+    @abstractmethod
+    def upsert_assignments(self, table, rows):
+        """Insert rows, skipping existing (template, client, date) rows
+
+        Returns (inserted, skipped).
+        """
+
+    @abstractmethod
+    def get_checklist(self, client_id, assigned_date):
+        """(workout assignments, meal assignments) of a client for one date
+
+        Each assignment embeds its template under 'workouts' / 'meal_plans'.
+        """
+
+    @abstractmethod
+    def get_schedule(self, client_id, start, end):
+        """(workout assignments, meal assignments) of a client from start to end
+
+        Ordered by date. Each assignment embeds a template summary (id,
+        title, description) under 'workouts' / 'meal_plans'; the exercises
+        and meals are loaded with get_template_body.
+        """
+
+    @abstractmethod
+    def get_assignments(self, workout_ids, meal_ids):
+        """(workout assignments, meal assignments) with the given ids, shaped like get_checklist
+
+        For rows a session hears about from the change feed (db/changes.py).
+        """
+
+    @abstractmethod
+    def get_history_page(self, table, client_id, after=None, limit=EXPORT_PAGE_SIZE):
+        """One page of a client's assignments, oldest first, for exports
+
+        Rows have HISTORY_COLUMNS and embed the title of the version they
+        were assigned with under 'workout_versions' / 'meal_plan_versions'.
+        after is the (assigned_date, id) cursor of the previous page.
+        """
+
+    @abstractmethod
+    def set_completed(self, table, assignment_id, completed, completed_at):
+        """Set the completion state of one assignment"""
+
+    @abstractmethod
+    def set_completions(self, workouts, meals):
+        """Apply batched completion changes ({id, completed, completed_at} dicts)"""
+
+    # Analytics
+    @abstractmethod
+    def get_adherence(self, trainer_id, since, until):
+        """A trainer's adherence counts for the weeks from since to until
+
+        Rows are {grain, id, name, kind, week_start, assigned, completed}:
+        grain 'client' rows are per client and week, grain 'template' rows
+        per workout / meal plan and week.
+        """
+
+    # Jobs
+    @abstractmethod
+    def enqueue_job(self, owner_id, kind, params, max_attempts=JOB_MAX_ATTEMPTS):
+        """Add a queued job and return its row"""
+
+    @abstractmethod
+    def claim_job(self, owner_id, lease_seconds):
+        """Mark the owner's next runnable job running and return it, or None
+
+        Runnable jobs are queued ones whose run_after has passed and running
+        ones whose lease expired (their worker stopped). Claiming counts an
+        attempt and leases the job for lease_seconds.
+        """
+
+    @abstractmethod
+    def set_job_progress(self, job_id, done, total, lease_seconds):
+        """Record progress of a running job and extend its lease"""
+
+    @abstractmethod
+    def finish_job(self, job_id, result):
+        """Mark a job done with its JSON result"""
+
+    @abstractmethod
+    def fail_job(self, job_id, error, retry_in=None):
+        """Record a failed attempt: queue it again in retry_in seconds, or mark it failed"""
+
+    @abstractmethod
+    def list_jobs(self, owner_id, limit):
+        """The owner's most recent jobs, newest first"""
+
+
+class SupabaseRepository(Repository):
+    """Repository backed by a Supabase client"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_profile(self, user_id):
+        response = self.client.table('profiles').select('*').eq('id', user_id).execute()
+        return response.data[0] if response.data else None
+
+    def update_profile(self, user_id, fields):
+        self.client.table('profiles').update(fields).eq('id', user_id).execute()
+
+    def search_clients(self, search='', limit=CLIENT_SEARCH_LIMIT):
+        query = self.client.table('profiles').select(CLIENT_COLUMNS).eq('role', 'client')
+        query = apply_search(query, search, ['full_name', 'email'])
+        return query.order('full_name').limit(limit).execute().data
+
+    def find_clients(self, emails):
+        if not emails:
+            return []
+        return self.client.table('profiles').select(CLIENT_COLUMNS).eq('role', 'client') \
+            .in_('email', list(emails)).execute().data
+
+    def create_template(self, table, trainer_id, title, description, body):
+        data = {
+            'trainer_id': trainer_id,
+            'title': title,
+            'description': description,
+            TEMPLATE_BODIES[table]: body
+        }
+        return self.client.table(table).insert(data).execute().data[0]
+
+    def create_templates(self, table, trainer_id, templates):
+        # Imported here so the module loads without the Supabase SDK
+        from postgrest.types import ReturnMethod
+
+        rows = [
+            {'trainer_id': trainer_id, 'title': t['title'], 'description': t['description'],
+             TEMPLATE_BODIES[table]: t['body']}
+            for t in templates
+        ]
+        for batch in batches(rows):
+            # The new rows are not needed, so skip sending them back
+            self.client.table(table).insert(batch, returning=ReturnMethod.minimal).execute()
+        return len(rows)
+
+    def list_templates(self, table, trainer_id, after=None, limit=None):
+        query = self.client.table(table).select(TEMPLATE_SUMMARY_COLUMNS).eq('trainer_id', trainer_id)
+        query = query.is_('archived_at', 'null')
+        return page_query(query, after=after, limit=limit).execute().data
+
+    def get_template_body(self, table, template_id, version=None):
+        if version is not None:
+            versions, template_column = VERSION_TABLES[table]
+            # body is the computed column body(version row) from schema.sql
+            response = self.client.table(versions).select('body') \
+                .eq(template_column, template_id).eq('version', version).execute()
+            return response.data[0]['body'] or []
+        column = TEMPLATE_BODIES[table]
+        response = self.client.table(table).select(column).eq('id', template_id).execute()
+        return response.data[0][column] or []
+
+    def update_template(self, table, template_id, title, description, body):
+        data = {'title': title, 'description': description, TEMPLATE_BODIES[table]: body}
+        return self.client.table(table).update(data).eq('id', template_id).execute().data[0]['version']
+
+    def clone_template(self, table, template_id, title):
+        column = TEMPLATE_BODIES[table]
+        source = self.client.table(table).select(f"trainer_id, description, {column}") \
+            .eq('id', template_id).execute().data[0]
+        return self.create_template(table, source['trainer_id'], title, source['description'], source[column])
+
+    def list_versions(self, table, template_id):
+        versions, template_column = VERSION_TABLES[table]
+        return self.client.table(versions).select(VERSION_COLUMNS).eq(template_column, template_id) \
+            .order('version', desc=True).execute().data
+
+    def archive_template(self, table, template_id, today):
+        self.client.table(table).update({'archived_at': utc_iso()}).eq('id', template_id).execute()
+        for assignments, (template_column, templates, _) in ASSIGNMENT_TABLES.items():
+            if templates == table:
+                self.client.table(assignments).delete().eq(template_column, template_id) \
+                    .gte('assigned_date', today).eq('completed', False).execute()
+
+    def delete_template(self, table, template_id):
+        self.client.table(table).delete().eq('id', template_id).execute()
+
+    def templates_with_item(self, table, trainer_id, item_id):
+        # JSONB containment, served by the GIN index on the body column
+        id_key = CATALOG_KINDS[table][1]
+        query = self.client.table(table).select(TEMPLATE_SUMMARY_COLUMNS).eq('trainer_id', trainer_id).is_('archived_at', 'null')
+        query = query.filter(TEMPLATE_BODIES[table], 'cs', json.dumps([{id_key: item_id}]))
+        return page_query(query).execute().data
+
+    def find_templates(self, table, trainer_id, titles):
+        if not titles:
+            return []
+        query = self.client.table(table).select(TEMPLATE_SUMMARY_COLUMNS).eq('trainer_id', trainer_id).is_('archived_at', 'null')
+        return page_query(query.in_('title', list(titles))).execute().data
+
+    def list_catalog(self, kind):
+        return self.client.table('catalog_items').select(CATALOG_COLUMNS).eq('kind', kind).execute().data
+
+    def get_catalog_items(self, ids):
+        if not ids:
+            return []
+        return self.client.table('catalog_items').select(CATALOG_COLUMNS).in_('id', list(ids)).execute().data
+
+    def intern_catalog_items(self, kind, names):
+        return self.client.rpc('intern_catalog_items', {
+            'p_kind': kind,
+            'p_names': list(names)
+        }).execute().data
+
+    def insert_assignment(self, table, row):
+        self.client.table(table).insert(row).execute()
+
+    def upsert_assignments(self, table, rows):
+        template_column = ASSIGNMENT_TABLES[table][0]
+        inserted = 0
+        for batch in batches(rows):
+            response = self.client.table(table).upsert(
+                batch,
+                ignore_duplicates=True,
+                on_conflict=f"{template_column},client_id,assigned_date"
+            ).execute()
+            inserted += len(response.data)
+        return inserted, len(rows) - inserted
+
+    def get_checklist(self, client_id, assigned_date):
+        # Both lists come back from one RPC (see get_client_checklist in schema.sql)
+        response = self.client.rpc('get_client_checklist', {
+            'p_client_id': client_id,
+            'p_date': assigned_date
+        }).execute()
+        checklist = response.data[0] if response.data else {}
+        return checklist.get('workouts') or [], checklist.get('meals') or []
+
+    def get_schedule(self, client_id, start, end):
+        # One range query over (client_id, assigned_date); see get_client_schedule in schema.sql
+        response = self.client.rpc('get_client_schedule', {
+            'p_client_id': client_id,
+            'p_start': start,
+            'p_end': end
+        }).execute()
+        schedule = response.data[0] if response.data else {}
+        return schedule.get('workouts') or [], schedule.get('meals') or []
+
+    def get_assignments(self, workout_ids, meal_ids):
+        # See get_assignments_by_id in schema.sql
+        response = self.client.rpc('get_assignments_by_id', {
+            'p_workout_ids': list(workout_ids),
+            'p_meal_ids': list(meal_ids)
+        }).execute()
+        assignments = response.data[0] if response.data else {}
+        return assignments.get('workouts') or [], assignments.get('meals') or []
+
+    def get_history_page(self, table, client_id, after=None, limit=EXPORT_PAGE_SIZE):
+        versions = VERSION_TABLES[ASSIGNMENT_TABLES[table][1]][0]
+        # Embedded through the (template, version) foreign key from schema.sql
+        query = self.client.table(table).select(f'{HISTORY_COLUMNS}, {versions}(title)').eq('client_id', client_id)
+        return history_page_query(query, after=after, limit=limit).execute().data
+
+    def set_completed(self, table, assignment_id, completed, completed_at):
+        data = {'completed': completed, 'completed_at': completed_at}
+        self.client.table(table).update(data).eq('id', assignment_id).execute()
+
+    def set_completions(self, workouts, meals):
+        self.client.rpc('set_assignment_completion', {
+            'p_workouts': workouts,
+            'p_meals': meals
+        }).execute()
+
+    def get_adherence(self, trainer_id, since, until):
+        # Pre-aggregated per client, template and week (see adherence_weekly in schema.sql)
+        return self.client.rpc('get_trainer_adherence', {
+            'p_trainer_id': trainer_id,
+            'p_since': since,
+            'p_until': until
+        }).execute().data
+
+    def enqueue_job(self, owner_id, kind, params, max_attempts=JOB_MAX_ATTEMPTS):
+        data = {'owner_id': owner_id, 'kind': kind, 'params': params, 'max_attempts': max_attempts}
+        return self.client.table('jobs').insert(data).execute().data[0]
+
+    def claim_job(self, owner_id, lease_seconds):
+        # FOR UPDATE SKIP LOCKED, so two workers never claim the same job (see claim_job in schema.sql)
+        rows = self.client.rpc('claim_job', {
+            'p_owner_id': owner_id,
+            'p_lease_seconds': lease_seconds
+        }).execute().data
+        return rows[0] if rows else None
+
+    def set_job_progress(self, job_id, done, total, lease_seconds):
+        self.client.table('jobs').update({
+            'done': done,
+            'total': total,
+            'locked_until': utc_iso(lease_seconds),
+            'updated_at': utc_iso()
+        }).eq('id', job_id).execute()
+
+    def finish_job(self, job_id, result):
+        self.client.table('jobs').update({
+            'status': 'done',
+            'result': result,
+            'locked_until': None,
+            'updated_at': utc_iso()
+        }).eq('id', job_id).execute()
+
+    def fail_job(self, job_id, error, retry_in=None):
+        data = {'error': error, 'locked_until': None, 'updated_at': utc_iso()}
+        if retry_in is None:
+            data['status'] = 'failed'
+        else:
+            data.update(status='queued', run_after=utc_iso(retry_in))
+        self.client.table('jobs').update(data).eq('id', job_id).execute()
+
+    def list_jobs(self, owner_id, limit):
+        # Newest first with the id tiebreak, sent as one order param (see page_query)
+        return page_query(self.client.table('jobs').select('*').eq('owner_id', owner_id), limit=limit) \
+            .execute().data
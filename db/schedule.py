@@ -0,0 +1,167 @@
+"""
+Client schedule windows
+
+The client calendar shows a week or a month at a time. Each window is
+fetched with one range query (Repository.get_schedule, served by the
+(client_id, assigned_date) indexes) and kept in a per-session
+ScheduleCache, so moving back and forth between windows, or leaving the
+page open past midnight, does not query day by day. After a window is
+shown, the next one is fetched on a background thread so paging forward is
+usually a cache hit.
+
+Background fetches must not touch st.session_state (there is no script
+context on the worker thread): the cache only keeps their Futures and
+collects the results on the next rerun that needs them.
+
+While the change feed is live (db/changes.py) windows do not expire:
+apply_changes() and merge() keep them current instead.
+"""
+
+import calendar
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import streamlit as st
+
+from db.changes import apply_changes, merge_rows
+
+# Seconds a fetched window is reused before it is fetched again
+SCHEDULE_TTL_SECONDS = 300
+# Windows kept per session; the oldest is dropped beyond this
+MAX_WINDOWS = 12
+# Background fetches running at once across all sessions
+PREFETCH_WORKERS = 4
+
+VIEWS = ('Week', 'Month')
+
+
+@st.cache_resource
+def get_prefetch_executor():
+    """Process-wide thread pool for background schedule fetches"""
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='schedule-prefetch')
+
+
+def window(view, day):
+    """(start, end) dates of the week (Monday to Sunday) or month containing day"""
+    if view == 'Week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    last = calendar.monthrange(day.year, day.month)[1]
+    return day.replace(day=1), day.replace(day=last)
+
+
+def next_window(view, start):
+    """The window after the one starting at start"""
+    if view == 'Week':
+        return window(view, start + timedelta(days=7))
+    return window(view, window(view, start)[1] + timedelta(days=1))
+
+
+def previous_window(view, start):
+    """The window before the one starting at start"""
+    return window(view, start - timedelta(days=1))
+
+
+def group_by_day(workouts, meals):
+    """{ISO date: {'workouts': [...], 'meals': [...]}} for the assignments"""
+    days = {}
+    for kind, rows in (('workouts', workouts), ('meals', meals)):
+        for row in rows:
+            day = days.setdefault(row['assigned_date'], {'workouts': [], 'meals': []})
+            day[kind].append(row)
+    return days
+
+
+class ScheduleCache:
+    """Per-session cache of schedule windows with background prefetching
+
+    load(start, end) returns (workouts, meals) for the dates start..end.
+    While live is set, fetched windows are kept until changed or dropped.
+    """
+
+    def __init__(self, ttl=SCHEDULE_TTL_SECONDS, max_windows=MAX_WINDOWS, clock=time.time):
+        self.ttl = ttl
+        self.max_windows = max_windows
+        self.clock = clock
+        self.live = False
+        self._windows = {}  # (start, end) -> (fetched_at, workouts, meals)
+        self._prefetching = {}  # (start, end) -> (submitted_at, Future)
+
+    def _fresh(self, key):
+        entry = self._windows.get(key)
+        return entry is not None and (self.live or self.clock() - entry[0] < self.ttl)
+
+    def _store(self, key, fetched_at, workouts, meals):
+        self._windows.pop(key, None)
+        self._windows[key] = (fetched_at, workouts, meals)
+        while len(self._windows) > self.max_windows:
+            del self._windows[next(iter(self._windows))]
+
+    def _collect(self, key):
+        """Move a finished (or in-flight) prefetch into the cache"""
+        submitted_at, future = self._prefetching.pop(key, (None, None))
+        if future is None:
+            return
+        try:
+            self._store(key, submitted_at, *future.result())
+        except Exception:
+            pass  # a failed prefetch just means a normal load
+
+    def get(self, start, end, load):
+        """(workouts, meals) for start..end, loading the window if needed"""
+        key = (start, end)
+        self._collect(key)
+        if not self._fresh(key):
+            fetched_at = self.clock()
+            self._store(key, fetched_at, *load(start, end))
+        _, workouts, meals = self._windows[key]
+        return workouts, meals
+
+    def prefetch(self, start, end, load, executor):
+        """Start loading start..end in the background unless it is cached"""
+        key = (start, end)
+        if self._fresh(key) or key in self._prefetching:
+            return
+        self._prefetching[key] = (self.clock(), executor.submit(load, start, end))
+        # Windows paged away from are never collected; forget the oldest
+        while len(self._prefetching) > self.max_windows:
+            del self._prefetching[next(iter(self._prefetching))]
+
+    def apply(self, written):
+        """Update cached rows with saved completions {(kind, id): (completed, completed_at)}"""
+        for _, workouts, meals in self._windows.values():
+            for kind, rows in (('workout', workouts), ('meal', meals)):
+                for row in rows:
+                    change = written.get((kind, row['id']))
+                    if change:
+                        row['completed'], row['completed_at'] = change
+
+    def apply_changes(self, changes):
+        """Apply feed changes to the cached windows; returns {table: ids} to fetch and merge()"""
+        # Finished prefetches get the changes like any window; one still
+        # running may have read the rows before them
+        for key, (_, future) in list(self._prefetching.items()):
+            if future.done():
+                self._collect(key)
+        self._prefetching.clear()
+        fetch = {'workout_assignments': set(), 'meal_assignments': set()}
+        for (start, end), (_, workouts, meals) in self._windows.items():
+            first, last = start.isoformat(), end.isoformat()
+            lists = {'workout_assignments': workouts, 'meal_assignments': meals}
+            wanted = lambda change: first <= change['assigned_date'] <= last
+            for table, ids in apply_changes(lists, changes, wanted).items():
+                fetch[table] |= ids
+        return fetch
+
+    def merge(self, workouts, meals):
+        """Add fetched assignments to the windows covering their dates"""
+        for (start, end), (_, cached_workouts, cached_meals) in self._windows.items():
+            first, last = start.isoformat(), end.isoformat()
+            for rows, fetched in ((cached_workouts, workouts), (cached_meals, meals)):
+                ids = {row['id'] for row in fetched if first <= row['assigned_date'] <= last}
+                merge_rows(rows, fetched, ids - {row['id'] for row in rows})
+
+    def clear(self):
+        self._windows.clear()
+        self._prefetching.clear()
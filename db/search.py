@@ -0,0 +1,33 @@
+"""
+Client search helpers
+
+Trainers pick clients through a search box rather than a selectbox holding
+every client in the tenant. Matching runs in Postgres against the trigram
+indexes on profiles.full_name and profiles.email (see schema.sql), and only
+the columns the pickers display are returned.
+"""
+
+CLIENT_COLUMNS = 'id, full_name, email'
+CLIENT_SEARCH_LIMIT = 20
+
+
+def escape_like(term):
+    """term with LIKE's wildcards backslash-escaped, so % and _ match themselves
+
+    PostgREST turns every * into %, so a * cannot be sent literally; both
+    backends treat it as matching any one character (_) instead.
+    """
+    return ''.join('\\' + ch if ch in '\\%_' else '_' if ch == '*' else ch for ch in term)
+
+
+def apply_search(query, term, columns):
+    """Filter a query to rows where any of columns contains term (case-insensitive)"""
+    # Double quotes and backslashes would end the quoted PostgREST value
+    term = ''.join(ch for ch in term.strip() if ch not in '"\\')
+    if not term:
+        return query
+    # Inside a quoted value PostgREST reads \\ as \, which ILIKE then takes as its escape
+    pattern = escape_like(term).replace('\\', '\\\\')
+    conditions = ','.join(f'{column}.ilike."*{pattern}*"' for column in columns)
+    query.params = query.params.add('or', f'({conditions})')
+    return query
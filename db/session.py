@@ -0,0 +1,148 @@
+"""
+Signed-in sessions and access token refresh
+
+Supabase access tokens are short-lived JWTs (an hour by default). gotrue's
+own auto refresh starts a Timer thread per client a few seconds before
+expiry, never cancels it when the browser tab goes away and stops after a
+failed attempt, after which the next query fails with "JWT expired" and the
+user has to sign in again. It also refreshes from get_session() on whichever
+thread builds a request first, so the threads of one rerun (db/fetch.py)
+can race to spend the same single-use refresh token.
+
+The app turns it off (db/client.py) and keeps an AuthSession per browser
+session instead. One TokenRefresher thread per process refreshes every
+session whose token expires within REFRESH_MARGIN_SECONDS, well ahead of
+time and again on the next poll if an attempt fails; sessions are held
+weakly, so a closed tab is simply forgotten. AuthSession.refresh() runs at
+most one refresh at a time and anyone asking meanwhile waits for it. Each
+rerun calls ensure_fresh() first, which only waits for a refresh when the
+token would expire during the rerun (e.g. the process was suspended).
+"""
+
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+import streamlit as st
+
+# Tokens expiring within this many seconds are refreshed in the background
+REFRESH_MARGIN_SECONDS = 300
+# Seconds between the refresher's passes over the sessions
+REFRESH_POLL_SECONDS = 30
+# A rerun whose token expires sooner than this waits for a refresh first
+RERUN_MARGIN_SECONDS = 60
+# Seconds to wait for a refresh before giving up on it
+REFRESH_TIMEOUT_SECONDS = 10
+# Auth API statuses meaning the refresh token is no longer valid
+REJECTED_STATUSES = (400, 401, 403)
+
+logger = logging.getLogger(__name__)
+
+
+class AuthSession:
+    """Tokens of one browser session's sign in
+
+    auth is the session's gotrue client and session the gotrue Session it
+    signed in with. rejected is set once the refresh token has been turned
+    down; only signing in again helps then.
+    """
+
+    def __init__(self, auth, session, clock=time.time):
+        self.auth = auth
+        self.clock = clock
+        self.expires_at = session.expires_at
+        self.rejected = False
+        self._refresh_token = session.refresh_token
+        self._refreshing = None  # Future of the refresh in flight
+        self._lock = threading.Lock()
+
+    def expires_in(self):
+        """Seconds until the access token expires"""
+        if self.expires_at is None:
+            return float('inf')
+        return self.expires_at - self.clock()
+
+    def refresh(self):
+        """Refresh the tokens, or wait for the refresh already running
+
+        Raises what the refresh raised.
+        """
+        with self._lock:
+            future = self._refreshing
+            if future is None:
+                future = self._refreshing = Future()
+                running = False
+            else:
+                running = True
+        if not running:
+            try:
+                response = self.auth.refresh_session(self._refresh_token)
+                self.expires_at = response.session.expires_at
+                self._refresh_token = response.session.refresh_token
+                future.set_result(True)
+            except Exception as e:
+                if getattr(e, 'status', None) in REJECTED_STATUSES:
+                    self.rejected = True
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._refreshing = None
+        return future.result(REFRESH_TIMEOUT_SECONDS)
+
+    def ensure_fresh(self, margin=RERUN_MARGIN_SECONDS):
+        """Refresh now if the token expires within margin; returns False once rejected"""
+        if not self.rejected and self.expires_in() <= margin:
+            self.refresh()
+        return not self.rejected
+
+
+class TokenRefresher:
+    """Thread refreshing the AuthSessions added to it before their tokens expire"""
+
+    def __init__(self, margin=REFRESH_MARGIN_SECONDS, poll=REFRESH_POLL_SECONDS):
+        self.margin = margin
+        self.poll = poll
+        self._sessions = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, session):
+        with self._lock:
+            self._sessions.add(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='token-refresh', daemon=True)
+                self._thread.start()
+
+    def discard(self, session):
+        with self._lock:
+            self._sessions.discard(session)
+
+    def refresh_due(self):
+        """Refresh every session expiring within the margin; returns how many were refreshed"""
+        with self._lock:
+            sessions = list(self._sessions)
+        refreshed = 0
+        for session in sessions:
+            if session.rejected:
+                self.discard(session)
+            elif session.expires_in() <= self.margin:
+                try:
+                    session.refresh()
+                    refreshed += 1
+                except Exception as e:
+                    # Tried again on the next pass unless rejected
+                    logger.warning("Token refresh failed: %s", str(e))
+        return refreshed
+
+    def run(self):
+        while True:
+            time.sleep(self.poll)
+            self.refresh_due()
+
+
+@st.cache_resource
+def get_token_refresher():
+    """Process-wide token refresher shared by all sessions"""
+    return TokenRefresher()
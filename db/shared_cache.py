@@ -0,0 +1,460 @@
+"""
+Query cache shared between app workers
+
+Each Streamlit process has its own QueryCache (db/cache.py), so with N
+replicas behind a load balancer every list is loaded N times, and a restart
+starts cold. Setting CACHE_URL puts a store shared by the workers behind it:
+
+    sqlite:////var/cache/trainer/cache.db   workers on one host (a local file)
+    redis://cache:6379/0                    workers anywhere (Redis or compatible)
+    memory://                               an in-process FakeRedis, for tests
+
+SharedQueryCache keeps the QueryCache interface. A lookup tries the worker's
+own entries first (for LOCAL_TTL_SECONDS), then the store, then the loader,
+and loaded values go to both. The write functions in app.py already
+invalidate what they change; with a shared cache invalidate() also deletes
+the shared entries and announces (name, owner) to the other workers, which
+drop their local copies: over Redis pub/sub, or through a log table that
+each worker polls every INVALIDATION_POLL_SECONDS with SQLite. A worker that
+misses a message serves its copy for at most LOCAL_TTL_SECONDS.
+
+A load can race a write: worker A misses and starts loading, worker B
+writes and invalidates, and A then stores the rows it read before B's
+write, which other workers would serve for the shared TTL. So the store
+keeps a generation per (name, owner) that invalidate() advances;
+get_or_load reads it before loading, and the value is only stored if it
+has not moved since.
+
+Values are stored as JSON, never pickled, so whoever can write to the store
+cannot make the workers run code. If the store is unreachable the cache
+falls back to its local entries and logs a warning.
+"""
+
+import fnmatch
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from db.cache import DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS, QueryCache
+
+# Seconds a worker reuses its own copy of a shared entry
+LOCAL_TTL_SECONDS = 30
+# Seconds between a SQLite-backed worker's checks for invalidations
+INVALIDATION_POLL_SECONDS = 1
+# Seconds invalidations are kept in the SQLite log
+INVALIDATION_LOG_SECONDS = 3600
+# Seconds before a dropped Redis subscription is retried
+RESUBSCRIBE_SECONDS = 5
+# Redis channel the workers announce invalidations on
+INVALIDATION_CHANNEL = 'query_cache:invalidate'
+# Seconds a Redis generation counter outlives its last invalidation; far
+# longer than any load
+GENERATION_SECONDS = 3600
+
+logger = logging.getLogger(__name__)
+
+
+def encode_key(key):
+    """Store key of a cache key tuple"""
+    return json.dumps(key, default=str, separators=(',', ':'))
+
+
+def key_owner(key):
+    """The owner id of a cache key, or None"""
+    return key[1] if len(key) > 1 else None
+
+
+class SQLiteCacheStore:
+    """Shared entries in a SQLite file, for the workers of one host"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        key TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        owner TEXT,
+        value TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS cache_entries_group ON cache_entries (name, owner);
+    CREATE TABLE IF NOT EXISTS cache_invalidations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        owner TEXT,
+        created_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.clock = clock
+        # Autocommit; each write is its own transaction
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        # Invalidations made before this worker started are already reflected
+        self._seen = self.connection.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM cache_invalidations"
+        ).fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?", (key, self.clock())
+            ).fetchone()
+        return row[0] if row else None
+
+    def _generation(self, name, owner):
+        # The last logged invalidation covering (name, owner)
+        return self.connection.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM cache_invalidations WHERE name = ? AND (owner IS NULL OR owner = ?)",
+            (name, owner)
+        ).fetchone()[0]
+
+    def generation(self, name, owner):
+        """Token that changes whenever the entries of (name, owner) are invalidated"""
+        with self._lock:
+            return self._generation(name, owner)
+
+    def set(self, key, name, owner, value, ttl, generation=None):
+        """Store an entry; given a generation, only if it is still current. Returns whether it was stored"""
+        now = self.clock()
+        with self._lock, self.connection:
+            if generation is not None:
+                self.connection.execute("BEGIN IMMEDIATE")
+                if self._generation(name, owner) != generation:
+                    return False
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, name, owner, value, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, name, owner, value, now + ttl)
+            )
+        return True
+
+    def invalidate(self, name, owner):
+        """Delete the entries of name (for one owner, or all) and log the invalidation"""
+        now = self.clock()
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute(
+                "DELETE FROM cache_entries WHERE name = ? AND (? IS NULL OR owner = ?)", (name, owner, owner)
+            )
+            self.connection.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+            self.connection.execute(
+                "INSERT INTO cache_invalidations (name, owner, created_at) VALUES (?, ?, ?)", (name, owner, now)
+            )
+            self.connection.execute(
+                "DELETE FROM cache_invalidations WHERE created_at < ?", (now - INVALIDATION_LOG_SECONDS,)
+            )
+
+    def poll(self):
+        """(name, owner) of the invalidations logged since the last poll"""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT id, name, owner FROM cache_invalidations WHERE id > ? ORDER BY id", (self._seen,)
+            ).fetchall()
+        if rows:
+            self._seen = rows[-1][0]
+        return [(name, owner) for _, name, owner in rows]
+
+    def listen(self, callback):
+        """Call callback(name, owner) for every invalidation; runs forever"""
+        while True:
+            time.sleep(INVALIDATION_POLL_SECONDS)
+            try:
+                for name, owner in self.poll():
+                    callback(name, owner)
+            except Exception:
+                logger.exception("Could not read cache invalidations")
+
+
+class RedisCacheStore:
+    """Shared entries in Redis, or any server speaking its protocol
+
+    client is a redis.Redis with decode_responses=True, or a FakeRedis.
+    Each (name, owner) group keeps a set of its entry keys, so invalidating
+    a group deletes exactly its entries without scanning the keyspace, and
+    a generation counter, next to one for the whole name.
+    """
+
+    def __init__(self, client, prefix='query_cache'):
+        self.client = client
+        self.prefix = prefix
+
+    def _entry(self, key):
+        return f"{self.prefix}:entry:{key}"
+
+    def _group(self, name, owner):
+        return f"{self.prefix}:group:{name}:{owner}"
+
+    def _counter(self, name, owner=None):
+        if owner is None:
+            return f"{self.prefix}:generation:{name}"
+        return f"{self.prefix}:generation:{name}:{owner}"
+
+    def get(self, key):
+        return self.client.get(self._entry(key))
+
+    def generation(self, name, owner):
+        """Token that changes whenever the entries of (name, owner) are invalidated"""
+        return [self.client.get(self._counter(name)), self.client.get(self._counter(name, owner))]
+
+    def set(self, key, name, owner, value, ttl, generation=None):
+        """Store an entry; given a generation, only if it is still current. Returns whether it was stored"""
+        entry, group = self._entry(key), self._group(name, owner)
+        self.client.set(entry, value, ex=ttl)
+        self.client.sadd(group, entry)
+        self.client.expire(group, ttl)
+        # Checked after the write: an invalidation that advanced the
+        # counters before this read is undone here, and one after it finds
+        # the entry in its group and deletes it
+        if generation is not None and self.generation(name, owner) != generation:
+            self.client.delete(entry)
+            return False
+        return True
+
+    def invalidate(self, name, owner):
+        """Delete the entries of name (for one owner, or all) and announce it"""
+        counter = self._counter(name, owner)
+        self.client.incr(counter)
+        self.client.expire(counter, GENERATION_SECONDS)
+        if owner is None:
+            # Only sign up does this; a scan over the group keys is fine
+            groups = list(self.client.scan_iter(match=f"{self.prefix}:group:{name}:*"))
+        else:
+            groups = [self._group(name, owner)]
+        for group in groups:
+            self.client.delete(*self.client.smembers(group), group)
+        self.client.publish(INVALIDATION_CHANNEL, json.dumps([name, owner]))
+
+    def listen(self, callback):
+        """Call callback(name, owner) for every announced invalidation; runs forever"""
+        while True:
+            try:
+                pubsub = self.client.pubsub()
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        callback(*json.loads(message['data']))
+            except Exception:
+                logger.exception("Cache invalidation subscription failed; resubscribing")
+            time.sleep(RESUBSCRIBE_SECONDS)
+
+
+class FakePubSub:
+    """The subscribe/listen part of a redis PubSub"""
+
+    def __init__(self, server):
+        self.server = server
+        self.messages = queue.Queue()
+
+    def subscribe(self, channel):
+        self.server.subscribe(channel, self)
+
+    def listen(self):
+        while True:
+            yield self.messages.get()
+
+
+class FakeRedis:
+    """In-process stand-in for the Redis commands RedisCacheStore uses
+
+    Clients made with client() share one keyspace and its channels, like
+    connections to one server from several workers.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._values = {}  # key -> (value, expires_at or None)
+        self._channels = {}  # channel -> [FakePubSub]
+        self._lock = threading.Lock()
+
+    def client(self):
+        return self
+
+    def _live(self, key):
+        entry = self._values.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= self.clock():
+            del self._values[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry else None
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._values[key] = (value, self.clock() + ex if ex else None)
+        return True
+
+    def sadd(self, key, *members):
+        with self._lock:
+            entry = self._live(key)
+            values = set(entry[0]) if entry else set()
+            values.update(members)
+            self._values[key] = (values, entry[1] if entry else None)
+        return len(members)
+
+    def smembers(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return set(entry[0]) if entry else set()
+
+    def incr(self, key):
+        with self._lock:
+            entry = self._live(key)
+            value = int(entry[0]) + 1 if entry else 1
+            self._values[key] = (str(value), entry[1] if entry else None)
+        return value
+
+    def expire(self, key, seconds):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                return False
+            self._values[key] = (entry[0], self.clock() + seconds)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._values.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match='*'):
+        with self._lock:
+            keys = [key for key in self._values if self._live(key) and fnmatch.fnmatchcase(key, match)]
+        return iter(keys)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub.messages.put({'type': 'message', 'channel': channel, 'data': message})
+        return len(subscribers)
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    def subscribe(self, channel, pubsub):
+        with self._lock:
+            self._channels.setdefault(channel, []).append(pubsub)
+
+
+class SharedQueryCache(QueryCache):
+    """QueryCache whose entries are also kept in a store shared by all workers
+
+    The inherited entries are this worker's copies; hits and misses count
+    lookups in them, and shared_hits the misses the store answered.
+    """
+
+    def __init__(self, store, ttl=DEFAULT_TTL_SECONDS, local_ttl=LOCAL_TTL_SECONDS,
+                 max_entries=DEFAULT_MAX_ENTRIES, clock=time.monotonic):
+        super().__init__(max_entries=max_entries, ttl=local_ttl, clock=clock)
+        self.store = store
+        self.shared_ttl = ttl
+        self.shared_hits = 0
+
+    def get(self, key):
+        found, value = super().get(key)
+        if found:
+            return True, value
+        try:
+            stored = self.store.get(encode_key(key))
+        except Exception as e:
+            logger.warning("Shared cache read failed: %s", e)
+            return False, None
+        if stored is None:
+            return False, None
+        value = json.loads(stored)
+        super().set(key, value)
+        with self._lock:
+            self.shared_hits += 1
+        return True, value
+
+    def set(self, key, value, generation=None):
+        """Store a value here and in the store
+
+        generation is the store's generation of the key read before the
+        value was loaded; if the key has been invalidated since, the value
+        may predate that write and is dropped.
+        """
+        try:
+            stored = self.store.set(encode_key(key), key[0], key_owner(key),
+                                    json.dumps(value, separators=(',', ':')), self.shared_ttl, generation)
+        except Exception as e:
+            logger.warning("Shared cache write failed: %s", e)
+            stored = True
+        if stored:
+            super().set(key, value)
+
+    def get_or_load(self, key, loader):
+        """QueryCache.get_or_load, keeping the value only if nothing invalidated it while it loaded"""
+        found, value = self.get(key)
+        if found:
+            return value
+        try:
+            generation = self.store.generation(key[0], key_owner(key))
+        except Exception as e:
+            logger.warning("Shared cache read failed: %s", e)
+            value = loader()
+            super().set(key, value)
+            return value
+        value = loader()
+        self.set(key, value, generation)
+        return value
+
+    def invalidate(self, name, owner_id=None):
+        """Drop the entries here and in the store, and tell the other workers"""
+        super().invalidate(name, owner_id)
+        try:
+            self.store.invalidate(name, owner_id)
+        except Exception as e:
+            # The store keeps its entries, and other workers keep reloading
+            # their copies from it, until they expire after shared_ttl
+            logger.warning("Shared cache invalidation failed: %s", e)
+
+    def drop_local(self, name, owner_id=None):
+        """Drop this worker's copies after another worker invalidated them"""
+        super().invalidate(name, owner_id)
+
+    def clear(self):
+        """Drop this worker's copies and reset the counters; the store is left alone"""
+        super().clear()
+        with self._lock:
+            self.shared_hits = 0
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats['shared_hits'] = self.shared_hits
+        return stats
+
+    def follow(self):
+        """Start applying the other workers' invalidations on a daemon thread"""
+        threading.Thread(
+            target=self.store.listen, args=(self.drop_local,), name='cache-invalidations', daemon=True
+        ).start()
+        return self
+
+
+# One fake server per process for memory:// URLs
+_memory_server = FakeRedis()
+
+
+def open_store(url):
+    """The cache store for a CACHE_URL"""
+    if url.startswith('sqlite:///'):
+        return SQLiteCacheStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        import redis
+        return RedisCacheStore(redis.Redis.from_url(url, decode_responses=True))
+    if url == 'memory://':
+        return RedisCacheStore(_memory_server.client())
+    raise ValueError(f"Unsupported CACHE_URL: {url}")
+
+
+def open_shared_cache(url):
+    """SharedQueryCache on the store at url, following other workers' invalidations"""
+    return SharedQueryCache(open_store(url)).follow()
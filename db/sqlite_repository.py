@@ -0,0 +1,779 @@
+"""
+SQLite backend for the repository layer
+
+Mirrors the tables, constraints and indexes of schema.sql closely enough to
+run the app's data functions offline: UUID text ids, JSON columns stored as
+text, ON DELETE CASCADE, the UNIQUE (template, client, date) constraints,
+the catalog, the triggers maintaining adherence_weekly and the jobs queue.
+Row Level Security has no SQLite equivalent and is not emulated, and SQLite
+has no GIN indexes, so templates_with_item scans the trainer's templates.
+
+Use ':memory:' (the default) for tests and benchmarks, or a file path to
+keep the data between runs.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import streamlit as st
+
+from db.catalog import CATALOG_KINDS, catalog_key, reference_body
+from db.pagination import EXPORT_PAGE_SIZE
+from db.repository import ASSIGNMENT_TABLES, HISTORY_COLUMNS, JOB_MAX_ATTEMPTS, TEMPLATE_BODIES, Repository
+from db.search import CLIENT_SEARCH_LIMIT, escape_like
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    email TEXT UNIQUE NOT NULL,
+    full_name TEXT,
+    role TEXT NOT NULL CHECK (role IN ('trainer', 'client')),
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS workouts (
+    id TEXT PRIMARY KEY,
+    trainer_id TEXT NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    title TEXT NOT NULL,
+    description TEXT,
+    exercises TEXT,
+    version INTEGER NOT NULL DEFAULT 1,
+    archived_at TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meal_plans (
+    id TEXT PRIMARY KEY,
+    trainer_id TEXT NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    title TEXT NOT NULL,
+    description TEXT,
+    meals TEXT,
+    version INTEGER NOT NULL DEFAULT 1,
+    archived_at TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS workout_assignments (
+    id TEXT PRIMARY KEY,
+    workout_id TEXT NOT NULL REFERENCES workouts(id) ON DELETE CASCADE,
+    client_id TEXT NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    assigned_date TEXT NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    completed_at TEXT,
+    version INTEGER,
+    created_at TEXT NOT NULL,
+    UNIQUE(workout_id, client_id, assigned_date)
+);
+
+CREATE TABLE IF NOT EXISTS meal_assignments (
+    id TEXT PRIMARY KEY,
+    meal_plan_id TEXT NOT NULL REFERENCES meal_plans(id) ON DELETE CASCADE,
+    client_id TEXT NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    assigned_date TEXT NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    completed_at TEXT,
+    version INTEGER,
+    created_at TEXT NOT NULL,
+    UNIQUE(meal_plan_id, client_id, assigned_date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_workouts_trainer_created ON workouts(trainer_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_meal_plans_trainer_created ON meal_plans(trainer_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_profiles_role_full_name ON profiles(role, full_name);
+CREATE INDEX IF NOT EXISTS idx_workout_assignments_client_date ON workout_assignments(client_id, assigned_date);
+CREATE INDEX IF NOT EXISTS idx_meal_assignments_client_date ON meal_assignments(client_id, assigned_date);
+
+CREATE TABLE IF NOT EXISTS adherence_weekly (
+    client_id TEXT NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL CHECK (kind IN ('workout', 'meal')),
+    template_id TEXT NOT NULL,
+    week_start TEXT NOT NULL,
+    trainer_id TEXT,
+    assigned INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (client_id, kind, template_id, week_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_adherence_weekly_trainer_week ON adherence_weekly(trainer_id, week_start);
+
+CREATE TABLE IF NOT EXISTS template_bodies (
+    hash TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS workout_versions (
+    workout_id TEXT NOT NULL REFERENCES workouts(id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT,
+    body_hash TEXT NOT NULL REFERENCES template_bodies(hash),
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (workout_id, version)
+);
+
+CREATE TABLE IF NOT EXISTS meal_plan_versions (
+    meal_plan_id TEXT NOT NULL REFERENCES meal_plans(id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT,
+    body_hash TEXT NOT NULL REFERENCES template_bodies(hash),
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (meal_plan_id, version)
+);
+
+CREATE TABLE IF NOT EXISTS catalog_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL CHECK (kind IN ('exercise', 'food')),
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    UNIQUE (kind, name_key)
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_id TEXT NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    result TEXT,
+    error TEXT,
+    run_after TEXT NOT NULL,
+    locked_until TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_owner_created ON jobs(owner_id, created_at);
+"""
+
+# Row-level stand-ins for the statement-level adherence triggers in
+# schema.sql. The app only ever updates `completed`, so that is the only
+# update tracked. date(d, 'weekday 0', '-6 days') is the Monday of d's week.
+ADHERENCE_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS {kind}_adherence_insert AFTER INSERT ON {table}
+BEGIN
+    INSERT INTO adherence_weekly (client_id, kind, template_id, week_start, trainer_id, assigned, completed)
+    SELECT NEW.client_id, '{kind}', NEW.{column}, date(NEW.assigned_date, 'weekday 0', '-6 days'),
+           trainer_id, 1, NEW.completed
+    FROM {templates} WHERE id = NEW.{column}
+    ON CONFLICT (client_id, kind, template_id, week_start) DO UPDATE
+    SET assigned = assigned + 1, completed = completed + excluded.completed;
+END;
+
+CREATE TRIGGER IF NOT EXISTS {kind}_adherence_update AFTER UPDATE OF completed ON {table}
+WHEN OLD.completed <> NEW.completed
+BEGIN
+    UPDATE adherence_weekly SET completed = completed + NEW.completed - OLD.completed
+    WHERE client_id = NEW.client_id AND kind = '{kind}' AND template_id = NEW.{column}
+      AND week_start = date(NEW.assigned_date, 'weekday 0', '-6 days');
+END;
+
+CREATE TRIGGER IF NOT EXISTS {kind}_adherence_delete AFTER DELETE ON {table}
+BEGIN
+    UPDATE adherence_weekly SET assigned = assigned - 1, completed = completed - OLD.completed
+    WHERE client_id = OLD.client_id AND kind = '{kind}' AND template_id = OLD.{column}
+      AND week_start = date(OLD.assigned_date, 'weekday 0', '-6 days');
+    DELETE FROM adherence_weekly
+    WHERE client_id = OLD.client_id AND kind = '{kind}' AND template_id = OLD.{column}
+      AND week_start = date(OLD.assigned_date, 'weekday 0', '-6 days') AND assigned <= 0;
+END;
+"""
+
+# Stand-ins for the assignment change triggers in schema.sql:
+# assignment_changed() is a Python function registered on the connection
+# that queues the row, and SQLiteRepository hands the queue to on_change
+# once the write commits, as NOTIFY is delivered on commit.
+CHANGE_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS {table}_announce_insert AFTER INSERT ON {table}
+BEGIN
+    SELECT assignment_changed('{table}', 'INSERT', NEW.id, NEW.client_id,
+        (SELECT trainer_id FROM {templates} WHERE id = NEW.{column}),
+        NEW.assigned_date, NEW.version, NEW.completed, NEW.completed_at);
+END;
+
+CREATE TRIGGER IF NOT EXISTS {table}_announce_update AFTER UPDATE ON {table}
+BEGIN
+    SELECT assignment_changed('{table}', 'UPDATE', NEW.id, NEW.client_id,
+        (SELECT trainer_id FROM {templates} WHERE id = NEW.{column}),
+        NEW.assigned_date, NEW.version, NEW.completed, NEW.completed_at);
+END;
+
+CREATE TRIGGER IF NOT EXISTS {table}_announce_delete AFTER DELETE ON {table}
+BEGIN
+    SELECT assignment_changed('{table}', 'DELETE', OLD.id, OLD.client_id,
+        (SELECT trainer_id FROM {templates} WHERE id = OLD.{column}),
+        OLD.assigned_date, OLD.version, OLD.completed, OLD.completed_at);
+END;
+"""
+
+# Columns added to the tables above after their first release: databases
+# created before get them on open
+ADDED_COLUMNS = {
+    'workouts': {'version': 'INTEGER NOT NULL DEFAULT 1', 'archived_at': 'TEXT'},
+    'meal_plans': {'version': 'INTEGER NOT NULL DEFAULT 1', 'archived_at': 'TEXT'},
+    'workout_assignments': {'version': 'INTEGER'},
+    'meal_assignments': {'version': 'INTEGER'},
+}
+
+# Stand-ins for the template version triggers in schema.sql. body_hash() is
+# a Python function registered on the connection, so templates must be
+# written through SQLiteRepository (or a connection that registers it).
+VERSION_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS {templates}_version_insert AFTER INSERT ON {templates}
+BEGIN
+    INSERT OR IGNORE INTO template_bodies (hash, body, created_at)
+    VALUES (body_hash(NEW.{body}), COALESCE(NEW.{body}, '[]'), NEW.updated_at);
+    INSERT INTO {versions} ({column}, version, title, description, body_hash, created_at)
+    VALUES (NEW.id, NEW.version, NEW.title, NEW.description, body_hash(NEW.{body}), NEW.updated_at);
+END;
+
+CREATE TRIGGER IF NOT EXISTS {templates}_version_update AFTER UPDATE OF title, description, {body} ON {templates}
+WHEN NEW.title IS NOT OLD.title OR NEW.description IS NOT OLD.description OR NEW.{body} IS NOT OLD.{body}
+BEGIN
+    UPDATE {templates} SET version = OLD.version + 1 WHERE id = NEW.id;
+    INSERT OR IGNORE INTO template_bodies (hash, body, created_at)
+    VALUES (body_hash(NEW.{body}), COALESCE(NEW.{body}, '[]'), NEW.updated_at);
+    INSERT INTO {versions} ({column}, version, title, description, body_hash, created_at)
+    VALUES (NEW.id, OLD.version + 1, NEW.title, NEW.description, body_hash(NEW.{body}), NEW.updated_at);
+END;
+
+CREATE TRIGGER IF NOT EXISTS {assignments}_pin AFTER INSERT ON {assignments}
+WHEN NEW.version IS NULL
+BEGIN
+    UPDATE {assignments} SET version = (SELECT version FROM {templates} WHERE id = NEW.{column})
+    WHERE id = NEW.id;
+END;
+"""
+
+# Version 1 of templates and pins of assignments from before versioning
+VERSION_BACKFILL = """
+INSERT OR IGNORE INTO template_bodies (hash, body, created_at)
+SELECT body_hash({body}), COALESCE({body}, '[]'), updated_at FROM {templates};
+INSERT OR IGNORE INTO {versions} ({column}, version, title, description, body_hash, created_at)
+SELECT id, version, title, description, body_hash({body}), updated_at FROM {templates};
+UPDATE {assignments} SET version = (SELECT version FROM {templates} WHERE id = {column})
+WHERE version IS NULL;
+"""
+
+# Template table -> (body column, versions table, template column, assignment table)
+VERSIONED = {
+    'workouts': ('exercises', 'workout_versions', 'workout_id', 'workout_assignments'),
+    'meal_plans': ('meals', 'meal_plan_versions', 'meal_plan_id', 'meal_assignments'),
+}
+
+# Columns decoded from JSON text on the way out
+JSON_COLUMNS = ('exercises', 'meals', 'body', 'params', 'result')
+# Columns decoded from 0/1 on the way out
+BOOL_COLUMNS = ('completed',)
+
+
+def now_iso(seconds=0):
+    """UTC time seconds from now as a fixed-width ISO string, so text order is time order"""
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%S.%f+00:00')
+
+
+def new_id():
+    """A new UUID in text form, like uuid_generate_v4()"""
+    return str(uuid.uuid4())
+
+
+def body_hash(body):
+    """Hash of a stored body, the key of template_bodies"""
+    return hashlib.sha256((body or '[]').encode()).hexdigest()
+
+
+def to_dict(row):
+    """Convert a sqlite3.Row into a PostgREST-shaped dict"""
+    data = dict(row)
+    for column in JSON_COLUMNS:
+        if column in data and data[column] is not None:
+            data[column] = json.loads(data[column])
+    for column in BOOL_COLUMNS:
+        if column in data:
+            data[column] = bool(data[column])
+    return data
+
+
+def insert_assignment_sql(table, verb='INSERT'):
+    """Insert of one assignment, pinned to its template's current version
+
+    Pinning in the INSERT, as the BEFORE INSERT trigger in schema.sql does,
+    keeps the {assignments}_pin trigger from updating the new row, which
+    would announce every insert to on_change a second time as an UPDATE.
+    """
+    template_column, template_table, _ = ASSIGNMENT_TABLES[table]
+    return (
+        f"{verb} INTO {table} (id, {template_column}, client_id, assigned_date, version, created_at) "
+        f"VALUES (?, ?, ?, ?, (SELECT version FROM {template_table} WHERE id = ?), ?)"
+    )
+
+
+class SQLiteRepository(Repository):
+    """Repository backed by a local SQLite database"""
+
+    def __init__(self, path=':memory:'):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.create_function('body_hash', 1, body_hash, deterministic=True)
+        self.connection.create_function('assignment_changed', 9, self._record_change)
+        # Called with each change to an assignment once it commits (see db/changes.py)
+        self.on_change = None
+        self._changes = []
+        self.connection.executescript(SCHEMA)
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row['name'] for row in self.connection.execute(f"PRAGMA table_info({table})")}
+            for column, definition in columns.items():
+                if column not in existing:
+                    self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        for templates, (body, versions, column, assignments) in VERSIONED.items():
+            names = dict(templates=templates, body=body, versions=versions, column=column, assignments=assignments)
+            self.connection.executescript(VERSION_TRIGGERS.format(**names))
+            self.connection.executescript(VERSION_BACKFILL.format(**names))
+        for kind, table, column, templates in (
+            ('workout', 'workout_assignments', 'workout_id', 'workouts'),
+            ('meal', 'meal_assignments', 'meal_plan_id', 'meal_plans'),
+        ):
+            self.connection.executescript(ADHERENCE_TRIGGERS.format(
+                kind=kind, table=table, column=column, templates=templates
+            ))
+            self.connection.executescript(CHANGE_TRIGGERS.format(
+                table=table, column=column, templates=templates
+            ))
+        # One connection is shared by Streamlit's script threads
+        self._lock = threading.Lock()
+        self.migrate_catalog()
+
+    def _query(self, sql, params=(), decode=True):
+        convert = to_dict if decode else dict
+        with self._lock:
+            return [convert(row) for row in self.connection.execute(sql, params).fetchall()]
+
+    def _execute(self, sql, params=()):
+        with self._write():
+            return self.connection.execute(sql, params).rowcount
+
+    @contextmanager
+    def _write(self):
+        """Lock and transaction of a write; assignment changes go to on_change after it commits"""
+        with self._lock:
+            try:
+                with self.connection:
+                    yield
+            finally:
+                changes, self._changes = self._changes, []
+        if self.on_change is not None:
+            for change in changes:
+                self.on_change(change)
+
+    def _record_change(self, table, op, assignment_id, client_id, trainer_id, assigned_date,
+                       version, completed, completed_at):
+        self._changes.append({
+            'table': table, 'op': op, 'id': assignment_id, 'client_id': client_id,
+            'trainer_id': trainer_id, 'assigned_date': assigned_date, 'version': version,
+            'completed': bool(completed), 'completed_at': completed_at,
+        })
+
+    # Profiles
+    def create_profile(self, user_id, email, full_name, role):
+        """Insert a profile; Supabase does this in the signup trigger"""
+        timestamp = now_iso()
+        self._execute(
+            "INSERT INTO profiles (id, email, full_name, role, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, email, full_name, role, timestamp, timestamp)
+        )
+
+    def get_profile(self, user_id):
+        rows = self._query("SELECT * FROM profiles WHERE id = ?", (user_id,))
+        return rows[0] if rows else None
+
+    def update_profile(self, user_id, fields):
+        columns = ', '.join(f"{column} = ?" for column in fields)
+        self._execute(
+            f"UPDATE profiles SET {columns}, updated_at = ? WHERE id = ?",
+            (*fields.values(), now_iso(), user_id)
+        )
+
+    def search_clients(self, search='', limit=CLIENT_SEARCH_LIMIT):
+        # LIKE is case-insensitive for ASCII in SQLite, like ILIKE
+        pattern = f"%{escape_like(search.strip())}%"
+        return self._query(
+            "SELECT id, full_name, email FROM profiles "
+            "WHERE role = 'client' AND (full_name LIKE ? ESCAPE '\\' OR email LIKE ? ESCAPE '\\') "
+            "ORDER BY full_name LIMIT ?",
+            (pattern, pattern, limit)
+        )
+
+    def find_clients(self, emails):
+        if not emails:
+            return []
+        placeholders = ', '.join('?' for _ in emails)
+        return self._query(
+            f"SELECT id, full_name, email FROM profiles WHERE role = 'client' AND email IN ({placeholders})",
+            tuple(emails)
+        )
+
+    # Templates
+    def create_template(self, table, trainer_id, title, description, body):
+        template_id = new_id()
+        timestamp = now_iso()
+        self._execute(
+            f"INSERT INTO {table} (id, trainer_id, title, description, {TEMPLATE_BODIES[table]}, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (template_id, trainer_id, title, description, json.dumps(body), timestamp, timestamp)
+        )
+        return self._query(f"SELECT * FROM {table} WHERE id = ?", (template_id,))[0]
+
+    def create_templates(self, table, trainer_id, templates):
+        timestamp = now_iso()
+        with self._write():
+            self.connection.executemany(
+                f"INSERT INTO {table} (id, trainer_id, title, description, {TEMPLATE_BODIES[table]}, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (new_id(), trainer_id, t['title'], t['description'], json.dumps(t['body']), timestamp, timestamp)
+                    for t in templates
+                ]
+            )
+        return len(templates)
+
+    def list_templates(self, table, trainer_id, after=None, limit=None):
+        sql = f"SELECT id, title, description, version, created_at FROM {table} WHERE trainer_id = ? AND archived_at IS NULL"
+        params = [trainer_id]
+        if after is not None:
+            created_at, row_id = after
+            sql += " AND (created_at < ? OR (created_at = ? AND id < ?))"
+            params += [created_at, created_at, row_id]
+        sql += " ORDER BY created_at DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._query(sql, params)
+
+    def get_template_body(self, table, template_id, version=None):
+        if version is not None:
+            _, versions, column, _ = VERSIONED[table]
+            rows = self._query(
+                f"SELECT b.body FROM {versions} v JOIN template_bodies b ON b.hash = v.body_hash "
+                f"WHERE v.{column} = ? AND v.version = ?",
+                (template_id, version)
+            )
+            return rows[0]['body'] or []
+        column = TEMPLATE_BODIES[table]
+        rows = self._query(f"SELECT {column} FROM {table} WHERE id = ?", (template_id,))
+        return rows[0][column] or []
+
+    def update_template(self, table, template_id, title, description, body):
+        self._execute(
+            f"UPDATE {table} SET title = ?, description = ?, {TEMPLATE_BODIES[table]} = ?, updated_at = ? "
+            "WHERE id = ?",
+            (title, description, json.dumps(body), now_iso(), template_id)
+        )
+        return self._query(f"SELECT version FROM {table} WHERE id = ?", (template_id,))[0]['version']
+
+    def clone_template(self, table, template_id, title):
+        column = TEMPLATE_BODIES[table]
+        source = self._query(f"SELECT trainer_id, description, {column} FROM {table} WHERE id = ?", (template_id,))[0]
+        return self.create_template(table, source['trainer_id'], title, source['description'], source[column])
+
+    def list_versions(self, table, template_id):
+        _, versions, column, _ = VERSIONED[table]
+        return self._query(
+            f"SELECT version, title, description, body_hash, created_at FROM {versions} "
+            f"WHERE {column} = ? ORDER BY version DESC",
+            (template_id,)
+        )
+
+    def archive_template(self, table, template_id, today):
+        _, _, column, assignments = VERSIONED[table]
+        with self._write():
+            self.connection.execute(f"UPDATE {table} SET archived_at = ? WHERE id = ?", (now_iso(), template_id))
+            self.connection.execute(
+                f"DELETE FROM {assignments} WHERE {column} = ? AND assigned_date >= ? AND completed = 0",
+                (template_id, today)
+            )
+
+    def delete_template(self, table, template_id):
+        self._execute(f"DELETE FROM {table} WHERE id = ?", (template_id,))
+
+    def templates_with_item(self, table, trainer_id, item_id):
+        id_key = CATALOG_KINDS[table][1]
+        return self._query(
+            f"SELECT id, title, description, version, created_at FROM {table} "
+            "WHERE trainer_id = ? AND archived_at IS NULL "
+            f"AND EXISTS (SELECT 1 FROM json_each({TEMPLATE_BODIES[table]}) "
+            f"WHERE json_extract(value, '$.{id_key}') = ?) "
+            "ORDER BY created_at DESC, id DESC",
+            (trainer_id, item_id)
+        )
+
+    def find_templates(self, table, trainer_id, titles):
+        if not titles:
+            return []
+        placeholders = ', '.join('?' for _ in titles)
+        return self._query(
+            f"SELECT id, title, description, version, created_at FROM {table} "
+            f"WHERE trainer_id = ? AND archived_at IS NULL AND title IN ({placeholders}) "
+            "ORDER BY created_at DESC, id DESC",
+            (trainer_id, *titles)
+        )
+
+    # Catalog
+    def list_catalog(self, kind):
+        return self._query("SELECT id, kind, name FROM catalog_items WHERE kind = ?", (kind,))
+
+    def get_catalog_items(self, ids):
+        ids = list(ids)
+        if not ids:
+            return []
+        placeholders = ', '.join('?' for _ in ids)
+        return self._query(f"SELECT id, kind, name FROM catalog_items WHERE id IN ({placeholders})", ids)
+
+    def intern_catalog_items(self, kind, names):
+        wanted = {}
+        for name in names:
+            if name.strip():
+                wanted.setdefault(catalog_key(name), ' '.join(name.split()))
+        if not wanted:
+            return []
+        timestamp = now_iso()
+        with self._write():
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO catalog_items (kind, name, name_key, created_at) VALUES (?, ?, ?, ?)",
+                [(kind, name, key, timestamp) for key, name in wanted.items()]
+            )
+        placeholders = ', '.join('?' for _ in wanted)
+        return self._query(
+            f"SELECT id, kind, name FROM catalog_items WHERE kind = ? AND name_key IN ({placeholders})",
+            (kind, *wanted)
+        )
+
+    def migrate_catalog(self):
+        """Rewrite bodies that still hold names to reference catalog items
+
+        The SQLite counterpart of the migration at the end of schema.sql.
+        """
+        for table, column in TEMPLATE_BODIES.items():
+            kind = CATALOG_KINDS[table][0]
+            rows = self._query(f"SELECT id, {column} FROM {table} WHERE {column} LIKE '%\"name\"%'")
+            for row in rows:
+                body = row[column]
+                if not isinstance(body, list):
+                    continue
+                items = self.intern_catalog_items(kind, [entry.get('name') or '' for entry in body])
+                self._execute(
+                    f"UPDATE {table} SET {column} = ? WHERE id = ?",
+                    (json.dumps(reference_body(table, body, items)), row['id'])
+                )
+
+    # Assignments
+    def insert_assignment(self, table, row):
+        template_column = ASSIGNMENT_TABLES[table][0]
+        self._execute(
+            insert_assignment_sql(table),
+            (new_id(), row[template_column], row['client_id'], row['assigned_date'], row[template_column], now_iso())
+        )
+
+    def upsert_assignments(self, table, rows):
+        template_column = ASSIGNMENT_TABLES[table][0]
+        timestamp = now_iso()
+        with self._write():
+            # rowcount leaves out the rows written by the adherence triggers
+            inserted = self.connection.executemany(
+                insert_assignment_sql(table, 'INSERT OR IGNORE'),
+                [
+                    (new_id(), row[template_column], row['client_id'], row['assigned_date'], row[template_column], timestamp)
+                    for row in rows
+                ]
+            ).rowcount
+        return inserted, len(rows) - inserted
+
+    def _assignments_with_templates(self, table, where, params, columns='*'):
+        """Assignments matching where with their template embedded as of the pinned version
+
+        With columns='*' the embedded template includes the pinned body.
+        """
+        template_column, template_table, embed = ASSIGNMENT_TABLES[table]
+        body_column, versions, _, _ = VERSIONED[template_table]
+        with_body = columns == '*'
+        assignments = self._query(
+            f"SELECT a.*, v.title AS pinned_title, v.description AS pinned_description"
+            f"{', b.body' if with_body else ''} FROM {table} a "
+            f"LEFT JOIN {versions} v ON v.{template_column} = a.{template_column} AND v.version = a.version "
+            f"{'LEFT JOIN template_bodies b ON b.hash = v.body_hash ' if with_body else ''}"
+            f"WHERE {where} ORDER BY a.assigned_date, a.created_at",
+            params
+        )
+        ids = list({a[template_column] for a in assignments})
+        templates = {}
+        if ids:
+            placeholders = ', '.join('?' for _ in ids)
+            for template in self._query(
+                f"SELECT {columns} FROM {template_table} WHERE id IN ({placeholders})", ids
+            ):
+                templates[template['id']] = template
+        for assignment in assignments:
+            template = templates.get(assignment[template_column])
+            pinned = {
+                'title': assignment.pop('pinned_title'),
+                'description': assignment.pop('pinned_description'),
+            }
+            if with_body:
+                pinned[body_column] = assignment.pop('body')
+            if template is not None and pinned['title'] is not None:
+                template = {**template, **pinned}
+            assignment[embed] = template
+        return assignments
+
+    def get_checklist(self, client_id, assigned_date):
+        return self.get_schedule(client_id, assigned_date, assigned_date, columns='*')
+
+    def get_schedule(self, client_id, start, end, columns='id, title, description'):
+        where = "a.client_id = ? AND a.assigned_date BETWEEN ? AND ?"
+        return (
+            self._assignments_with_templates('workout_assignments', where, (client_id, start, end), columns),
+            self._assignments_with_templates('meal_assignments', where, (client_id, start, end), columns)
+        )
+
+    def get_assignments(self, workout_ids, meal_ids):
+        return tuple(
+            self._assignments_with_templates(
+                table, f"a.id IN ({', '.join('?' for _ in ids)})", list(ids)
+            ) if ids else []
+            for table, ids in (('workout_assignments', workout_ids), ('meal_assignments', meal_ids))
+        )
+
+    def get_history_page(self, table, client_id, after=None, limit=EXPORT_PAGE_SIZE):
+        template_column, template_table, _ = ASSIGNMENT_TABLES[table]
+        versions = VERSIONED[template_table][1]
+        columns = ', '.join(f'a.{column.strip()}' for column in HISTORY_COLUMNS.split(','))
+        where, params = "a.client_id = ?", [client_id]
+        if after is not None:
+            where += " AND (a.assigned_date > ? OR (a.assigned_date = ? AND a.id > ?))"
+            params += [after[0], after[0], after[1]]
+        rows = self._query(
+            f"SELECT {columns}, v.title FROM {table} a "
+            f"LEFT JOIN {versions} v ON v.{template_column} = a.{template_column} AND v.version = a.version "
+            f"WHERE {where} ORDER BY a.assigned_date, a.id LIMIT ?",
+            params + [limit]
+        )
+        for row in rows:
+            title = row.pop('title')
+            row[versions] = {'title': title} if title is not None else None
+        return rows
+
+    def set_completed(self, table, assignment_id, completed, completed_at):
+        self._execute(
+            f"UPDATE {table} SET completed = ?, completed_at = ? WHERE id = ?",
+            (int(completed), completed_at, assignment_id)
+        )
+
+    def set_completions(self, workouts, meals):
+        with self._write():
+            for table, changes in (('workout_assignments', workouts), ('meal_assignments', meals)):
+                self.connection.executemany(
+                    f"UPDATE {table} SET completed = ?, completed_at = ? WHERE id = ?",
+                    [(int(c['completed']), c['completed_at'], c['id']) for c in changes]
+                )
+
+    # Analytics
+    def get_adherence(self, trainer_id, since, until):
+        return self._query(
+            "WITH a AS (SELECT * FROM adherence_weekly WHERE trainer_id = ? "
+            "AND week_start BETWEEN date(?, 'weekday 0', '-6 days') AND ?) "
+            "SELECT 'client' AS grain, a.client_id AS id, COALESCE(p.full_name, p.email) AS name, "
+            "a.kind, a.week_start, SUM(a.assigned) AS assigned, SUM(a.completed) AS completed "
+            "FROM a JOIN profiles p ON p.id = a.client_id "
+            "GROUP BY a.client_id, a.kind, a.week_start "
+            "UNION ALL "
+            "SELECT 'template', a.template_id, COALESCE(w.title, mp.title), "
+            "a.kind, a.week_start, SUM(a.assigned), SUM(a.completed) "
+            "FROM a "
+            "LEFT JOIN workouts w ON a.kind = 'workout' AND w.id = a.template_id "
+            "LEFT JOIN meal_plans mp ON a.kind = 'meal' AND mp.id = a.template_id "
+            "GROUP BY a.template_id, a.kind, a.week_start",
+            (trainer_id, since, until),
+            decode=False
+        )
+
+    # Jobs
+    def enqueue_job(self, owner_id, kind, params, max_attempts=JOB_MAX_ATTEMPTS):
+        timestamp = now_iso()
+        with self._write():
+            job_id = self.connection.execute(
+                "INSERT INTO jobs (owner_id, kind, params, max_attempts, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (owner_id, kind, json.dumps(params), max_attempts, timestamp, timestamp, timestamp)
+            ).lastrowid
+        return self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))[0]
+
+    def claim_job(self, owner_id, lease_seconds):
+        # The select and update share the lock, like FOR UPDATE SKIP LOCKED in schema.sql
+        now = now_iso()
+        with self._write():
+            row = self.connection.execute(
+                "SELECT id FROM jobs WHERE owner_id = ? "
+                "AND ((status = 'queued' AND run_after <= ?) OR (status = 'running' AND locked_until < ?)) "
+                "ORDER BY run_after, id LIMIT 1",
+                (owner_id, now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = self.connection.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ?, updated_at = ? "
+                "WHERE id = ? RETURNING *",
+                (now_iso(lease_seconds), now, row['id'])
+            ).fetchone()
+            return to_dict(claimed)
+
+    def set_job_progress(self, job_id, done, total, lease_seconds):
+        self._execute(
+            "UPDATE jobs SET done = ?, total = ?, locked_until = ?, updated_at = ? WHERE id = ?",
+            (done, total, now_iso(lease_seconds), now_iso(), job_id)
+        )
+
+    def finish_job(self, job_id, result):
+        self._execute(
+            "UPDATE jobs SET status = 'done', result = ?, locked_until = NULL, updated_at = ? WHERE id = ?",
+            (json.dumps(result), now_iso(), job_id)
+        )
+
+    def fail_job(self, job_id, error, retry_in=None):
+        if retry_in is None:
+            self._execute(
+                "UPDATE jobs SET status = 'failed', error = ?, locked_until = NULL, updated_at = ? WHERE id = ?",
+                (error, now_iso(), job_id)
+            )
+        else:
+            self._execute(
+                "UPDATE jobs SET status = 'queued', error = ?, run_after = ?, locked_until = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (error, now_iso(retry_in), now_iso(), job_id)
+            )
+
+    def list_jobs(self, owner_id, limit):
+        return self._query(
+            "SELECT * FROM jobs WHERE owner_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+            (owner_id, limit)
+        )
+
+
+@st.cache_resource(show_spinner=False)
+def get_sqlite_repository(path=':memory:'):
+    """Process-wide SQLite repository for the given database path"""
+    return SQLiteRepository(path)
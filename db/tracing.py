@@ -0,0 +1,267 @@
+"""
+Per-rerun request tracing
+
+Each Streamlit rerun can be wrapped in a Trace (see trace_rerun). While it
+is active, every HTTP request the Supabase client sends through the shared
+transport (PostgREST tables and RPCs, and supabase.auth calls) is recorded
+by db/client.py's TracingTransport as a span with its target, filters, status, latency, row count and response
+bytes. TracingRepository adds a parent span per repository call, so a
+rerun's tree reads rerun -> repository method -> HTTP request.
+
+The active trace lives in a context variable: Streamlit runs every script
+run in its own thread, so concurrent sessions never see each other's spans,
+and with no active trace the hooks cost one lookup. Loaders that
+db/fetch.py runs on its pool get a copy of the caller's context, so their
+requests are recorded in the caller's trace.
+
+Finished traces can be exported as JSON lines (one line per span) or as
+OpenTelemetry OTLP/JSON (one line per trace, the format of the collector's
+file exporter).
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import unquote
+
+from db.repository import ASSIGNMENT_TABLES, TEMPLATE_BODIES
+
+EXPORT_FORMATS = ('jsonl', 'otlp')
+SERVICE_NAME = 'personal-trainer-app'
+# Repository methods whose first argument names a table
+TABLES = set(ASSIGNMENT_TABLES) | set(TEMPLATE_BODIES)
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+# (trace, span) of the innermost open span
+_current_span = contextvars.ContextVar('current_span', default=None)
+_export_lock = threading.Lock()
+
+
+class Span:
+    """One timed operation with attributes and child spans"""
+
+    def __init__(self, name, parent_id=None, attributes=None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self):
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """The span tree of one rerun"""
+
+    def __init__(self, name='rerun', **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.root = Span(name, attributes=attributes)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Open a child of the innermost span open in this context
+
+        The open span is a context variable rather than a stack on the
+        trace, so loaders run concurrently by db/fetch.py each nest their
+        spans under the span that started them.
+        """
+        current = _current_span.get()
+        parent = current[1] if current is not None and current[0] is self else self.root
+        span = Span(name, parent_id=parent.span_id, attributes=attributes)
+        parent.children.append(span)
+        token = _current_span.set((self, span))
+        try:
+            yield span
+        except Exception as e:
+            span.attributes['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end()
+            _current_span.reset(token)
+
+    def walk(self):
+        """Yield (depth, span) for every span, depth first"""
+        pending = [(0, self.root)]
+        while pending:
+            depth, span = pending.pop()
+            yield depth, span
+            pending.extend((depth + 1, child) for child in reversed(span.children))
+
+    def requests(self):
+        """The HTTP request spans"""
+        return [span for _, span in self.walk() if 'http.status' in span.attributes]
+
+    def finish(self):
+        self.root.end()
+
+
+@contextmanager
+def trace_rerun(name='rerun', **attributes):
+    """Make a new Trace current for the duration of the block"""
+    trace = Trace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        _current_trace.reset(token)
+
+
+def current_trace():
+    """The active Trace, or None outside trace_rerun"""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Child span of the active trace; yields None when nothing is traced"""
+    trace = current_trace()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, **attributes) as child:
+        yield child
+
+
+def annotate(**attributes):
+    """Set attributes on the active trace's root span"""
+    trace = current_trace()
+    if trace is not None:
+        trace.root.attributes.update(attributes)
+
+
+def request_attributes(request):
+    """Service, target and filters of a Supabase request"""
+    path = request.url.path
+    service, target = 'http', path
+    for prefix, name in (('/rest/v1/', 'rest'), ('/auth/v1/', 'auth')):
+        if prefix in path:
+            service, target = name, path.split(prefix, 1)[1]
+    return {
+        'service': service,
+        'target': target,
+        'http.method': request.method,
+        'query': unquote(request.url.query.decode()),
+    }
+
+
+def row_count(response):
+    """Rows in a PostgREST response, or None when it is not a JSON list"""
+    content_range = response.headers.get('content-range', '')
+    if '/' in content_range:
+        rows = content_range.split('/')[0]
+        if rows == '*':
+            return 0
+        start, _, end = rows.partition('-')
+        if start.isdigit() and end.isdigit():
+            return int(end) - int(start) + 1
+    if 'json' in response.headers.get('content-type', ''):
+        try:
+            data = json.loads(response.content)
+        except ValueError:
+            return None
+        return len(data) if isinstance(data, list) else 1
+    return None
+
+
+class TracingRepository:
+    """Repository wrapper opening a span around every method call"""
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    def __getattr__(self, name):
+        attr = getattr(self.repository, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            attributes = {}
+            if args and isinstance(args[0], str) and args[0] in TABLES:
+                attributes['table'] = args[0]
+            with span(f"repo.{name}", **attributes) as repo_span:
+                result = attr(*args, **kwargs)
+                if repo_span is not None and isinstance(result, list):
+                    repo_span.attributes['rows'] = len(result)
+                return result
+        return call
+
+
+def span_records(trace):
+    """Flat JSON-ready dicts, one per span"""
+    return [
+        {
+            'trace_id': trace.trace_id,
+            'span_id': span.span_id,
+            'parent_id': span.parent_id,
+            'name': span.name,
+            'start_ns': span.start_ns,
+            'duration_ms': round(span.duration_ms, 3),
+            'attributes': span.attributes,
+        }
+        for _, span in trace.walk()
+    ]
+
+
+def otlp_value(value):
+    """An OTLP AnyValue for a Python attribute value"""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_record(trace):
+    """The trace as one OTLP/JSON ExportTraceServiceRequest"""
+    spans = []
+    for _, span in trace.walk():
+        spans.append({
+            'traceId': trace.trace_id,
+            'spanId': span.span_id,
+            'parentSpanId': span.parent_id or '',
+            'name': span.name,
+            # SPAN_KIND_CLIENT for HTTP requests, SPAN_KIND_INTERNAL otherwise
+            'kind': 3 if 'http.method' in span.attributes else 1,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns or span.start_ns),
+            'attributes': [
+                {'key': key, 'value': otlp_value(value)}
+                for key, value in span.attributes.items() if value is not None
+            ],
+        })
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': 'db.tracing'}, 'spans': spans}],
+        }]
+    }
+
+
+def export_trace(trace, path, export_format='jsonl'):
+    """Append a finished trace to path in the given format"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown trace format {export_format!r}; use one of {EXPORT_FORMATS}")
+    records = span_records(trace) if export_format == 'jsonl' else [otlp_record(trace)]
+    lines = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+    with _export_lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(lines)
@@ -4,6 +4,9 @@
 -- Enable UUID extension
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 
+-- Enable trigram matching for client search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Profiles table (extends Supabase auth.users)
 CREATE TABLE IF NOT EXISTS profiles (
     id UUID REFERENCES auth.users ON DELETE CASCADE PRIMARY KEY,
@@ -61,12 +64,31 @@ CREATE TABLE IF NOT EXISTS meal_assignments (
 );
 
 -- Create indexes for better query performance
-CREATE INDEX IF NOT EXISTS idx_workouts_trainer ON workouts(trainer_id);
-CREATE INDEX IF NOT EXISTS idx_meal_plans_trainer ON meal_plans(trainer_id);
+-- Trainer template libraries are paged newest first on (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_workouts_trainer_created ON workouts(trainer_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_meal_plans_trainer_created ON meal_plans(trainer_id, created_at DESC, id DESC);
+-- Superseded by the keyset indexes above
+DROP INDEX IF EXISTS idx_workouts_trainer;
+DROP INDEX IF EXISTS idx_meal_plans_trainer;
+-- Client search: substring ILIKE on name/email, first page ordered by name
+CREATE INDEX IF NOT EXISTS idx_profiles_full_name_trgm ON profiles USING GIN (full_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_profiles_email_trgm ON profiles USING GIN (email gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_profiles_role_full_name ON profiles(role, full_name);
 CREATE INDEX IF NOT EXISTS idx_workout_assignments_client_date ON workout_assignments(client_id, assigned_date);
 CREATE INDEX IF NOT EXISTS idx_meal_assignments_client_date ON meal_assignments(client_id, assigned_date);
 
 -- Row Level Security (RLS) Policies
+--
+-- Policies are written so Postgres can evaluate the expensive part once per
+-- statement instead of once per row:
+--   * auth.uid() is wrapped as (SELECT auth.uid()) so it becomes an InitPlan
+--   * cross-table checks go through the SECURITY DEFINER helpers below and
+--     are used as "column IN (SELECT helper())", which is hashed once rather
+--     than run as a correlated EXISTS per row; running as the owner also
+--     skips RLS on the looked-up table (and the recursion on profiles)
+-- Supporting indexes: profiles(id) is the primary key, workouts/meal_plans
+-- (trainer_id, ...) are created above, and the UNIQUE constraints on the
+-- assignment tables already lead with workout_id / meal_plan_id.
 
 -- Enable RLS on all tables
 ALTER TABLE profiles ENABLE ROW LEVEL SECURITY;
@@ -75,78 +97,91 @@ ALTER TABLE meal_plans ENABLE ROW LEVEL SECURITY;
 ALTER TABLE workout_assignments ENABLE ROW LEVEL SECURITY;
 ALTER TABLE meal_assignments ENABLE ROW LEVEL SECURITY;
 
+-- Policy helper functions
+CREATE OR REPLACE FUNCTION public.is_trainer()
+RETURNS BOOLEAN AS $$
+    SELECT EXISTS (
+        SELECT 1 FROM public.profiles
+        WHERE id = auth.uid() AND role = 'trainer'
+    );
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION public.trainer_workout_ids()
+RETURNS SETOF UUID AS $$
+    SELECT id FROM public.workouts WHERE trainer_id = auth.uid();
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION public.trainer_meal_plan_ids()
+RETURNS SETOF UUID AS $$
+    SELECT id FROM public.meal_plans WHERE trainer_id = auth.uid();
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION public.client_workout_ids()
+RETURNS SETOF UUID AS $$
+    SELECT workout_id FROM public.workout_assignments WHERE client_id = auth.uid();
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION public.client_meal_plan_ids()
+RETURNS SETOF UUID AS $$
+    SELECT meal_plan_id FROM public.meal_assignments WHERE client_id = auth.uid();
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
 -- Profiles policies
+DROP POLICY IF EXISTS "Users can view their own profile" ON profiles;
 CREATE POLICY "Users can view their own profile" ON profiles
-    FOR SELECT USING (auth.uid() = id);
+    FOR SELECT USING ((SELECT auth.uid()) = id);
 
+DROP POLICY IF EXISTS "Users can update their own profile" ON profiles;
 CREATE POLICY "Users can update their own profile" ON profiles
-    FOR UPDATE USING (auth.uid() = id);
+    FOR UPDATE USING ((SELECT auth.uid()) = id);
 
+DROP POLICY IF EXISTS "Trainers can view all profiles" ON profiles;
 CREATE POLICY "Trainers can view all profiles" ON profiles
-    FOR SELECT USING (
-        EXISTS (
-            SELECT 1 FROM profiles
-            WHERE id = auth.uid() AND role = 'trainer'
-        )
-    );
+    FOR SELECT USING ((SELECT public.is_trainer()));
 
 -- Workouts policies
+DROP POLICY IF EXISTS "Trainers can manage their own workouts" ON workouts;
 CREATE POLICY "Trainers can manage their own workouts" ON workouts
-    FOR ALL USING (trainer_id = auth.uid());
+    FOR ALL USING (trainer_id = (SELECT auth.uid()));
 
+DROP POLICY IF EXISTS "Clients can view workouts assigned to them" ON workouts;
 CREATE POLICY "Clients can view workouts assigned to them" ON workouts
-    FOR SELECT USING (
-        EXISTS (
-            SELECT 1 FROM workout_assignments
-            WHERE workout_assignments.workout_id = workouts.id
-            AND workout_assignments.client_id = auth.uid()
-        )
-    );
+    FOR SELECT USING (id IN (SELECT public.client_workout_ids()));
 
 -- Meal plans policies
+DROP POLICY IF EXISTS "Trainers can manage their own meal plans" ON meal_plans;
 CREATE POLICY "Trainers can manage their own meal plans" ON meal_plans
-    FOR ALL USING (trainer_id = auth.uid());
+    FOR ALL USING (trainer_id = (SELECT auth.uid()));
 
+DROP POLICY IF EXISTS "Clients can view meal plans assigned to them" ON meal_plans;
 CREATE POLICY "Clients can view meal plans assigned to them" ON meal_plans
-    FOR SELECT USING (
-        EXISTS (
-            SELECT 1 FROM meal_assignments
-            WHERE meal_assignments.meal_plan_id = meal_plans.id
-            AND meal_assignments.client_id = auth.uid()
-        )
-    );
+    FOR SELECT USING (id IN (SELECT public.client_meal_plan_ids()));
 
 -- Workout assignments policies
+DROP POLICY IF EXISTS "Trainers can manage workout assignments" ON workout_assignments;
 CREATE POLICY "Trainers can manage workout assignments" ON workout_assignments
-    FOR ALL USING (
-        EXISTS (
-            SELECT 1 FROM workouts
-            WHERE workouts.id = workout_assignments.workout_id
-            AND workouts.trainer_id = auth.uid()
-        )
-    );
+    FOR ALL USING (workout_id IN (SELECT public.trainer_workout_ids()));
 
+DROP POLICY IF EXISTS "Clients can view their own workout assignments" ON workout_assignments;
 CREATE POLICY "Clients can view their own workout assignments" ON workout_assignments
-    FOR SELECT USING (client_id = auth.uid());
+    FOR SELECT USING (client_id = (SELECT auth.uid()));
 
+DROP POLICY IF EXISTS "Clients can update their own workout completion" ON workout_assignments;
 CREATE POLICY "Clients can update their own workout completion" ON workout_assignments
-    FOR UPDATE USING (client_id = auth.uid());
+    FOR UPDATE USING (client_id = (SELECT auth.uid()));
 
 -- Meal assignments policies
+DROP POLICY IF EXISTS "Trainers can manage meal assignments" ON meal_assignments;
 CREATE POLICY "Trainers can manage meal assignments" ON meal_assignments
-    FOR ALL USING (
-        EXISTS (
-            SELECT 1 FROM meal_plans
-            WHERE meal_plans.id = meal_assignments.meal_plan_id
-            AND meal_plans.trainer_id = auth.uid()
-        )
-    );
+    FOR ALL USING (meal_plan_id IN (SELECT public.trainer_meal_plan_ids()));
 
+DROP POLICY IF EXISTS "Clients can view their own meal assignments" ON meal_assignments;
 CREATE POLICY "Clients can view their own meal assignments" ON meal_assignments
-    FOR SELECT USING (client_id = auth.uid());
+    FOR SELECT USING (client_id = (SELECT auth.uid()));
 
+DROP POLICY IF EXISTS "Clients can update their own meal completion" ON meal_assignments;
 CREATE POLICY "Clients can update their own meal completion" ON meal_assignments
-    FOR UPDATE USING (client_id = auth.uid());
+    FOR UPDATE USING (client_id = (SELECT auth.uid()));
 
 -- Function to automatically create profile on signup
 CREATE OR REPLACE FUNCTION public.handle_new_user()
@@ -162,3 +197,823 @@ $$ LANGUAGE plpgsql SECURITY DEFINER;
 CREATE TRIGGER on_auth_user_created
     AFTER INSERT ON auth.users
     FOR EACH ROW EXECUTE FUNCTION public.handle_new_user();
+
+-- Batched completion toggles from the client dashboard.
+-- p_workouts / p_meals are arrays of {id, completed, completed_at}; the
+-- "Clients can update their own ... completion" policies still apply.
+CREATE OR REPLACE FUNCTION public.set_assignment_completion(p_workouts JSONB, p_meals JSONB)
+RETURNS VOID AS $$
+    UPDATE workout_assignments wa
+    SET completed = c.completed, completed_at = c.completed_at
+    FROM jsonb_to_recordset(p_workouts) AS c(id UUID, completed BOOLEAN, completed_at TIMESTAMPTZ)
+    WHERE wa.id = c.id;
+
+    UPDATE meal_assignments ma
+    SET completed = c.completed, completed_at = c.completed_at
+    FROM jsonb_to_recordset(p_meals) AS c(id UUID, completed BOOLEAN, completed_at TIMESTAMPTZ)
+    WHERE ma.id = c.id;
+$$ LANGUAGE sql;
+
+-- Trainer adherence aggregates
+--
+-- One row per client, template and week with assigned / completed counts,
+-- so the adherence dashboard reads O(clients x weeks) rows instead of
+-- scanning the assignment tables. Statement-level triggers keep it in step
+-- with workout_assignments and meal_assignments: a bulk schedule or a batch
+-- of completion toggles is folded in with one upsert per statement.
+-- refresh_adherence() rebuilds it from scratch (backfill, or a nightly job,
+-- e.g. SELECT cron.schedule('refresh-adherence', '0 3 * * *',
+-- 'SELECT public.refresh_adherence()') with pg_cron).
+CREATE TABLE IF NOT EXISTS adherence_weekly (
+    client_id UUID REFERENCES profiles(id) ON DELETE CASCADE NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('workout', 'meal')),
+    template_id UUID NOT NULL, -- workouts.id or meal_plans.id
+    week_start DATE NOT NULL, -- Monday
+    trainer_id UUID, -- owner of the template
+    assigned INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (client_id, kind, template_id, week_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_adherence_weekly_trainer_week ON adherence_weekly(trainer_id, week_start);
+
+ALTER TABLE adherence_weekly ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Trainers can view their clients' adherence" ON adherence_weekly;
+CREATE POLICY "Trainers can view their clients' adherence" ON adherence_weekly
+    FOR SELECT USING (trainer_id = (SELECT auth.uid()));
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'adherence_change') THEN
+        CREATE TYPE public.adherence_change AS (
+            template_id UUID,
+            client_id UUID,
+            assigned_date DATE,
+            assigned INTEGER,
+            completed INTEGER
+        );
+    END IF;
+END
+$$;
+
+-- Fold a set of +/- changes into adherence_weekly; rows that drop to no
+-- assignments (e.g. after a template is deleted) are removed
+CREATE OR REPLACE FUNCTION public.apply_adherence_changes(p_kind TEXT, p_changes public.adherence_change[])
+RETURNS VOID AS $$
+    INSERT INTO adherence_weekly AS a (client_id, kind, template_id, week_start, trainer_id, assigned, completed)
+    SELECT d.client_id, p_kind, d.template_id, d.week_start, t.trainer_id, d.assigned, d.completed
+    FROM (
+        SELECT client_id, template_id, date_trunc('week', assigned_date)::DATE AS week_start,
+               SUM(assigned) AS assigned, SUM(completed) AS completed
+        FROM unnest(p_changes)
+        GROUP BY 1, 2, 3
+        HAVING SUM(assigned) <> 0 OR SUM(completed) <> 0
+    ) d
+    LEFT JOIN (
+        SELECT id, trainer_id FROM workouts WHERE p_kind = 'workout'
+        UNION ALL
+        SELECT id, trainer_id FROM meal_plans WHERE p_kind = 'meal'
+    ) t ON t.id = d.template_id
+    ON CONFLICT (client_id, kind, template_id, week_start) DO UPDATE
+    SET assigned = a.assigned + EXCLUDED.assigned,
+        completed = a.completed + EXCLUDED.completed;
+
+    DELETE FROM adherence_weekly a
+    USING unnest(p_changes) c
+    WHERE a.kind = p_kind
+      AND a.client_id = c.client_id
+      AND a.template_id = c.template_id
+      AND a.week_start = date_trunc('week', c.assigned_date)::DATE
+      AND a.assigned <= 0;
+$$ LANGUAGE sql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION public.track_workout_adherence()
+RETURNS TRIGGER AS $$
+DECLARE
+    changes public.adherence_change[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        changes := ARRAY(
+            SELECT ROW(workout_id, client_id, assigned_date, 1, COALESCE(completed, FALSE)::INT)::public.adherence_change
+            FROM new_rows);
+    ELSIF TG_OP = 'DELETE' THEN
+        changes := ARRAY(
+            SELECT ROW(workout_id, client_id, assigned_date, -1, -COALESCE(completed, FALSE)::INT)::public.adherence_change
+            FROM old_rows);
+    ELSE
+        changes := ARRAY(
+            SELECT ROW(workout_id, client_id, assigned_date, 1, COALESCE(completed, FALSE)::INT)::public.adherence_change
+            FROM new_rows
+            UNION ALL
+            SELECT ROW(workout_id, client_id, assigned_date, -1, -COALESCE(completed, FALSE)::INT)::public.adherence_change
+            FROM old_rows);
+    END IF;
+    PERFORM public.apply_adherence_changes('workout', changes);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION public.track_meal_adherence()
+RETURNS TRIGGER AS $$
+DECLARE
+    changes public.adherence_change[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        changes := ARRAY(
+            SELECT ROW(meal_plan_id, client_id, assigned_date, 1, COALESCE(completed, FALSE)::INT)::public.adherence_change
+            FROM new_rows);
+    ELSIF TG_OP = 'DELETE' THEN
+        changes := ARRAY(
+            SELECT ROW(meal_plan_id, client_id, assigned_date, -1, -COALESCE(completed, FALSE)::INT)::public.adherence_change
+            FROM old_rows);
+    ELSE
+        changes := ARRAY(
+            SELECT ROW(meal_plan_id, client_id, assigned_date, 1, COALESCE(completed, FALSE)::INT)::public.adherence_change
+            FROM new_rows
+            UNION ALL
+            SELECT ROW(meal_plan_id, client_id, assigned_date, -1, -COALESCE(completed, FALSE)::INT)::public.adherence_change
+            FROM old_rows);
+    END IF;
+    PERFORM public.apply_adherence_changes('meal', changes);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Transition tables allow a single event per trigger, hence three per table
+DROP TRIGGER IF EXISTS workout_adherence_insert ON workout_assignments;
+CREATE TRIGGER workout_adherence_insert
+    AFTER INSERT ON workout_assignments REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.track_workout_adherence();
+DROP TRIGGER IF EXISTS workout_adherence_update ON workout_assignments;
+CREATE TRIGGER workout_adherence_update
+    AFTER UPDATE ON workout_assignments REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.track_workout_adherence();
+DROP TRIGGER IF EXISTS workout_adherence_delete ON workout_assignments;
+CREATE TRIGGER workout_adherence_delete
+    AFTER DELETE ON workout_assignments REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.track_workout_adherence();
+
+DROP TRIGGER IF EXISTS meal_adherence_insert ON meal_assignments;
+CREATE TRIGGER meal_adherence_insert
+    AFTER INSERT ON meal_assignments REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.track_meal_adherence();
+DROP TRIGGER IF EXISTS meal_adherence_update ON meal_assignments;
+CREATE TRIGGER meal_adherence_update
+    AFTER UPDATE ON meal_assignments REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.track_meal_adherence();
+DROP TRIGGER IF EXISTS meal_adherence_delete ON meal_assignments;
+CREATE TRIGGER meal_adherence_delete
+    AFTER DELETE ON meal_assignments REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.track_meal_adherence();
+
+-- Full rebuild of adherence_weekly from the assignment tables
+CREATE OR REPLACE FUNCTION public.refresh_adherence()
+RETURNS VOID AS $$
+    DELETE FROM adherence_weekly;
+
+    INSERT INTO adherence_weekly (client_id, kind, template_id, week_start, trainer_id, assigned, completed)
+    SELECT wa.client_id, 'workout', wa.workout_id, date_trunc('week', wa.assigned_date)::DATE, w.trainer_id,
+           COUNT(*), COUNT(*) FILTER (WHERE wa.completed)
+    FROM workout_assignments wa
+    JOIN workouts w ON w.id = wa.workout_id
+    GROUP BY 1, 3, 4, 5
+    UNION ALL
+    SELECT ma.client_id, 'meal', ma.meal_plan_id, date_trunc('week', ma.assigned_date)::DATE, mp.trainer_id,
+           COUNT(*), COUNT(*) FILTER (WHERE ma.completed)
+    FROM meal_assignments ma
+    JOIN meal_plans mp ON mp.id = ma.meal_plan_id
+    GROUP BY 1, 3, 4, 5;
+$$ LANGUAGE sql SECURITY DEFINER SET search_path = public;
+
+-- The maintenance functions bypass RLS, so only the owner may call them
+REVOKE EXECUTE ON FUNCTION public.apply_adherence_changes(TEXT, public.adherence_change[]) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION public.refresh_adherence() FROM PUBLIC;
+
+SELECT public.refresh_adherence();
+
+-- Adherence of one trainer's clients between two dates, rolled up twice:
+-- grain 'client' rows are per client, kind and week, grain 'template' rows
+-- per workout / meal plan and week. Both come from adherence_weekly, so the
+-- result is O((clients + templates) x weeks) rows. Runs with the caller's
+-- rights, so trainers only see their own rows.
+CREATE OR REPLACE FUNCTION public.get_trainer_adherence(p_trainer_id UUID, p_since DATE, p_until DATE)
+RETURNS TABLE (
+    grain TEXT,
+    id UUID,
+    name TEXT,
+    kind TEXT,
+    week_start DATE,
+    assigned INTEGER,
+    completed INTEGER
+) AS $$
+    WITH a AS (
+        SELECT * FROM adherence_weekly
+        WHERE trainer_id = p_trainer_id
+          AND week_start BETWEEN date_trunc('week', p_since)::DATE AND p_until
+    )
+    SELECT 'client', a.client_id, COALESCE(p.full_name, p.email), a.kind, a.week_start,
+           SUM(a.assigned)::INTEGER, SUM(a.completed)::INTEGER
+    FROM a
+    JOIN profiles p ON p.id = a.client_id
+    GROUP BY a.client_id, p.full_name, p.email, a.kind, a.week_start
+    UNION ALL
+    SELECT 'template', a.template_id, COALESCE(w.title, mp.title), a.kind, a.week_start,
+           SUM(a.assigned)::INTEGER, SUM(a.completed)::INTEGER
+    FROM a
+    LEFT JOIN workouts w ON a.kind = 'workout' AND w.id = a.template_id
+    LEFT JOIN meal_plans mp ON a.kind = 'meal' AND mp.id = a.template_id
+    GROUP BY a.template_id, w.title, mp.title, a.kind, a.week_start;
+$$ LANGUAGE sql STABLE;
+
+-- Exercise and food catalog
+--
+-- Exercise names (workouts.exercises) and meal names (meal_plans.meals) are
+-- interned in catalog_items and template bodies reference them by id:
+--   exercises: [{"exercise_id": 12, "sets": "3", "reps": "10"}]
+--   meals:     [{"food_id": 4, "time": "8:00 AM", "items": "..."}]
+-- Names that differ only in case or spacing share one row (catalog_key).
+-- The catalog is shared by all trainers; the app keeps it in memory and
+-- fills in names when it displays a body. The GIN indexes below make
+-- "templates using exercise 12" (exercises @> '[{"exercise_id": 12}]') an
+-- index lookup.
+CREATE OR REPLACE FUNCTION public.catalog_key(p_name TEXT)
+RETURNS TEXT AS $$
+    SELECT lower(btrim(regexp_replace(p_name, '\s+', ' ', 'g')));
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE TABLE IF NOT EXISTS catalog_items (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    kind TEXT NOT NULL CHECK (kind IN ('exercise', 'food')),
+    name TEXT NOT NULL CHECK (btrim(name) <> ''),
+    name_key TEXT GENERATED ALWAYS AS (public.catalog_key(name)) STORED,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),
+    UNIQUE (kind, name_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_workouts_exercises ON workouts USING GIN (exercises jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_meal_plans_meals ON meal_plans USING GIN (meals jsonb_path_ops);
+
+ALTER TABLE catalog_items ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Authenticated users can view the catalog" ON catalog_items;
+CREATE POLICY "Authenticated users can view the catalog" ON catalog_items
+    FOR SELECT TO authenticated USING (true);
+
+-- Catalog rows for p_names, adding the ones that are new. Only trainers may
+-- add rows (there is no INSERT policy); for anyone else this returns the
+-- existing rows only.
+CREATE OR REPLACE FUNCTION public.intern_catalog_items(p_kind TEXT, p_names TEXT[])
+RETURNS TABLE (id BIGINT, kind TEXT, name TEXT) AS $$
+    WITH wanted AS (
+        SELECT DISTINCT ON (public.catalog_key(n)) public.catalog_key(n) AS key,
+               btrim(regexp_replace(n, '\s+', ' ', 'g')) AS name
+        FROM unnest(p_names) AS n
+        WHERE btrim(n) <> ''
+    ), inserted AS (
+        INSERT INTO catalog_items (kind, name)
+        SELECT p_kind, wanted.name FROM wanted WHERE public.is_trainer()
+        ON CONFLICT (kind, name_key) DO NOTHING
+        RETURNING catalog_items.id, catalog_items.kind, catalog_items.name
+    )
+    SELECT * FROM inserted
+    UNION ALL
+    SELECT c.id, c.kind, c.name
+    FROM catalog_items c
+    JOIN wanted ON c.kind = p_kind AND c.name_key = wanted.key;
+$$ LANGUAGE sql SECURITY DEFINER SET search_path = public;
+
+-- Migration: intern the names in existing bodies and rewrite the bodies to
+-- reference them. Only entries that still carry a "name" are touched, so
+-- this is a no-op once applied.
+INSERT INTO catalog_items (kind, name)
+SELECT DISTINCT ON (kind, key) kind, name FROM (
+    SELECT 'exercise' AS kind, public.catalog_key(e->>'name') AS key,
+           btrim(regexp_replace(e->>'name', '\s+', ' ', 'g')) AS name
+    FROM workouts, jsonb_array_elements(exercises) AS e
+    WHERE jsonb_typeof(exercises) = 'array' AND btrim(e->>'name') <> ''
+    UNION ALL
+    SELECT 'food', public.catalog_key(m->>'name'), btrim(regexp_replace(m->>'name', '\s+', ' ', 'g'))
+    FROM meal_plans, jsonb_array_elements(meals) AS m
+    WHERE jsonb_typeof(meals) = 'array' AND btrim(m->>'name') <> ''
+) AS names
+ORDER BY kind, key
+ON CONFLICT (kind, name_key) DO NOTHING;
+
+UPDATE workouts w SET exercises = (
+    SELECT jsonb_agg(
+        CASE WHEN c.id IS NULL THEN e ELSE (e - 'name') || jsonb_build_object('exercise_id', c.id) END
+        ORDER BY ord)
+    FROM jsonb_array_elements(w.exercises) WITH ORDINALITY AS t(e, ord)
+    LEFT JOIN catalog_items c ON c.kind = 'exercise' AND c.name_key = public.catalog_key(e->>'name')
+)
+WHERE jsonb_typeof(w.exercises) = 'array' AND jsonb_path_exists(w.exercises, '$[*].name');
+
+UPDATE meal_plans mp SET meals = (
+    SELECT jsonb_agg(
+        CASE WHEN c.id IS NULL THEN m ELSE (m - 'name') || jsonb_build_object('food_id', c.id) END
+        ORDER BY ord)
+    FROM jsonb_array_elements(mp.meals) WITH ORDINALITY AS t(m, ord)
+    LEFT JOIN catalog_items c ON c.kind = 'food' AND c.name_key = public.catalog_key(m->>'name')
+)
+WHERE jsonb_typeof(mp.meals) = 'array' AND jsonb_path_exists(mp.meals, '$[*].name');
+
+-- Template versions
+--
+-- Every change to a workout's or meal plan's title, description or body
+-- records a new version; the workouts / meal_plans row is the working copy
+-- (its version column is the latest version). Bodies are stored once per
+-- distinct content in template_bodies, keyed by a hash of the JSONB, so a
+-- version that only renames a workout, or a duplicated template, shares
+-- the body of the one it came from (copy-on-write).
+--
+-- Assignments are pinned to the version current when they were created
+-- (their version column), and the client checklist and calendar show that
+-- version, so editing a template never rewrites what a client was given.
+-- Templates are archived rather than deleted (archived_at); deleting one
+-- still cascades, for example when a trainer's account is removed.
+CREATE OR REPLACE FUNCTION public.body_hash(p_body JSONB)
+RETURNS TEXT AS $$
+    SELECT encode(sha256(convert_to(COALESCE(p_body, '[]'::jsonb)::text, 'UTF8')), 'hex');
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE TABLE IF NOT EXISTS template_bodies (
+    hash TEXT PRIMARY KEY, -- body_hash(body)
+    body JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW())
+);
+
+ALTER TABLE workouts ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE workouts ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE meal_plans ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE meal_plans ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP WITH TIME ZONE;
+
+CREATE TABLE IF NOT EXISTS workout_versions (
+    workout_id UUID REFERENCES workouts(id) ON DELETE CASCADE NOT NULL,
+    version INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT,
+    body_hash TEXT REFERENCES template_bodies(hash) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),
+    PRIMARY KEY (workout_id, version)
+);
+
+CREATE TABLE IF NOT EXISTS meal_plan_versions (
+    meal_plan_id UUID REFERENCES meal_plans(id) ON DELETE CASCADE NOT NULL,
+    version INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT,
+    body_hash TEXT REFERENCES template_bodies(hash) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),
+    PRIMARY KEY (meal_plan_id, version)
+);
+
+CREATE INDEX IF NOT EXISTS idx_workout_versions_body ON workout_versions(body_hash);
+CREATE INDEX IF NOT EXISTS idx_meal_plan_versions_body ON meal_plan_versions(body_hash);
+
+ALTER TABLE workout_assignments ADD COLUMN IF NOT EXISTS version INTEGER;
+ALTER TABLE meal_assignments ADD COLUMN IF NOT EXISTS version INTEGER;
+
+-- Set the version of a new or edited template: 1 on insert, +1 when the
+-- title, description or body (TG_ARGV[0]) changes
+CREATE OR REPLACE FUNCTION public.bump_template_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        NEW.version := 1;
+    ELSIF (NEW.title, NEW.description, to_jsonb(NEW) -> TG_ARGV[0])
+          IS DISTINCT FROM (OLD.title, OLD.description, to_jsonb(OLD) -> TG_ARGV[0]) THEN
+        NEW.version := OLD.version + 1;
+    ELSE
+        NEW.version := OLD.version;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Record the version set above in TG_ARGV[1] (keyed by TG_ARGV[2]),
+-- storing the body only if its content is new
+CREATE OR REPLACE FUNCTION public.record_template_version()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_body JSONB := COALESCE(NULLIF(to_jsonb(NEW) -> TG_ARGV[0], 'null'::jsonb), '[]'::jsonb);
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.version = OLD.version THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO template_bodies (hash, body) VALUES (public.body_hash(v_body), v_body)
+    ON CONFLICT (hash) DO NOTHING;
+    EXECUTE format(
+        'INSERT INTO %I (%I, version, title, description, body_hash) VALUES ($1, $2, $3, $4, $5)',
+        TG_ARGV[1], TG_ARGV[2]
+    ) USING NEW.id, NEW.version, NEW.title, NEW.description, public.body_hash(v_body);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS workout_version_bump ON workouts;
+CREATE TRIGGER workout_version_bump
+    BEFORE INSERT OR UPDATE ON workouts
+    FOR EACH ROW EXECUTE FUNCTION public.bump_template_version('exercises');
+DROP TRIGGER IF EXISTS workout_version_record ON workouts;
+CREATE TRIGGER workout_version_record
+    AFTER INSERT OR UPDATE ON workouts
+    FOR EACH ROW EXECUTE FUNCTION public.record_template_version('exercises', 'workout_versions', 'workout_id');
+
+DROP TRIGGER IF EXISTS meal_plan_version_bump ON meal_plans;
+CREATE TRIGGER meal_plan_version_bump
+    BEFORE INSERT OR UPDATE ON meal_plans
+    FOR EACH ROW EXECUTE FUNCTION public.bump_template_version('meals');
+DROP TRIGGER IF EXISTS meal_plan_version_record ON meal_plans;
+CREATE TRIGGER meal_plan_version_record
+    AFTER INSERT OR UPDATE ON meal_plans
+    FOR EACH ROW EXECUTE FUNCTION public.record_template_version('meals', 'meal_plan_versions', 'meal_plan_id');
+
+-- Pin new assignments to the template's current version
+CREATE OR REPLACE FUNCTION public.pin_workout_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.version IS NULL THEN
+        SELECT version INTO NEW.version FROM workouts WHERE id = NEW.workout_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION public.pin_meal_plan_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.version IS NULL THEN
+        SELECT version INTO NEW.version FROM meal_plans WHERE id = NEW.meal_plan_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS workout_assignment_pin ON workout_assignments;
+CREATE TRIGGER workout_assignment_pin
+    BEFORE INSERT ON workout_assignments
+    FOR EACH ROW EXECUTE FUNCTION public.pin_workout_version();
+DROP TRIGGER IF EXISTS meal_assignment_pin ON meal_assignments;
+CREATE TRIGGER meal_assignment_pin
+    BEFORE INSERT ON meal_assignments
+    FOR EACH ROW EXECUTE FUNCTION public.pin_meal_plan_version();
+
+-- Backfill: version 1 of every existing template, and pin existing assignments to it
+INSERT INTO template_bodies (hash, body)
+SELECT DISTINCT public.body_hash(body), COALESCE(body, '[]'::jsonb)
+FROM (SELECT exercises AS body FROM workouts UNION ALL SELECT meals FROM meal_plans) AS bodies
+ON CONFLICT (hash) DO NOTHING;
+
+INSERT INTO workout_versions (workout_id, version, title, description, body_hash, created_at)
+SELECT id, version, title, description, public.body_hash(exercises), updated_at FROM workouts
+ON CONFLICT DO NOTHING;
+INSERT INTO meal_plan_versions (meal_plan_id, version, title, description, body_hash, created_at)
+SELECT id, version, title, description, public.body_hash(meals), updated_at FROM meal_plans
+ON CONFLICT DO NOTHING;
+
+UPDATE workout_assignments wa SET version = w.version
+FROM workouts w WHERE wa.version IS NULL AND w.id = wa.workout_id;
+UPDATE meal_assignments ma SET version = mp.version
+FROM meal_plans mp WHERE ma.version IS NULL AND mp.id = ma.meal_plan_id;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'workout_assignments_version_fkey') THEN
+        ALTER TABLE workout_assignments ADD CONSTRAINT workout_assignments_version_fkey
+            FOREIGN KEY (workout_id, version) REFERENCES workout_versions(workout_id, version);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'meal_assignments_version_fkey') THEN
+        ALTER TABLE meal_assignments ADD CONSTRAINT meal_assignments_version_fkey
+            FOREIGN KEY (meal_plan_id, version) REFERENCES meal_plan_versions(meal_plan_id, version);
+    END IF;
+END
+$$;
+
+-- Drop bodies no version refers to any more (after templates were deleted)
+CREATE OR REPLACE FUNCTION public.prune_template_bodies()
+RETURNS INTEGER AS $$
+    WITH pruned AS (
+        DELETE FROM template_bodies b
+        WHERE NOT EXISTS (SELECT 1 FROM workout_versions v WHERE v.body_hash = b.hash)
+          AND NOT EXISTS (SELECT 1 FROM meal_plan_versions v WHERE v.body_hash = b.hash)
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INTEGER FROM pruned;
+$$ LANGUAGE sql SECURITY DEFINER SET search_path = public;
+
+REVOKE EXECUTE ON FUNCTION public.prune_template_bodies() FROM PUBLIC;
+
+ALTER TABLE template_bodies ENABLE ROW LEVEL SECURITY;
+ALTER TABLE workout_versions ENABLE ROW LEVEL SECURITY;
+ALTER TABLE meal_plan_versions ENABLE ROW LEVEL SECURITY;
+
+-- Bodies are read through the version rows that reference them: body(v)
+-- is a computed column of both version tables (select=body in the REST
+-- API). A version row is only visible under the policies below, and a hash
+-- cannot be guessed without knowing the body, so template_bodies itself
+-- needs no SELECT policy and reading one body never enumerates the caller's
+-- history.
+CREATE OR REPLACE FUNCTION public.body(public.workout_versions)
+RETURNS JSONB AS $$
+    SELECT body FROM public.template_bodies WHERE hash = $1.body_hash;
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION public.body(public.meal_plan_versions)
+RETURNS JSONB AS $$
+    SELECT body FROM public.template_bodies WHERE hash = $1.body_hash;
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+-- The version an assignment is pinned to, looked up by primary key. It is
+-- visible to whoever can see the assignment (its client, or the trainer who
+-- owns the template), so the checklist and schedule use this instead of
+-- paying the policies below a second time.
+CREATE OR REPLACE FUNCTION public.pinned_version(public.workout_assignments)
+RETURNS public.workout_versions AS $$
+    SELECT * FROM public.workout_versions
+    WHERE workout_id = $1.workout_id AND version = $1.version;
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION public.pinned_version(public.meal_assignments)
+RETURNS public.meal_plan_versions AS $$
+    SELECT * FROM public.meal_plan_versions
+    WHERE meal_plan_id = $1.meal_plan_id AND version = $1.version;
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+-- Versions are written by the triggers only
+DROP POLICY IF EXISTS "Trainers can view versions of their workouts" ON workout_versions;
+CREATE POLICY "Trainers can view versions of their workouts" ON workout_versions
+    FOR SELECT USING (workout_id IN (SELECT public.trainer_workout_ids()));
+
+DROP POLICY IF EXISTS "Clients can view versions of workouts assigned to them" ON workout_versions;
+CREATE POLICY "Clients can view versions of workouts assigned to them" ON workout_versions
+    FOR SELECT USING (workout_id IN (SELECT public.client_workout_ids()));
+
+DROP POLICY IF EXISTS "Trainers can view versions of their meal plans" ON meal_plan_versions;
+CREATE POLICY "Trainers can view versions of their meal plans" ON meal_plan_versions
+    FOR SELECT USING (meal_plan_id IN (SELECT public.trainer_meal_plan_ids()));
+
+DROP POLICY IF EXISTS "Clients can view versions of meal plans assigned to them" ON meal_plan_versions;
+CREATE POLICY "Clients can view versions of meal plans assigned to them" ON meal_plan_versions
+    FOR SELECT USING (meal_plan_id IN (SELECT public.client_meal_plan_ids()));
+
+
+-- Client checklist: workout and meal assignments for one date in a single call.
+-- Each row mirrors the PostgREST embed ('*, workouts(*)' / '*, meal_plans(*)'),
+-- with the title, description and body of the pinned version.
+-- Runs with the caller's rights, so the RLS policies above still apply.
+CREATE OR REPLACE FUNCTION public.get_client_checklist(p_client_id UUID, p_date DATE)
+RETURNS TABLE (workouts JSON, meals JSON) AS $$
+    SELECT
+        COALESCE((
+            SELECT json_agg(to_jsonb(wa) || jsonb_build_object('workouts', CASE
+                WHEN v.version IS NULL THEN to_jsonb(w)
+                ELSE to_jsonb(w) || jsonb_build_object(
+                    'title', v.title, 'description', v.description, 'exercises', public.body(v))
+                END) ORDER BY wa.created_at)
+            FROM workout_assignments wa
+            LEFT JOIN workouts w ON w.id = wa.workout_id
+            LEFT JOIN LATERAL public.pinned_version(wa) v ON true
+            WHERE wa.client_id = p_client_id AND wa.assigned_date = p_date
+        ), '[]'::json) AS workouts,
+        COALESCE((
+            SELECT json_agg(to_jsonb(ma) || jsonb_build_object('meal_plans', CASE
+                WHEN v.version IS NULL THEN to_jsonb(mp)
+                ELSE to_jsonb(mp) || jsonb_build_object(
+                    'title', v.title, 'description', v.description, 'meals', public.body(v))
+                END) ORDER BY ma.created_at)
+            FROM meal_assignments ma
+            LEFT JOIN meal_plans mp ON mp.id = ma.meal_plan_id
+            LEFT JOIN LATERAL public.pinned_version(ma) v ON true
+            WHERE ma.client_id = p_client_id AND ma.assigned_date = p_date
+        ), '[]'::json) AS meals;
+$$ LANGUAGE sql STABLE;
+
+-- Client schedule: assignments of one client over a date range in one call,
+-- for the week/month calendar. Uses the (client_id, assigned_date) indexes.
+-- Templates are embedded as summaries of the pinned version; bodies are
+-- fetched when a day is opened.
+CREATE OR REPLACE FUNCTION public.get_client_schedule(p_client_id UUID, p_start DATE, p_end DATE)
+RETURNS TABLE (workouts JSON, meals JSON) AS $$
+    SELECT
+        COALESCE((
+            SELECT json_agg(
+                to_jsonb(wa) || jsonb_build_object('workouts', jsonb_build_object(
+                    'id', w.id,
+                    'title', COALESCE(v.title, w.title),
+                    'description', CASE WHEN v.version IS NULL THEN w.description ELSE v.description END))
+                ORDER BY wa.assigned_date, wa.created_at)
+            FROM workout_assignments wa
+            LEFT JOIN workouts w ON w.id = wa.workout_id
+            LEFT JOIN LATERAL public.pinned_version(wa) v ON true
+            WHERE wa.client_id = p_client_id AND wa.assigned_date BETWEEN p_start AND p_end
+        ), '[]'::json) AS workouts,
+        COALESCE((
+            SELECT json_agg(
+                to_jsonb(ma) || jsonb_build_object('meal_plans', jsonb_build_object(
+                    'id', mp.id,
+                    'title', COALESCE(v.title, mp.title),
+                    'description', CASE WHEN v.version IS NULL THEN mp.description ELSE v.description END))
+                ORDER BY ma.assigned_date, ma.created_at)
+            FROM meal_assignments ma
+            LEFT JOIN meal_plans mp ON mp.id = ma.meal_plan_id
+            LEFT JOIN LATERAL public.pinned_version(ma) v ON true
+            WHERE ma.client_id = p_client_id AND ma.assigned_date BETWEEN p_start AND p_end
+        ), '[]'::json) AS meals;
+$$ LANGUAGE sql STABLE;
+
+-- Assignments by id, in the shape of get_client_checklist: the rows a
+-- session learns about from the change feed below. Runs with the caller's
+-- rights, so ids the caller may not see come back as nothing.
+CREATE OR REPLACE FUNCTION public.get_assignments_by_id(p_workout_ids UUID[], p_meal_ids UUID[])
+RETURNS TABLE (workouts JSON, meals JSON) AS $$
+    SELECT
+        COALESCE((
+            SELECT json_agg(to_jsonb(wa) || jsonb_build_object('workouts', CASE
+                WHEN v.version IS NULL THEN to_jsonb(w)
+                ELSE to_jsonb(w) || jsonb_build_object(
+                    'title', v.title, 'description', v.description, 'exercises', public.body(v))
+                END) ORDER BY wa.assigned_date, wa.created_at)
+            FROM workout_assignments wa
+            LEFT JOIN workouts w ON w.id = wa.workout_id
+            LEFT JOIN LATERAL public.pinned_version(wa) v ON true
+            WHERE wa.id = ANY(p_workout_ids)
+        ), '[]'::json) AS workouts,
+        COALESCE((
+            SELECT json_agg(to_jsonb(ma) || jsonb_build_object('meal_plans', CASE
+                WHEN v.version IS NULL THEN to_jsonb(mp)
+                ELSE to_jsonb(mp) || jsonb_build_object(
+                    'title', v.title, 'description', v.description, 'meals', public.body(v))
+                END) ORDER BY ma.assigned_date, ma.created_at)
+            FROM meal_assignments ma
+            LEFT JOIN meal_plans mp ON mp.id = ma.meal_plan_id
+            LEFT JOIN LATERAL public.pinned_version(ma) v ON true
+            WHERE ma.id = ANY(p_meal_ids)
+        ), '[]'::json) AS meals;
+$$ LANGUAGE sql STABLE;
+
+-- ============================================================================
+-- Assignment change feed
+-- ============================================================================
+-- Writes to the assignment tables are announced on the assignment_changes
+-- channel, so open client dashboards and trainer adherence pages update
+-- without polling (see db/changes.py). NOTIFY is delivered on commit, and
+-- payloads are limited to 8000 bytes, so each notification carries up to 20
+-- rows of one statement: id, client, trainer, date, pinned version and
+-- completion, never template content. LISTEN needs no privileges on the
+-- tables, so the app's listener can log in as a role that can read nothing.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'assignment_change') THEN
+        CREATE TYPE public.assignment_change AS (
+            id UUID,
+            client_id UUID,
+            trainer_id UUID,
+            assigned_date DATE,
+            version INTEGER,
+            completed BOOLEAN,
+            completed_at TIMESTAMP WITH TIME ZONE
+        );
+    END IF;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION public.notify_assignment_changes(p_table TEXT, p_op TEXT, p_changes public.assignment_change[])
+RETURNS VOID AS $$
+BEGIN
+    PERFORM pg_notify('assignment_changes', json_build_object(
+        'table', p_table, 'op', p_op, 'rows', json_agg(json_build_object(
+            'id', c.id, 'client_id', c.client_id, 'trainer_id', c.trainer_id,
+            'assigned_date', c.assigned_date, 'version', c.version,
+            'completed', c.completed, 'completed_at', c.completed_at)))::text)
+    FROM unnest(p_changes) WITH ORDINALITY AS c(id, client_id, trainer_id, assigned_date, version, completed, completed_at, n)
+    GROUP BY (c.n - 1) / 20;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.announce_workout_assignments()
+RETURNS TRIGGER AS $$
+DECLARE
+    changes public.assignment_change[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changes := ARRAY(
+            SELECT ROW(r.id, r.client_id, w.trainer_id, r.assigned_date, r.version, r.completed, r.completed_at)::public.assignment_change
+            FROM old_rows r LEFT JOIN workouts w ON w.id = r.workout_id);
+    ELSE
+        changes := ARRAY(
+            SELECT ROW(r.id, r.client_id, w.trainer_id, r.assigned_date, r.version, r.completed, r.completed_at)::public.assignment_change
+            FROM new_rows r LEFT JOIN workouts w ON w.id = r.workout_id);
+    END IF;
+    PERFORM public.notify_assignment_changes(TG_TABLE_NAME, TG_OP, changes);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION public.announce_meal_assignments()
+RETURNS TRIGGER AS $$
+DECLARE
+    changes public.assignment_change[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changes := ARRAY(
+            SELECT ROW(r.id, r.client_id, mp.trainer_id, r.assigned_date, r.version, r.completed, r.completed_at)::public.assignment_change
+            FROM old_rows r LEFT JOIN meal_plans mp ON mp.id = r.meal_plan_id);
+    ELSE
+        changes := ARRAY(
+            SELECT ROW(r.id, r.client_id, mp.trainer_id, r.assigned_date, r.version, r.completed, r.completed_at)::public.assignment_change
+            FROM new_rows r LEFT JOIN meal_plans mp ON mp.id = r.meal_plan_id);
+    END IF;
+    PERFORM public.notify_assignment_changes(TG_TABLE_NAME, TG_OP, changes);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS workout_assignments_announce_insert ON workout_assignments;
+CREATE TRIGGER workout_assignments_announce_insert
+    AFTER INSERT ON workout_assignments REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.announce_workout_assignments();
+DROP TRIGGER IF EXISTS workout_assignments_announce_update ON workout_assignments;
+CREATE TRIGGER workout_assignments_announce_update
+    AFTER UPDATE ON workout_assignments REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.announce_workout_assignments();
+DROP TRIGGER IF EXISTS workout_assignments_announce_delete ON workout_assignments;
+CREATE TRIGGER workout_assignments_announce_delete
+    AFTER DELETE ON workout_assignments REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.announce_workout_assignments();
+
+DROP TRIGGER IF EXISTS meal_assignments_announce_insert ON meal_assignments;
+CREATE TRIGGER meal_assignments_announce_insert
+    AFTER INSERT ON meal_assignments REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.announce_meal_assignments();
+DROP TRIGGER IF EXISTS meal_assignments_announce_update ON meal_assignments;
+CREATE TRIGGER meal_assignments_announce_update
+    AFTER UPDATE ON meal_assignments REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.announce_meal_assignments();
+DROP TRIGGER IF EXISTS meal_assignments_announce_delete ON meal_assignments;
+CREATE TRIGGER meal_assignments_announce_delete
+    AFTER DELETE ON meal_assignments REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.announce_meal_assignments();
+
+-- ============================================================================
+-- Background jobs
+-- ============================================================================
+-- Queue for trainer operations too slow to run inside a page rerun (bulk
+-- scheduling, archiving a template with many assignments); see db/jobs.py.
+-- Workers claim jobs with claim_job(), which locks the row it takes with
+-- FOR UPDATE SKIP LOCKED, so concurrent workers never run the same job and
+-- never wait on each other. A job stays leased to its worker until
+-- locked_until; one whose worker died is claimed again after that.
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    owner_id UUID NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    params JSONB NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    result JSONB,
+    error TEXT,
+    run_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    locked_until TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- The jobs panel lists an owner's latest jobs; claim_job looks only at
+-- unfinished ones, which stay few however many have completed
+CREATE INDEX IF NOT EXISTS idx_jobs_owner_created ON jobs(owner_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_jobs_runnable ON jobs(owner_id, run_after)
+    WHERE status IN ('queued', 'running');
+
+ALTER TABLE jobs ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Trainers can manage their own jobs" ON jobs;
+CREATE POLICY "Trainers can manage their own jobs" ON jobs
+    FOR ALL USING (owner_id = (SELECT auth.uid()))
+    WITH CHECK (owner_id = (SELECT auth.uid()) AND (SELECT public.is_trainer()));
+
+-- Claim the owner's next runnable job: queued and due, or running with an
+-- expired lease. Runs with the caller's rights, so a trainer can only claim
+-- their own jobs.
+CREATE OR REPLACE FUNCTION public.claim_job(p_owner_id UUID, p_lease_seconds INTEGER)
+RETURNS SETOF jobs AS $$
+    UPDATE jobs
+    SET status = 'running',
+        attempts = attempts + 1,
+        locked_until = NOW() + make_interval(secs => p_lease_seconds),
+        updated_at = NOW()
+    WHERE id = (
+        SELECT id FROM jobs
+        WHERE owner_id = p_owner_id
+          AND status IN ('queued', 'running')
+          AND ((status = 'queued' AND run_after <= NOW()) OR locked_until < NOW())
+        ORDER BY run_after, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *;
+$$ LANGUAGE sql;
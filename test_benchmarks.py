@@ -0,0 +1,109 @@
+"""
+Tests for the benchmark helpers in benchmarks/app_bench.py, benchmarks/startup_bench.py
+and benchmarks/memory_bench.py
+Run with: python -m pytest -q test_benchmarks.py
+"""
+
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Add parent directory to path to import the benchmarks package
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks import app_bench, memory_bench, startup_bench
+from db.fetch import fetch_all
+from db.sqlite_repository import SQLiteRepository
+
+
+def test_seed_matches_requested_sizes():
+    """Test that seeding creates the requested rows and is not repeated"""
+    sizes = {'trainers': 2, 'clients': 5, 'assignments': 40}
+    repo = SQLiteRepository()
+
+    assert app_bench.seed(repo, sizes) is True
+    assert app_bench.seed(repo, sizes) is False
+    count = lambda table: repo.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    assert count('profiles') == 7
+    assert count('workouts') == 2 * app_bench.TEMPLATES_PER_TRAINER
+    assert count('workout_assignments') + count('meal_assignments') == 40
+
+    workouts, meals = repo.get_checklist(app_bench.client_id(0, sizes), app_bench.date.today().isoformat())
+    assert len(workouts) == 1 and len(meals) == 1
+
+
+def test_counting_repository_records_calls():
+    """Test that every repository call is counted with its payload size"""
+    repo = app_bench.CountingRepository(SQLiteRepository())
+    repo.search_clients('ann')
+
+    (name, start, end, size, loader), = repo.calls
+    assert name == 'search_clients'
+    assert end >= start
+    assert size == app_bench.payload_size([('ann',), {}], [])
+
+
+def test_waits_count_fetch_all_loaders_side_by_side():
+    """Test that a fetch_all batch costs as many waits as its busiest loader"""
+    calls = [('a', 0.0, 1.0, 0, None), ('b', 1.0, 2.0, 0, (7, 0)), ('c', 1.0, 2.0, 0, (7, 1)),
+             ('d', 2.0, 3.0, 0, (7, 1)), ('e', 3.0, 4.0, 0, (8, 0)), ('f', 5.0, 6.0, 0, None)]
+    assert app_bench.waits(calls) == 5
+    assert app_bench.waits([]) == 0
+
+    repo = app_bench.CountingRepository(SQLiteRepository())
+    fetch_all(lambda: repo.search_clients('a'), lambda: (repo.search_clients('b'), repo.search_clients('c')),
+              executor=ThreadPoolExecutor(max_workers=2))
+    repo.search_clients('d')
+    assert app_bench.waits(repo.calls) == 3
+
+
+def test_compare_flags_regressions():
+    """Test percentile and the baseline comparison"""
+    assert app_bench.percentile([5, 1, 4, 2, 3], 50) == 3
+    assert app_bench.percentile([5, 1, 4, 2, 3], 95) == 5
+
+    baseline = {'page': {'p50_ms': 10, 'p95_ms': 20, 'round_trips': 2, 'bytes': 1000}}
+    same = {'page': dict(baseline['page'], p95_ms=25, bytes=1050)}
+    worse = {'page': {'p50_ms': 10, 'p95_ms': 40, 'round_trips': 3, 'bytes': 2000}}
+
+    assert app_bench.compare(same, baseline) == []
+    assert len(app_bench.compare(worse, baseline)) == 3
+
+    baseline['page']['waits'] = 1
+    assert app_bench.compare({'page': dict(same['page'], waits=2)}, baseline) == ['page: 2 waits (baseline 1)']
+
+
+def test_startup_budget_counts_app_imports_only():
+    """Test that only imports after the marker count towards the budget"""
+    stderr = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       900 |        900 | streamlit",
+        startup_bench.MARKER,
+        "import time:       100 |        100 |   db.search",
+        "import time:       400 |        500 | db.repository",
+    ])
+    modules = startup_bench.app_imports(stderr)
+    assert modules == [('db.search', 100, 100, 1), ('db.repository', 400, 500, 0)]
+
+    result = {'exception': None, 'titles': [startup_bench.LOGIN_TITLE], 'lazy_loaded': []}
+    assert startup_bench.check(result, modules, budget_ms=1) == []
+    assert startup_bench.check(result, modules, budget_ms=0.4) == ["imports took 0.5 ms (budget 0.4 ms)"]
+    assert startup_bench.check({**result, 'lazy_loaded': ['httpx']}, modules, budget_ms=1) == [
+        "imported before sign in: httpx"]
+
+
+def test_memory_bench_measures_both_representations():
+    """Test that session state is measured as dicts and as records"""
+    sizes = memory_bench.sizes_for(3)
+    repo = SQLiteRepository()
+    app_bench.seed(repo, sizes)
+    user_ids = [app_bench.client_id(n, sizes) for n in range(3)]
+
+    state = memory_bench.session_state(repo, user_ids[0], as_records=True)
+    assert state['profile']['role'] == 'client' and len(state['schedule']) == 2
+    dicts, _ = memory_bench.retained_bytes(repo, user_ids, as_records=False)
+    records, templates = memory_bench.retained_bytes(repo, user_ids, as_records=True)
+    assert 0 < records < dicts and templates > 0
+
+    assert memory_bench.check(100, 40, 0.5) == []
+    assert memory_bench.check(100, 60, 0.5) == ["records take 60% of the dicts' memory (target 50%)"]
@@ -0,0 +1,841 @@
+"""
+Tests for the db package
+Run with: python -m pytest -q test_db.py
+"""
+
+import gc
+import io
+import json
+import pickle
+import sys
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+# Add parent directory to path to import the db package
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from db.adherence import adherence_frame, by_client, by_template, by_week, overall
+from db.bulk import batches, build_assignment_rows, schedule_dates
+from db.cache import QueryCache
+from db.catalog import Catalog, PrefixTrie, reference_body
+from db.client import PooledClient, TracingTransport
+from db.changes import ChangeFeed, PostgresListener, SessionChanges, apply_changes, merge_rows
+from db.completions import PendingCompletions, flush
+from db.export import csv_chunks, export_file_name, history_rows, parquet_chunks
+from db.fetch import fetch_all
+from db.imports import import_schedule, import_templates, read_records
+from db.jobs import JOB_HANDLERS, JobRunner, retry_delay
+from db.pagination import history_page_query, next_cursor, page_query
+from db.records import MealAssignment, Profile, Workout, WorkoutAssignment, assignment_records
+from db.render import details_markdown
+from db.repository import SupabaseRepository
+from db.schedule import ScheduleCache, group_by_day, next_window, previous_window, window
+from db.search import apply_search
+from db.session import AuthSession, TokenRefresher
+from db.shared_cache import FakeRedis, RedisCacheStore, SharedQueryCache, SQLiteCacheStore, encode_key
+from db.sqlite_repository import SQLiteRepository
+from db.tracing import TracingRepository, export_trace, trace_rerun
+
+TEST_URL = "https://example.supabase.co"
+TEST_KEY = "header.payload.signature"
+
+
+def test_pooled_clients_share_transport():
+    """Test that per-session clients send requests over one shared transport"""
+    seen = []
+
+    def handler(request):
+        seen.append(request.url.path)
+        return httpx.Response(200, json=[])
+
+    transport = httpx.MockTransport(handler)
+    first = PooledClient(TEST_URL, TEST_KEY, transport)
+    second = PooledClient(TEST_URL, TEST_KEY, transport)
+
+    first.table('workouts').select('*').execute()
+    second.table('meal_plans').select('*').execute()
+
+    assert seen == ['/rest/v1/workouts', '/rest/v1/meal_plans']
+
+
+def test_pooled_clients_isolate_auth_state():
+    """Test that sessions do not share auth storage"""
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json=[]))
+    first = PooledClient(TEST_URL, TEST_KEY, transport)
+    second = PooledClient(TEST_URL, TEST_KEY, transport)
+
+    assert first.auth._storage is not second.auth._storage
+    # Refreshed by db/session.py instead of a timer per client
+    assert first.auth._auto_refresh_token is False
+
+
+def test_query_cache_hits_and_misses():
+    """Test that the query cache only calls the loader on a miss"""
+    cache = QueryCache()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return ['row']
+
+    assert cache.get_or_load(('workouts', 't1'), loader) == ['row']
+    assert cache.get_or_load(('workouts', 't1'), loader) == ['row']
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_query_cache_ttl_and_lru():
+    """Test that entries expire after the TTL and the oldest is evicted"""
+    now = [0.0]
+    cache = QueryCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.set(('workouts', 't1'), 1)
+    cache.set(('workouts', 't2'), 2)
+    cache.get(('workouts', 't1'))
+    cache.set(('workouts', 't3'), 3)
+
+    assert cache.get(('workouts', 't2')) == (False, None)
+    assert cache.get(('workouts', 't1')) == (True, 1)
+
+    now[0] = 11
+    assert cache.get(('workouts', 't1')) == (False, None)
+
+
+def test_query_cache_invalidation():
+    """Test that invalidation drops one owner's entry or every entry for a name"""
+    cache = QueryCache()
+    cache.set(('workouts', 't1'), 1)
+    cache.set(('workouts', 't2'), 2)
+    cache.set(('clients', 't1'), 3)
+    cache.set(('clients', 't2'), 4)
+
+    cache.invalidate('workouts', 't1')
+    cache.invalidate('clients')
+
+    assert cache.get(('workouts', 't1'))[0] is False
+    assert cache.get(('workouts', 't2'))[0] is True
+    assert cache.get(('clients', 't2'))[0] is False
+
+
+def test_schedule_dates_follows_weekdays():
+    """Test that only the requested weekdays inside the range are scheduled"""
+    # 2024-01-01 is a Monday
+    dates = schedule_dates(date(2024, 1, 1), date(2024, 1, 14), ["Mon", "Wed", "Fri"])
+
+    assert [d.day for d in dates] == [1, 3, 5, 8, 10, 12]
+
+
+def test_build_assignment_rows_and_batches():
+    """Test that rows are built once per client and date and split into batches"""
+    dates = [date(2024, 1, 1), date(2024, 1, 3)]
+    rows = build_assignment_rows('workout_id', 'w1', ['c1', 'c2', 'c1'], dates)
+
+    assert len(rows) == 4
+    assert rows[0] == {'workout_id': 'w1', 'client_id': 'c1', 'assigned_date': '2024-01-01'}
+    assert [len(b) for b in batches(rows, size=3)] == [3, 1]
+
+
+def test_page_query_keyset_params():
+    """Test that a page query orders on (created_at, id) and filters after the cursor"""
+    client = PooledClient(TEST_URL, TEST_KEY, httpx.MockTransport(lambda request: httpx.Response(200, json=[])))
+    rows = [
+        {'id': 'b', 'created_at': '2024-01-02T00:00:00+00:00'},
+        {'id': 'a', 'created_at': '2024-01-01T00:00:00+00:00'},
+    ]
+    query = page_query(client.table('workouts').select('id'), after=next_cursor(rows), limit=21)
+
+    assert query.params['order'] == 'created_at.desc,id.desc'
+    assert query.params['limit'] == '21'
+    assert query.params['or'] == (
+        '(created_at.lt."2024-01-01T00:00:00+00:00",'
+        'and(created_at.eq."2024-01-01T00:00:00+00:00",id.lt.a))'
+    )
+    assert next_cursor([]) is None
+
+    query = history_page_query(client.table('workout_assignments').select('id'), after=('2024-01-01', 'a'), limit=500)
+    assert query.params['order'] == 'assigned_date.asc,id.asc'
+    assert query.params['or'] == '(assigned_date.gt.2024-01-01,and(assigned_date.eq.2024-01-01,id.gt.a))'
+
+
+def test_list_jobs_sends_one_order_param():
+    """Test that jobs are ordered on (created_at, id) in a single PostgREST order param"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=[])
+
+    repo = SupabaseRepository(PooledClient(TEST_URL, TEST_KEY, httpx.MockTransport(handler)))
+    assert repo.list_jobs('t1', 20) == []
+    (request,) = requests
+    assert request.url.params.get_list('order') == ['created_at.desc,id.desc']
+    assert request.url.params['limit'] == '20'
+
+
+def test_apply_search_builds_quoted_ilike_filter():
+    """Test that client search matches name or email and strips quote characters"""
+    client = PooledClient(TEST_URL, TEST_KEY, httpx.MockTransport(lambda request: httpx.Response(200, json=[])))
+    query = apply_search(client.table('profiles').select('id'), ' Jo"n ', ['full_name', 'email'])
+
+    assert query.params['or'] == '(full_name.ilike."*Jon*",email.ilike."*Jon*")'
+    assert 'or' not in apply_search(client.table('profiles').select('id'), '  ', ['email']).params
+
+    query = apply_search(client.table('profiles').select('id'), 'john_doe 100%*', ['email'])
+    assert query.params['or'] == r'(email.ilike."*john\\_doe 100\\%_*")'
+
+
+def test_pending_completions_overlay_and_cancel():
+    """Test that toggles are shown optimistically and toggling back cancels them"""
+    pending = PendingCompletions(clock=lambda: 0.0)
+    pending.set('workout', 'a1', True, saved=False)
+
+    assert pending.value('workout', 'a1', False) is True
+    assert pending.value('meal', 'a1', False) is False
+
+    pending.set('workout', 'a1', False, saved=False)
+    assert len(pending) == 0
+    assert not pending.due()
+
+
+def test_pending_completions_flush_batches_and_retries():
+    """Test that pending toggles are sent in one payload, retried, then cleared"""
+    now = [0.0]
+    pending = PendingCompletions(clock=lambda: now[0])
+    pending.set('workout', 'a1', True, saved=False)
+    pending.set('meal', 'm1', False, saved=True)
+    assert not pending.due()
+    now[0] = 10.0
+    assert pending.due()
+
+    attempts = []
+
+    def send(payload):
+        attempts.append(payload)
+        if len(attempts) == 1:
+            raise ConnectionError("temporary")
+
+    written = flush(pending, send, sleep=lambda seconds: None)
+
+    assert len(attempts) == 2
+    assert [row['id'] for row in attempts[0]['workouts']] == ['a1']
+    assert attempts[0]['meals'] == [{'id': 'm1', 'completed': False, 'completed_at': None}]
+    assert set(written) == {('workout', 'a1'), ('meal', 'm1')}
+    assert len(pending) == 0
+
+    # Toggles recorded while a batch is being written are not dropped with it
+    pending.set('workout', 'a1', True, saved=False)
+    pending.set('workout', 'a2', True, saved=False)
+
+    def toggle_during_send(payload):
+        pending.set('workout', 'a1', False, saved=True)
+        pending.set('meal', 'm2', True, saved=False)
+
+    written = flush(pending, toggle_during_send)
+    assert set(written) == {('workout', 'a1'), ('workout', 'a2')}
+    assert set(pending.snapshot()) == {('workout', 'a1'), ('meal', 'm2')}
+    assert pending.value('workout', 'a1', True) is False
+
+
+def test_pending_completions_flush_later_wakes_or_writes():
+    """Test that due changes wake the session, or are written once it has gone"""
+    now = [0.0]
+    pending = PendingCompletions(clock=lambda: now[0])
+    pending.set('workout', 'a1', True, saved=False)
+    now[0] = 10.0  # already due, so the timer fires at once
+
+    woken = threading.Event()
+    pending.flush_later(lambda: woken.set() or True, lambda payload: pytest.fail("session is still open"))
+    assert woken.wait(5)
+    assert len(pending) == 1
+
+    sent = threading.Event()
+    pending.flush_later(lambda: False, lambda payload: sent.set())
+    assert sent.wait(5)
+    wait_for(lambda: len(pending) == 0)
+
+def test_tracing_records_requests_under_repository_spans():
+    """Test that traced reruns get a span per repository call and HTTP request"""
+    def handler(request):
+        return httpx.Response(200, json=[{'id': 1}, {'id': 2}], headers={'content-range': '0-1/*'})
+
+    client = PooledClient(TEST_URL, TEST_KEY, TracingTransport(httpx.MockTransport(handler)))
+    client.table('workouts').select('*').execute()  # not traced
+
+    with trace_rerun(page='Workouts') as trace:
+        client.table('workouts').select('id').eq('trainer_id', 't1').execute()
+
+    (depth, request), = [(d, s) for d, s in trace.walk() if s is not trace.root]
+    assert depth == 1
+    assert request.name == 'GET workouts'
+    assert request.attributes['service'] == 'rest'
+    assert request.attributes['query'] == 'select=id&trainer_id=eq.t1'
+    assert request.attributes['http.status'] == 200
+    assert request.attributes['rows'] == 2
+    assert request.attributes['bytes'] > 0
+
+    repo = TracingRepository(SQLiteRepository())
+    with trace_rerun() as trace:
+        repo.list_templates('workouts', 't1')
+    assert [(d, s.name, s.attributes) for d, s in trace.walk()][1] == (
+        1, 'repo.list_templates', {'table': 'workouts', 'rows': 0}
+    )
+
+
+def test_export_trace_formats(tmp_path):
+    """Test the JSON lines and OTLP/JSON exporters"""
+    with trace_rerun(role='trainer') as trace:
+        with trace.span('repo.get_profile'):
+            pass
+
+    export_trace(trace, str(tmp_path / 'spans.jsonl'))
+    spans = [json.loads(line) for line in (tmp_path / 'spans.jsonl').read_text().splitlines()]
+    assert [span['name'] for span in spans] == ['rerun', 'repo.get_profile']
+    assert spans[1]['parent_id'] == spans[0]['span_id']
+
+    export_trace(trace, str(tmp_path / 'spans.otlp'), 'otlp')
+    record, = [json.loads(line) for line in (tmp_path / 'spans.otlp').read_text().splitlines()]
+    otlp_spans = record['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert otlp_spans[0]['attributes'] == [{'key': 'role', 'value': {'stringValue': 'trainer'}}]
+    assert otlp_spans[1]['parentSpanId'] == otlp_spans[0]['spanId']
+
+
+def test_fetch_all_runs_loaders_together_in_the_callers_trace():
+    """Test that loaders overlap, keep their order and trace under one span"""
+    barrier = threading.Barrier(3, timeout=5)
+    repo = TracingRepository(SQLiteRepository())
+
+    def loader(table):
+        def load():
+            barrier.wait()  # only passes if all three run at once
+            return [table, fetch_all(lambda: 1, lambda: 2)]
+        return load
+
+    def list_workouts():
+        barrier.wait()
+        return repo.list_templates('workouts', 't1')
+
+    with ThreadPoolExecutor(max_workers=2) as executor, trace_rerun() as trace:
+        results = fetch_all(loader('workouts'), loader('meal_plans'), list_workouts, executor=executor)
+        assert results == [['workouts', [1, 2]], ['meal_plans', [1, 2]], []]
+
+        with pytest.raises(ValueError):
+            fetch_all(lambda: None, lambda: int('x'), executor=executor)
+
+    names = [(d, s.name) for d, s in trace.walk()]
+    assert names[1:3] == [(1, 'fetch_all'), (2, 'repo.list_templates')]
+
+
+def test_job_runner_reports_progress_and_retries():
+    """Test that jobs run in the background with progress, retries and a final failure"""
+    repo = SQLiteRepository()
+    repo.create_profile('t1', 'coach@example.com', 'Coach', 'trainer')
+    repo.create_profile('c1', 'ann@example.com', 'Ann', 'client')
+    workout = repo.create_template('workouts', 't1', 'Legs', '', [])
+    failures = []
+
+    def flaky(repo, params, progress):
+        failures.append(params['n'])
+        if len(failures) < 2:
+            raise RuntimeError('try again')
+        return {'ok': True}
+
+    def broken(repo, params, progress):
+        raise RuntimeError('always')
+
+    done = []
+    handlers = {'flaky': flaky, 'broken': broken, **JOB_HANDLERS}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        runner = JobRunner(repo, 't1', executor, on_done=done.append, handlers=handlers, retry_base=0)
+        bulk = repo.enqueue_job('t1', 'bulk_assign', {
+            'table': 'workout_assignments', 'template_id': workout['id'],
+            'client_ids': ['c1'], 'dates': ['2024-01-01', '2024-01-02']
+        })
+        repo.enqueue_job('t1', 'flaky', {'n': 1})
+        repo.enqueue_job('t1', 'broken', {}, max_attempts=2)
+        assert runner.kick().result(timeout=5) == 5  # 3 jobs, 2 retries
+
+    jobs = {job['kind']: job for job in repo.list_jobs('t1', 10)}
+    assert (jobs['bulk_assign']['status'], jobs['bulk_assign']['done'], jobs['bulk_assign']['total']) == ('done', 2, 2)
+    assert jobs['bulk_assign']['result'] == {'inserted': 2, 'skipped': 0}
+    assert (jobs['flaky']['status'], jobs['flaky']['attempts']) == ('done', 2)
+    assert (jobs['broken']['status'], jobs['broken']['attempts']) == ('failed', 2)
+    assert jobs['broken']['error'] == 'RuntimeError: always'
+    assert [job['id'] for job in done] == [bulk['id'], jobs['flaky']['id']]
+    assert [retry_delay(n, 5) for n in (1, 2, 3)] == [5, 10, 20]
+
+
+def test_history_export_fetches_pages_as_it_encodes():
+    """Test that exports interleave both tables by date and fetch a page per chunk"""
+    import pyarrow.parquet as pq
+
+    repo = SQLiteRepository()
+    repo.create_profile('t1', 't@example.com', 'Coach', 'trainer')
+    repo.create_profile('c1', 'c@example.com', 'Ann', 'client')
+    workout = repo.create_template('workouts', 't1', 'Legs', '', [])
+    meal_plan = repo.create_template('meal_plans', 't1', 'Bulk', '', [])
+    dates = [d.isoformat() for d in schedule_dates(date(2024, 1, 1), date(2024, 1, 7), ["Mon", "Wed", "Fri", "Sun"])]
+    repo.upsert_assignments('workout_assignments', build_assignment_rows('workout_id', workout['id'], ['c1'], map(date.fromisoformat, dates)))
+    repo.upsert_assignments('meal_assignments', build_assignment_rows('meal_plan_id', meal_plan['id'], ['c1'], map(date.fromisoformat, dates[:2])))
+    pages = []
+    get_history_page = repo.get_history_page
+    repo.get_history_page = lambda table, *args, **kwargs: pages.append(table) or get_history_page(table, *args, **kwargs)
+
+    chunks = csv_chunks(history_rows(repo, 'c1', page_size=2), size=2)
+    assert next(chunks) == b'date,type,title,version,completed,completed_at\r\n'
+    assert pages == []
+    assert next(chunks).decode().splitlines() == [
+        '2024-01-01,workout,Legs,1,False,', '2024-01-01,meal,Bulk,1,False,'
+    ]
+    assert pages == ['workout_assignments', 'meal_assignments']
+    lines = b''.join(chunks).decode().splitlines()
+    assert [line[:10] for line in lines] == ['2024-01-03', '2024-01-03', '2024-01-05', '2024-01-07']
+    # A full last page takes one more (empty) request to find the end
+    assert pages[2:] == ['workout_assignments', 'meal_assignments', 'workout_assignments']
+
+    parquet = b''.join(parquet_chunks(history_rows(repo, 'c1', page_size=2), size=4))
+    parquet_file = pq.ParquetFile(io.BytesIO(parquet))
+    assert parquet_file.metadata.num_rows == 6
+    assert parquet_file.num_row_groups == 2
+    assert parquet_file.read_row_group(0, use_threads=False).column('date').to_pylist()[0] == date(2024, 1, 1)
+    assert export_file_name('Ann O\'Neil', 'Parquet', date(2024, 2, 1)) == 'ann-o-neil-history-2024-02-01.parquet'
+
+
+def test_import_groups_rows_batches_writes_and_reports_errors():
+    """Test that imports group entry rows, intern names and report bad rows by number"""
+    repo = SQLiteRepository()
+    repo.create_profile('t1', 't@example.com', 'Coach', 'trainer')
+    repo.create_profile('c1', 'ann@example.com', 'Ann', 'client')
+    workouts = io.BytesIO(
+        b'Title,Description,Exercise,Sets,Reps\n'
+        b'Legs,Lower body,Back squat,5,5\n'
+        b',,Lunge,3,10\n'
+        b'Empty,,,,\n'
+        b'Push,, bench  PRESS ,5,5\n'
+    )
+    creates = []
+    create_templates = repo.create_templates
+    repo.create_templates = lambda *args: creates.append(len(args[2])) or create_templates(*args)
+
+    report = import_templates(repo, 'workouts', 't1', read_records(workouts, 'csv'), batch_size=2)
+    assert report == {'imported': 2, 'skipped': 0, 'errors': [{'row': 4, 'error': 'No exercise names'}]}
+    assert creates == [1, 1]
+    assert not workouts.closed
+    legs = repo.find_templates('workouts', 't1', ['Legs'])[0]
+    assert [entry['sets'] for entry in repo.get_template_body('workouts', legs['id'])] == ['5', '3']
+    assert {item['name'] for item in repo.list_catalog('exercise')} == {'Back squat', 'Lunge', 'bench PRESS'}
+
+    meal_plans = io.BytesIO(
+        b'{"title": "Bulk", "meals": [{"name": "Oats", "time": 8}]}\n'
+        b'\n'
+        b'not json\n'
+        b'{"title": "Cut", "meals": "eggs"}\n'
+    )
+    report = import_templates(repo, 'meal_plans', 't1', read_records(meal_plans, 'json'))
+    assert report['imported'] == 1
+    assert [error['row'] for error in report['errors']] == [3, 4]
+
+    schedule = io.BytesIO(
+        b'email,title,date\n'
+        b'ann@example.com,Legs,2024-01-01\n'
+        b'ANN@example.com,Legs,2024-01-01\n'
+        b'bob@example.com,Legs,2024-01-02\n'
+        b'ann@example.com,Arms,2024-01-02\n'
+        b'ann@example.com,Push,2024-02-30\n'
+        b'ann@example.com,Push,2024-01-03\n'
+    )
+    report = import_schedule(repo, 'workout_assignments', 't1', read_records(schedule, 'csv'), batch_size=4)
+    assert (report['imported'], report['skipped']) == (2, 1)
+    assert report['errors'] == [
+        {'row': 4, 'error': 'No client with email bob@example.com'},
+        {'row': 5, 'error': "No workout titled 'Arms'"},
+        {'row': 6, 'error': "Invalid date '2024-02-30' (expected YYYY-MM-DD)"},
+    ]
+    assert len(repo.get_schedule('c1', '2024-01-01', '2024-01-31')[0]) == 2
+
+
+def test_adherence_rollups():
+    """Test the per-client, per-week and per-template completion rates"""
+    def row(grain, id, name, kind, week, assigned, completed):
+        return {'grain': grain, 'id': id, 'name': name, 'kind': kind,
+                'week_start': week, 'assigned': assigned, 'completed': completed}
+
+    frame = adherence_frame([
+        row('client', 'c1', 'Ann', 'workout', '2024-01-01', 4, 3),
+        row('client', 'c1', 'Ann', 'meal', '2024-01-08', 2, 0),
+        row('client', 'c2', 'Bob', 'workout', '2024-01-01', 4, 4),
+        row('template', 'w1', 'Legs', 'workout', '2024-01-01', 8, 7),
+        row('template', 'm1', None, 'meal', '2024-01-08', 2, 0),
+    ])
+
+    clients = by_client(frame)
+    assert clients['name'].tolist() == ['Ann', 'Bob']
+    assert clients['completion_pct'].tolist() == [50.0, 100.0]
+
+    weeks = by_week(frame)
+    assert weeks.loc['2024-01-01', 'workout'] == 87.5
+    assert weeks.loc['2024-01-08', 'meal'] == 0.0
+
+    assert by_template(frame)['name'].tolist() == ['(deleted)', 'Legs']
+    assert overall(frame) == {'all': 70.0, 'meal': 0.0, 'workout': 87.5}
+    assert overall(adherence_frame([])) == {'all': None}
+
+
+def test_schedule_windows():
+    """Test week (Monday to Sunday) and month windows and paging between them"""
+    day = date(2024, 2, 14)  # a Wednesday
+
+    assert window('Week', day) == (date(2024, 2, 12), date(2024, 2, 18))
+    assert window('Month', day) == (date(2024, 2, 1), date(2024, 2, 29))
+    assert next_window('Week', date(2024, 2, 26)) == (date(2024, 3, 4), date(2024, 3, 10))
+    assert next_window('Month', date(2024, 12, 1)) == (date(2025, 1, 1), date(2025, 1, 31))
+    assert previous_window('Month', date(2024, 3, 1)) == (date(2024, 2, 1), date(2024, 2, 29))
+
+
+def test_schedule_cache_loads_once_and_uses_prefetch():
+    """Test that windows are cached, prefetched windows are reused and saves are applied"""
+    now = [0.0]
+    loads = []
+
+    def load(start, end):
+        loads.append((start, end))
+        return [{'id': 'w1', 'assigned_date': start.isoformat(), 'completed': False}], []
+
+    cache = ScheduleCache(ttl=60, clock=lambda: now[0])
+    week = window('Week', date(2024, 2, 14))
+    workouts, meals = cache.get(*week, load)
+    cache.get(*week, load)
+    assert loads == [week]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        following = next_window('Week', week[0])
+        cache.prefetch(*following, load, executor)
+        cache.prefetch(*following, load, executor)
+        cache.get(*following, lambda start, end: pytest.fail("prefetched window reloaded"))
+    assert loads == [week, following]
+
+    cache.apply({('workout', 'w1'): (True, '2024-02-12T08:00:00')})
+    assert workouts[0]['completed'] is True
+    assert group_by_day(workouts, meals) == {'2024-02-12': {'workouts': workouts, 'meals': []}}
+
+    now[0] = 61
+    cache.get(*week, load)
+    assert loads[-1] == week and len(loads) == 3
+
+
+def test_prefix_trie_matches_word_starts():
+    """Test that the trie finds names by any word prefix, shortest first, up to a limit"""
+    trie = PrefixTrie()
+    names = ['Bench press', 'Back squat', 'Squat', 'Overhead press', 'Split squat']
+    for n, name in enumerate(names):
+        trie.insert(name.lower(), {'id': n, 'kind': 'exercise', 'name': name})
+
+    assert [item['name'] for item in trie.search('SQ')] == ['Squat', 'Back squat', 'Split squat']
+    assert [item['name'] for item in trie.search('press', limit=1)] == ['Bench press']
+    assert trie.search('b') and not trie.search('deadlift')
+
+
+def test_catalog_references_and_expands_bodies():
+    """Test that names become ids on save and come back on display"""
+    catalog = Catalog()
+    items = [{'id': 1, 'kind': 'exercise', 'name': 'Bench press'}]
+    body = reference_body('workouts', [
+        {'name': ' bench  PRESS ', 'sets': '3', 'reps': '10'},
+        {'name': '', 'sets': '1', 'reps': '1'},
+    ], items)
+
+    assert body == [{'exercise_id': 1, 'sets': '3', 'reps': '10'}, {'name': '', 'sets': '1', 'reps': '1'}]
+    assert catalog.missing('workouts', body) == [1]
+    catalog.add(items)
+    assert catalog.missing('workouts', body) == []
+    assert catalog.expand('workouts', body)[0] == {'exercise_id': 1, 'name': 'Bench press', 'sets': '3', 'reps': '10'}
+    assert catalog.find('exercise', 'BENCH press')['id'] == 1
+    assert catalog.suggest('exercise', 'ben') == ['Bench press']
+    assert catalog.suggest('food', 'ben') == []
+
+
+def test_details_markdown_renders_one_block_per_template():
+    """Test that a body becomes a single numbered markdown list"""
+    workout = details_markdown('workouts', [
+        {'name': 'Squat', 'sets': '5', 'reps': '5'},
+        {'name': 'Lunge', 'sets': '3'},
+    ], description='Legs')
+    assert workout == (
+        "**Description:** Legs\n\n**Exercises:**\n\n"
+        "1. Squat - 5 sets x 5 reps\n2. Lunge - 3 sets x N/A reps"
+    )
+
+    meals = details_markdown('meal_plans', [{'name': 'Breakfast', 'time': '8:00', 'items': 'Oats\nBerries'}])
+    assert meals == "**Meals:**\n\n1. **Breakfast** (8:00)  \n   Oats  \n   Berries"
+    assert details_markdown('meal_plans', [], description=None) == "**Meals:**\n"
+
+
+def change(op, id, completed=False, assigned_date='2024-02-12', version=1, table='workout_assignments'):
+    """A change as the assignment triggers report it"""
+    return {'table': table, 'op': op, 'id': id, 'client_id': 'c1', 'trainer_id': 't1',
+            'assigned_date': assigned_date, 'version': version, 'completed': completed, 'completed_at': None}
+
+
+def test_change_feed_routes_changes_and_swallows_own_writes():
+    """Test that changes reach the client's and trainer's sessions only, without echoing own saves"""
+    feed = ChangeFeed()
+    client, trainer, other = SessionChanges(), SessionChanges(max_pending=2), SessionChanges()
+    woken = []
+    client.wake = lambda: woken.append('client')
+    other.wake = lambda: False  # the session has gone away
+    feed.subscribe('s1', 'c1', client)
+    feed.subscribe('s2', 't1', trainer)
+    feed.subscribe('s3', 'c2', other)
+
+    client.expect('workout_assignments', [{'id': 'a1', 'completed': True}])
+    feed.publish(change('UPDATE', 'a1', completed=True))
+    feed.publish(change('INSERT', 'a2'))
+    assert client.drain() == ([change('INSERT', 'a2')], False)
+    assert woken == ['client']
+    assert trainer.drain() == ([change('UPDATE', 'a1', completed=True), change('INSERT', 'a2')], False)
+    assert other.drain() == ([], False)
+
+    for n in range(3):
+        feed.publish(change('INSERT', f"b{n}"))
+    assert trainer.drain() == ([], True)
+    feed.resync()
+    assert client.drain() == ([], True)
+    assert len(feed._sessions) == 2
+
+
+def test_apply_changes_patches_drops_and_fetches_rows():
+    """Test that completions are patched in place and only new or moved rows are fetched"""
+    rows = [
+        {'id': 'a1', 'assigned_date': '2024-02-12', 'version': 1, 'completed': False, 'created_at': '1'},
+        {'id': 'a2', 'assigned_date': '2024-02-12', 'version': 1, 'completed': False, 'created_at': '2'},
+        {'id': 'a3', 'assigned_date': '2024-02-13', 'version': 1, 'completed': False, 'created_at': '3'},
+    ]
+    lists = {'workout_assignments': rows, 'meal_assignments': []}
+    wanted = lambda c: c['assigned_date'] <= '2024-02-18'
+    fetch = apply_changes(lists, [
+        change('UPDATE', 'a1', completed=True),
+        change('UPDATE', 'a2', assigned_date='2024-03-01'),
+        change('DELETE', 'a3'),
+        change('INSERT', 'a4', assigned_date='2024-02-14'),
+        change('INSERT', 'a5', assigned_date='2024-02-10'),
+        change('INSERT', 'a5', assigned_date='2024-02-10', version=2),
+    ], wanted)
+
+    assert fetch == {'workout_assignments': {'a4', 'a5'}, 'meal_assignments': set()}
+    assert [(r['id'], r['completed']) for r in rows] == [('a1', True)]
+    fetched = [{'id': 'a4', 'assigned_date': '2024-02-14'}, {'id': 'a5', 'assigned_date': '2024-02-10'}]
+    merge_rows(rows, fetched, fetch['workout_assignments'])
+    assert [r['id'] for r in rows] == ['a5', 'a1', 'a4']
+
+    cache = ScheduleCache(ttl=0)
+    cache.live = True
+    week = window('Week', date(2024, 2, 14))
+    workouts, _ = cache.get(*week, lambda start, end: ([dict(rows[1])], []))
+    fetch = cache.apply_changes([change('INSERT', 'a6', assigned_date='2024-02-15'),
+                                 change('INSERT', 'a7', assigned_date='2024-03-15')])
+    assert fetch == {'workout_assignments': {'a6'}, 'meal_assignments': set()}
+    cache.merge([{'id': 'a6', 'assigned_date': '2024-02-15'}], [])
+    assert [w['id'] for w in cache.get(*week, lambda start, end: pytest.fail("live window reloaded"))[0]] == ['a1', 'a6']
+
+
+def test_postgres_listener_publishes_notifications():
+    """Test that each NOTIFY payload is split into one change per row"""
+    class Notification:
+        payload = json.dumps({'table': 'meal_assignments', 'op': 'INSERT', 'rows': [
+            {'id': 'm1', 'client_id': 'c1'}, {'id': 'm2', 'client_id': 'c1'}
+        ]})
+
+    class Connection:
+        notifies = []
+
+        def poll(self):
+            self.notifies.append(Notification())
+
+    feed = ChangeFeed()
+    inbox = SessionChanges()
+    feed.subscribe('s1', 'c1', inbox)
+    PostgresListener('postgresql://unused', feed).deliver(Connection())
+
+    changes, _ = inbox.drain()
+    assert [(c['table'], c['op'], c['id']) for c in changes] == [
+        ('meal_assignments', 'INSERT', 'm1'), ('meal_assignments', 'INSERT', 'm2')
+    ]
+
+
+class FakeAuth:
+    """gotrue stand-in whose refresh_session waits for release and counts calls"""
+
+    def __init__(self, error=None):
+        self.calls = 0
+        self.error = error
+        self.release = threading.Event()
+
+    def refresh_session(self, refresh_token):
+        self.calls += 1
+        self.release.wait(5)
+        if self.error:
+            raise self.error()
+        session = SimpleNamespace(expires_at=10_000, refresh_token=f"{refresh_token}+")
+        return SimpleNamespace(session=session)
+
+
+def test_auth_session_refreshes_once_for_concurrent_callers():
+    """Test that callers arriving during a refresh wait for it instead of spending the token again"""
+    auth = FakeAuth()
+    session = AuthSession(auth, SimpleNamespace(expires_at=100, refresh_token='r1'), clock=lambda: 50)
+    assert session.ensure_fresh(margin=10) and auth.calls == 0
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = [executor.submit(session.ensure_fresh, 60) for _ in range(3)]
+        while auth.calls == 0:
+            pass
+        auth.release.set()
+        assert [r.result() for r in results] == [True, True, True]
+    assert auth.calls == 1
+    assert (session.expires_at, session._refresh_token) == (10_000, 'r1+')
+
+
+def test_token_refresher_refreshes_due_sessions_and_drops_rejected_ones():
+    """Test that only sessions near expiry are refreshed and a rejected token stops retries"""
+    class Rejected(Exception):
+        status = 400
+
+    now = [0]
+    due = AuthSession(FakeAuth(), SimpleNamespace(expires_at=100, refresh_token='r'), clock=lambda: now[0])
+    later = AuthSession(FakeAuth(), SimpleNamespace(expires_at=5_000, refresh_token='r'), clock=lambda: now[0])
+    dead = AuthSession(FakeAuth(Rejected), SimpleNamespace(expires_at=100, refresh_token='r'), clock=lambda: now[0])
+    for session in (due, later, dead):
+        session.auth.release.set()
+    refresher = TokenRefresher(margin=300, poll=3600)
+    refresher._thread = object()  # passes are run by hand
+    for session in (due, later, dead):
+        refresher.add(session)
+
+    assert refresher.refresh_due() == 1
+    assert (due.auth.calls, later.auth.calls, dead.auth.calls) == (1, 0, 1)
+    assert dead.rejected and not dead.ensure_fresh()
+    refresher.refresh_due()
+    assert dead not in refresher._sessions and dead.auth.calls == 1
+
+    # Closed sessions are forgotten once collected
+    del later
+    gc.collect()
+    assert len(refresher._sessions) == 1
+
+
+def wait_for(condition, timeout=5):
+    """Poll until condition() holds"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_shared_query_cache_serves_other_workers_over_redis():
+    """Test that workers on one Redis share entries and drop each other's invalidated copies"""
+    server = FakeRedis()
+    first = SharedQueryCache(RedisCacheStore(server.client())).follow()
+    second = SharedQueryCache(RedisCacheStore(server.client())).follow()
+    wait_for(lambda: len(server._channels.get('query_cache:invalidate', ())) == 2)
+
+    assert first.get_or_load(('workouts', 't1', None, None), lambda: [{'id': 'w1'}]) == [{'id': 'w1'}]
+    first.get_or_load(('workouts', 't2', None, None), lambda: [{'id': 'w2'}])
+    assert second.get_or_load(('workouts', 't1', None, None), lambda: pytest.fail("loaded twice")) == [{'id': 'w1'}]
+    assert second.stats()['shared_hits'] == 1
+
+    second.invalidate('workouts', 't1')
+    wait_for(lambda: not first.get(('workouts', 't1', None, None))[0])
+    assert first.get(('workouts', 't2', None, None)) == (True, [{'id': 'w2'}])
+
+    first.invalidate('workouts')
+    wait_for(lambda: not second.get(('workouts', 't2', None, None))[0])
+    assert list(server.scan_iter(match='query_cache:entry:*')) == []
+    assert list(server.scan_iter(match='query_cache:group:*')) == []
+
+
+def test_shared_query_cache_over_a_sqlite_file(tmp_path):
+    """Test that workers on one host share a cache file and see each other's invalidations"""
+    path = str(tmp_path / 'cache.db')
+    first = SharedQueryCache(SQLiteCacheStore(path))
+    second = SharedQueryCache(SQLiteCacheStore(path), ttl=60)
+
+    first.set(('clients', 't1', '', 20), [{'id': 'c1'}])
+    assert second.get(('clients', 't1', '', 20)) == (True, [{'id': 'c1'}])
+    assert SQLiteCacheStore(path).get('["clients","t1","",20]') == '[{"id":"c1"}]'
+
+    first.invalidate('clients')
+    assert second.store.poll() == [('clients', None)]
+    second.drop_local('clients')
+    assert second.get(('clients', 't1', '', 20)) == (False, None)
+    assert second.store.poll() == []
+
+
+@pytest.mark.parametrize('store', ['redis', 'sqlite'])
+def test_shared_query_cache_drops_values_invalidated_while_loading(store, tmp_path):
+    """Test that a value loaded before another worker's write is not shared after it"""
+    if store == 'redis':
+        server = FakeRedis()
+        first, second = (SharedQueryCache(RedisCacheStore(server.client())) for _ in range(2))
+    else:
+        path = str(tmp_path / 'cache.db')
+        first, second = (SharedQueryCache(SQLiteCacheStore(path)) for _ in range(2))
+    key = ('workouts', 't1', None, None)
+
+    def load_then_write():
+        rows = [{'id': 'w1', 'title': 'Old'}]
+        # Another worker writes and invalidates while these rows are in flight
+        second.invalidate('workouts', 't1')
+        return rows
+
+    assert first.get_or_load(key, load_then_write) == [{'id': 'w1', 'title': 'Old'}]
+    assert first.get(key) == (False, None)
+    assert first.store.get(encode_key(key)) is None
+    assert second.get_or_load(key, lambda: [{'id': 'w1', 'title': 'New'}]) == [{'id': 'w1', 'title': 'New'}]
+    assert first.get(key) == (True, [{'id': 'w1', 'title': 'New'}])
+
+    # Invalidating the whole name counts too; invalidating another owner does not
+    other = ('workouts', 't2', None, None)
+    assert first.get_or_load(other, lambda: second.invalidate('workouts') or []) == []
+    assert first.store.get(encode_key(other)) is None
+    assert first.get_or_load(other, lambda: second.invalidate('workouts', 't1') or []) == []
+    assert first.store.get(encode_key(other)) == '[]'
+
+
+def test_records_read_like_rows_and_share_templates():
+    """Test that records behave like the row dicts and each template is held once"""
+    template = {'id': 'w1', 'trainer_id': 't1', 'title': 'Legs', 'description': None,
+                'exercises': [{'exercise_id': 1, 'sets': '3'}]}
+    row = {'id': 'a1', 'workout_id': 'w1', 'client_id': 'c1', 'assigned_date': '2024-02-12',
+           'version': 2, 'completed': False, 'completed_at': None, 'workouts': template}
+    workouts, meals = assignment_records([row, dict(row, id='a2', workouts=dict(template))],
+                                         [{'id': 'm1', 'meal_plans': None}])
+
+    first, second = workouts
+    assert isinstance(first, WorkoutAssignment) and isinstance(meals[0], MealAssignment)
+    assert first['workouts'] is second['workouts']
+    assert dict(first['workouts']) == {'id': 'w1', 'title': 'Legs', 'description': None,
+                                       'exercises': ({'exercise_id': 1, 'sets': '3'},)}
+    assert first.get('created_at', 'missing') == 'missing' and 'created_at' not in first
+    assert dict(meals[0]) == {'id': 'm1', 'meal_plans': None}
+    assert not hasattr(first, '__dict__')
+
+    first['completed'] = True
+    assert (first['completed'], second['completed']) == (True, False)
+    with pytest.raises(KeyError):
+        first['notes'] = 'x'
+    with pytest.raises(AttributeError):
+        first['workouts'].title = 'Arms'
+    assert Workout.from_row(dict(template, title='Arms')) is not first['workouts']
+
+    copy = pickle.loads(pickle.dumps(first))
+    assert copy == first and copy['workouts'] is first['workouts']
+
+    profile = Profile.from_row({'id': 'c1', 'email': 'c@example.com', 'full_name': 'Cara', 'role': 'client'})
+    assert {'id': 'c1', **profile}['full_name'] == 'Cara' and profile.get('role') == 'client'
+    assert Profile.from_row(None) is None
@@ -0,0 +1,354 @@
+"""
+Tests for the repository layer, run against the SQLite backend
+Run with: python -m pytest -q test_repository.py
+"""
+
+import sys
+import os
+
+import pytest
+
+# Add parent directory to path to import the db package
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from db.pagination import next_cursor
+from db.repository import Repository
+from db.sqlite_repository import SQLiteRepository
+
+TRAINER = 'trainer-1'
+CLIENT = 'client-1'
+
+
+def make_repository():
+    """In-memory repository with one trainer and two clients"""
+    repo = SQLiteRepository()
+    repo.create_profile(TRAINER, 'coach@example.com', 'Coach Carter', 'trainer')
+    repo.create_profile(CLIENT, 'ann@example.com', 'Ann Client', 'client')
+    repo.create_profile('client-2', 'bob@example.com', 'Bob Client', 'client')
+    return repo
+
+
+def test_incomplete_backend_cannot_be_created():
+    """Test that a backend missing part of the interface fails when created"""
+    class ProfilesOnly(Repository):
+        def get_profile(self, user_id):
+            return None
+
+    with pytest.raises(TypeError, match='abstract'):
+        ProfilesOnly()
+def test_profiles_and_client_search():
+    """Test profile lookup, update and case-insensitive client search"""
+    repo = make_repository()
+    repo.update_profile(CLIENT, {'full_name': 'Annie Client'})
+
+    assert repo.get_profile(CLIENT)['full_name'] == 'Annie Client'
+    assert repo.get_profile('missing') is None
+    assert [c['id'] for c in repo.search_clients('ANNIE')] == [CLIENT]
+    assert len(repo.search_clients()) == 2
+    assert set(repo.search_clients(limit=1)[0]) == {'id', 'full_name', 'email'}
+
+    # LIKE wildcards in the term match only themselves
+    repo.create_profile('client-3', 'john_doe@example.com', 'John Doe', 'client')
+    repo.create_profile('client-4', 'johnxdoe@example.com', 'John X', 'client')
+    assert [c['id'] for c in repo.search_clients('john_doe')] == ['client-3']
+    assert repo.search_clients('100%') == []
+
+
+def test_templates_are_keyset_paged():
+    """Test that template lists are newest first and pages do not overlap"""
+    repo = make_repository()
+    for n in range(5):
+        repo.create_template('workouts', TRAINER, f"Workout {n}", '', [{'name': 'Squat'}])
+
+    first = repo.list_templates('workouts', TRAINER, limit=3)
+    second = repo.list_templates('workouts', TRAINER, after=next_cursor(first), limit=3)
+
+    assert [w['title'] for w in first + second] == [f"Workout {n}" for n in range(4, -1, -1)]
+    assert 'exercises' not in first[0]
+    assert repo.get_template_body('workouts', first[0]['id']) == [{'name': 'Squat'}]
+
+
+def test_assignments_checklist_and_completion():
+    """Test bulk upsert skips duplicates and the checklist embeds templates"""
+    repo = make_repository()
+    workout = repo.create_template('workouts', TRAINER, 'Legs', '', [])
+    meal_plan = repo.create_template('meal_plans', TRAINER, 'Keto', '', [{'name': 'Eggs'}])
+    rows = [
+        {'workout_id': workout['id'], 'client_id': CLIENT, 'assigned_date': '2024-01-01'},
+        {'workout_id': workout['id'], 'client_id': CLIENT, 'assigned_date': '2024-01-02'},
+    ]
+
+    assert repo.upsert_assignments('workout_assignments', rows) == (2, 0)
+    assert repo.upsert_assignments('workout_assignments', rows) == (0, 2)
+    repo.insert_assignment('meal_assignments', {
+        'meal_plan_id': meal_plan['id'], 'client_id': CLIENT, 'assigned_date': '2024-01-01'
+    })
+
+    workouts, meals = repo.get_checklist(CLIENT, '2024-01-01')
+    assert workouts[0]['workouts']['title'] == 'Legs'
+    assert workouts[0]['completed'] is False
+    assert meals[0]['meal_plans']['meals'] == [{'name': 'Eggs'}]
+
+    repo.set_completions(
+        workouts=[{'id': workouts[0]['id'], 'completed': True, 'completed_at': '2024-01-01T10:00:00'}],
+        meals=[]
+    )
+    repo.set_completed('meal_assignments', meals[0]['id'], True, None)
+    workouts, meals = repo.get_checklist(CLIENT, '2024-01-01')
+    assert workouts[0]['completed'] is True
+    assert meals[0]['completed'] is True
+
+
+def test_deleting_a_template_cascades():
+    """Test that deleting a workout removes its assignments, like ON DELETE CASCADE"""
+    repo = make_repository()
+    workout = repo.create_template('workouts', TRAINER, 'Legs', '', [])
+    repo.insert_assignment('workout_assignments', {
+        'workout_id': workout['id'], 'client_id': CLIENT, 'assigned_date': '2024-01-01'
+    })
+    repo.delete_template('workouts', workout['id'])
+
+    assert repo.get_checklist(CLIENT, '2024-01-01') == ([], [])
+
+
+def test_adherence_aggregate_follows_assignments():
+    """Test that the adherence triggers track inserts, completions and deletes"""
+    repo = make_repository()
+    workout = repo.create_template('workouts', TRAINER, 'Legs', '', [])
+    rows = [
+        {'workout_id': workout['id'], 'client_id': CLIENT, 'assigned_date': day}
+        for day in ('2024-01-01', '2024-01-03', '2024-01-08')  # Mondays 1st and 8th
+    ]
+    repo.upsert_assignments('workout_assignments', rows)
+    workouts, _ = repo.get_checklist(CLIENT, '2024-01-03')
+    repo.set_completions(workouts=[{'id': workouts[0]['id'], 'completed': True, 'completed_at': None}], meals=[])
+
+    adherence = repo.get_adherence(TRAINER, '2024-01-01', '2024-01-31')
+    counts = sorted((r['grain'], r['name'], r['week_start'], r['assigned'], r['completed']) for r in adherence)
+    assert counts == [
+        ('client', 'Ann Client', '2024-01-01', 2, 1),
+        ('client', 'Ann Client', '2024-01-08', 1, 0),
+        ('template', 'Legs', '2024-01-01', 2, 1),
+        ('template', 'Legs', '2024-01-08', 1, 0),
+    ]
+    assert repo.get_adherence('client-2', '2024-01-01', '2024-01-31') == []
+
+    repo.delete_template('workouts', workout['id'])
+    assert repo.get_adherence(TRAINER, '2024-01-01', '2024-01-31') == []
+
+
+def test_schedule_is_one_range_with_template_summaries():
+    """Test that the schedule covers the date range in order without template bodies"""
+    repo = make_repository()
+    workout = repo.create_template('workouts', TRAINER, 'Legs', '', [{'name': 'Squat'}])
+    repo.upsert_assignments('workout_assignments', [
+        {'workout_id': workout['id'], 'client_id': CLIENT, 'assigned_date': day}
+        for day in ('2024-01-09', '2024-01-01', '2024-01-07', '2024-01-08')
+    ])
+
+    workouts, meals = repo.get_schedule(CLIENT, '2024-01-01', '2024-01-07')
+
+    assert [w['assigned_date'] for w in workouts] == ['2024-01-01', '2024-01-07']
+    assert workouts[0]['workouts'] == {'id': workout['id'], 'title': 'Legs', 'description': ''}
+    assert meals == []
+
+
+def test_catalog_interns_names_and_finds_templates():
+    """Test that names are interned once per kind and templates are found by item"""
+    repo = make_repository()
+    first = repo.intern_catalog_items('exercise', ['Squat', 'squat ', 'Bench press', ''])
+    second = repo.intern_catalog_items('exercise', ['SQUAT'])
+    food = repo.intern_catalog_items('food', ['Squat'])
+
+    assert sorted(item['name'] for item in first) == ['Bench press', 'Squat']
+    assert second == [item for item in first if item['name'] == 'Squat']
+    assert food[0]['id'] not in {item['id'] for item in first}
+    assert len(repo.list_catalog('exercise')) == 2
+    assert repo.get_catalog_items([second[0]['id']]) == second
+
+    squat = second[0]['id']
+    legs = repo.create_template('workouts', TRAINER, 'Legs', '', [{'exercise_id': squat, 'sets': '3'}])
+    repo.create_template('workouts', TRAINER, 'Chest', '', [{'exercise_id': squat + 1}])
+    assert [w['id'] for w in repo.templates_with_item('workouts', TRAINER, squat)] == [legs['id']]
+
+
+def test_catalog_migration_rewrites_named_bodies(tmp_path):
+    """Test that reopening a database moves names in old bodies into the catalog"""
+    path = str(tmp_path / 'app.db')
+    repo = SQLiteRepository(path)
+    repo.create_profile(TRAINER, 'coach@example.com', 'Coach Carter', 'trainer')
+    workout = repo.create_template('workouts', TRAINER, 'Legs', '', [{'name': 'Squat', 'sets': '3'}, {'name': ''}])
+    plan = repo.create_template('meal_plans', TRAINER, 'Keto', '', [{'name': 'Eggs', 'time': '8:00'}])
+    repo.connection.close()
+
+    repo = SQLiteRepository(path)
+    squat = repo.list_catalog('exercise')[0]
+    eggs = repo.list_catalog('food')[0]
+
+    assert repo.get_template_body('workouts', workout['id']) == [{'exercise_id': squat['id'], 'sets': '3'}, {'name': ''}]
+    assert repo.get_template_body('meal_plans', plan['id']) == [{'food_id': eggs['id'], 'time': '8:00'}]
+    assert eggs['name'] == 'Eggs'
+
+
+def test_template_edits_are_versioned_and_assignments_pinned():
+    """Test that edits bump the version, share unchanged bodies and leave assignments pinned"""
+    repo = make_repository()
+    workout = repo.create_template('workouts', TRAINER, 'Legs', '', [{'name': 'Squat'}])
+    repo.insert_assignment('workout_assignments', {
+        'workout_id': workout['id'], 'client_id': CLIENT, 'assigned_date': '2024-01-01'
+    })
+
+    assert repo.update_template('workouts', workout['id'], 'Leg day', '', [{'name': 'Squat'}]) == 2
+    assert repo.update_template('workouts', workout['id'], 'Leg day', '', [{'name': 'Lunge'}]) == 3
+    versions = repo.list_versions('workouts', workout['id'])
+    assert [v['version'] for v in versions] == [3, 2, 1]
+    assert versions[1]['body_hash'] == versions[2]['body_hash'] != versions[0]['body_hash']
+    assert repo.get_template_body('workouts', workout['id'], 1) == [{'name': 'Squat'}]
+    assert repo.get_template_body('workouts', workout['id']) == [{'name': 'Lunge'}]
+
+    # The assignment keeps showing the version it was made with
+    workouts, _ = repo.get_checklist(CLIENT, '2024-01-01')
+    assert workouts[0]['version'] == 1
+    assert workouts[0]['workouts']['title'] == 'Legs'
+    assert workouts[0]['workouts']['exercises'] == [{'name': 'Squat'}]
+    scheduled, _ = repo.get_schedule(CLIENT, '2024-01-01', '2024-01-07')
+    assert scheduled[0]['workouts']['title'] == 'Legs'
+
+    repo.insert_assignment('workout_assignments', {
+        'workout_id': workout['id'], 'client_id': CLIENT, 'assigned_date': '2024-01-02'
+    })
+    workouts, _ = repo.get_checklist(CLIENT, '2024-01-02')
+    assert workouts[0]['version'] == 3
+    assert workouts[0]['workouts']['exercises'] == [{'name': 'Lunge'}]
+
+
+def test_history_is_keyset_paged_oldest_first():
+    """Test that a client's history pages on (assigned_date, id) with the pinned title"""
+    repo = make_repository()
+    workout = repo.create_template('workouts', TRAINER, 'Legs', '', [{'name': 'Squat'}])
+    other = repo.create_template('workouts', TRAINER, 'Arms', '', [])
+    for workout_id, client_id, assigned_date in [
+        (workout['id'], CLIENT, '2024-01-02'), (other['id'], CLIENT, '2024-01-01'),
+        (workout['id'], CLIENT, '2024-01-01'), (workout['id'], 'client-2', '2024-01-01'),
+    ]:
+        repo.insert_assignment('workout_assignments', {
+            'workout_id': workout_id, 'client_id': client_id, 'assigned_date': assigned_date
+        })
+    repo.update_template('workouts', workout['id'], 'Leg day', '', [{'name': 'Squat'}])
+
+    first = repo.get_history_page('workout_assignments', CLIENT, limit=2)
+    after = next_cursor(first, ('assigned_date', 'id'))
+    second = repo.get_history_page('workout_assignments', CLIENT, after=after, limit=2)
+    assert [row['assigned_date'] for row in first + second] == ['2024-01-01', '2024-01-01', '2024-01-02']
+    assert first[0]['id'] < first[1]['id']
+    assert second[0]['workout_versions'] == {'title': 'Legs'}
+    assert second[0]['version'] == 1 and second[0]['completed'] is False
+    assert repo.get_history_page('meal_assignments', CLIENT) == []
+
+
+def test_templates_are_created_in_bulk_and_found_by_title():
+    """Test multi-row template inserts and the title / email lookups imports use"""
+    repo = make_repository()
+    assert repo.create_templates('workouts', TRAINER, [
+        {'title': 'Legs', 'description': '', 'body': [{'name': 'Squat'}]},
+        {'title': 'Arms', 'description': 'Curls', 'body': [{'name': 'Curl'}]},
+    ]) == 2
+    repo.create_template('workouts', TRAINER, 'Legs', 'newer', [])
+
+    found = repo.find_templates('workouts', TRAINER, ['Legs', 'Core'])
+    assert [(t['title'], t['description']) for t in found] == [('Legs', 'newer'), ('Legs', '')]
+    assert repo.get_template_body('workouts', found[1]['id']) == [{'name': 'Squat'}]
+    assert repo.find_templates('workouts', 'client-2', ['Legs']) == []
+    assert [c['id'] for c in repo.find_clients(['ann@example.com', 'coach@example.com'])] == [CLIENT]
+
+
+def test_clone_shares_body_and_archive_keeps_history():
+    """Test that a copy shares the body and archiving drops only open future assignments"""
+    repo = make_repository()
+    workout = repo.create_template('workouts', TRAINER, 'Legs', '', [{'name': 'Squat'}])
+    copy = repo.clone_template('workouts', workout['id'], 'Legs (copy)')
+    assert copy['title'] == 'Legs (copy)'
+    assert (repo.list_versions('workouts', copy['id'])[0]['body_hash']
+            == repo.list_versions('workouts', workout['id'])[0]['body_hash'])
+
+    repo.upsert_assignments('workout_assignments', [
+        {'workout_id': workout['id'], 'client_id': CLIENT, 'assigned_date': day}
+        for day in ('2024-01-01', '2024-01-10', '2024-01-11')
+    ])
+    done, _ = repo.get_checklist(CLIENT, '2024-01-11')
+    repo.set_completed('workout_assignments', done[0]['id'], True, None)
+
+    repo.archive_template('workouts', workout['id'], '2024-01-10')
+
+    assert [w['id'] for w in repo.list_templates('workouts', TRAINER)] == [copy['id']]
+    scheduled, _ = repo.get_schedule(CLIENT, '2024-01-01', '2024-01-31')
+    assert [w['assigned_date'] for w in scheduled] == ['2024-01-01', '2024-01-11']
+    assert scheduled[0]['workouts']['title'] == 'Legs'
+
+
+def test_job_queue_claims_in_order_and_reclaims_expired_leases():
+    """Test that jobs are claimed once, in order, per owner, and retried or failed"""
+    repo = make_repository()
+    first = repo.enqueue_job(TRAINER, 'bulk_assign', {'dates': []})
+    second = repo.enqueue_job(TRAINER, 'archive_template', {})
+    assert first['status'] == 'queued' and first['params'] == {'dates': []}
+
+    assert repo.claim_job(CLIENT, 60) is None
+    claimed = repo.claim_job(TRAINER, 60)
+    assert (claimed['id'], claimed['status'], claimed['attempts']) == (first['id'], 'running', 1)
+    assert repo.claim_job(TRAINER, 60)['id'] == second['id']
+    assert repo.claim_job(TRAINER, 60) is None
+
+    repo.set_job_progress(first['id'], 5, 10, 60)
+    repo.fail_job(second['id'], 'boom', retry_in=3600)
+    assert repo.claim_job(TRAINER, 60) is None  # not due yet
+
+    # An expired lease means the worker died: the job is claimed again
+    repo.set_job_progress(first['id'], 5, 10, -1)
+    reclaimed = repo.claim_job(TRAINER, 60)
+    assert (reclaimed['id'], reclaimed['attempts'], reclaimed['done']) == (first['id'], 2, 5)
+
+    repo.finish_job(first['id'], {'inserted': 3, 'skipped': 0})
+    repo.fail_job(second['id'], 'boom')
+    jobs = {job['id']: job for job in repo.list_jobs(TRAINER, 10)}
+    assert jobs[first['id']]['status'] == 'done'
+    assert jobs[first['id']]['result'] == {'inserted': 3, 'skipped': 0}
+    assert (jobs[second['id']]['status'], jobs[second['id']]['error']) == ('failed', 'boom')
+
+
+def test_assignment_changes_are_reported_after_commit_and_fetched_by_id():
+    """Test that writes to assignments reach on_change once committed, and can be refetched by id"""
+    repo = make_repository()
+    workout = repo.create_template('workouts', TRAINER, 'Legs', '', [{'name': 'Squat'}])
+    changes = []
+    repo.on_change = changes.append
+
+    repo.insert_assignment('workout_assignments', {
+        'workout_id': workout['id'], 'client_id': CLIENT, 'assigned_date': '2024-01-01'
+    })
+    # One insert is one change, already pinned to the template's version
+    assert [(c['op'], c['version']) for c in changes] == [('INSERT', 1)]
+    assignment_id = changes[0]['id']
+    repo.set_completed('workout_assignments', assignment_id, True, '2024-01-01T10:00:00')
+    with pytest.raises(RuntimeError):
+        with repo._write():
+            repo.connection.execute("DELETE FROM workout_assignments")
+            raise RuntimeError("rolled back")
+
+    assert {c['op'] for c in changes} == {'INSERT', 'UPDATE'}
+    last = changes[-1]
+    assert (last['table'], last['id'], last['client_id'], last['trainer_id']) == (
+        'workout_assignments', assignment_id, CLIENT, TRAINER
+    )
+    assert (last['completed'], last['version'], last['assigned_date']) == (True, 1, '2024-01-01')
+
+    workouts, meals = repo.get_assignments([assignment_id], [])
+    assert workouts[0]['workouts']['exercises'] == [{'name': 'Squat'}]
+    assert meals == []
+
+    del changes[:]
+    repo.upsert_assignments('workout_assignments', [
+        {'workout_id': workout['id'], 'client_id': CLIENT, 'assigned_date': day}
+        for day in ('2024-01-01', '2024-01-02', '2024-01-03')
+    ])
+    assert [c['op'] for c in changes] == ['INSERT', 'INSERT']
@@ -1,29 +1,49 @@
 #!/usr/bin/env python3
+"""
+Connection check against a live Supabase project
+Run with: python test_supabase.py (needs SUPABASE_URL and SUPABASE_KEY)
+"""
 
 import os
 from dotenv import load_dotenv
 from supabase import create_client
 
-# Load environment variables
-load_dotenv()
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-print(f"Testing Supabase connection...")
-print(f"URL: {SUPABASE_URL}")
-print(f"Key starts with: {SUPABASE_KEY[:20]}...")
-print(f"Key length: {len(SUPABASE_KEY)}")
-
-try:
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    print("✅ Supabase client created successfully")
-    
-    # Test a simple query
-    result = supabase.table('profiles').select('count').execute()
-    print("✅ Database query successful")
-    print(f"Profiles table accessible: {result}")
-    
-except Exception as e:
-    print(f"❌ Error: {e}")
-    print(f"Error type: {type(e)}")
\ No newline at end of file
+from db.repository import SupabaseRepository
+
+
+def main():
+    # Load environment variables
+    load_dotenv()
+
+    SUPABASE_URL = os.getenv("SUPABASE_URL")
+    SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ Set SUPABASE_URL and SUPABASE_KEY first")
+        return
+
+    print(f"Testing Supabase connection...")
+    print(f"URL: {SUPABASE_URL}")
+    print(f"Key starts with: {SUPABASE_KEY[:20]}...")
+    print(f"Key length: {len(SUPABASE_KEY)}")
+
+    try:
+        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        print("✅ Supabase client created successfully")
+        
+        # Test a simple query
+        result = supabase.table('profiles').select('count').execute()
+        print("✅ Database query successful")
+        print(f"Profiles table accessible: {result}")
+        
+        # Test the repository layer the app uses
+        clients = SupabaseRepository(supabase).search_clients(limit=1)
+        print(f"✅ Repository query successful ({len(clients)} client rows visible)")
+        
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        print(f"Error type: {type(e)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -70,7 +70,12 @@ def test_schema_structure():
         'workouts',
         'meal_plans',
         'workout_assignments',
-        'meal_assignments'
+        'meal_assignments',
+        'catalog_items',
+        'template_bodies',
+        'workout_versions',
+        'meal_plan_versions',
+        'jobs'
     ]
     
     missing = []
@@ -86,6 +91,35 @@ def test_schema_structure():
         return True
 
 
+def test_schema_functions():
+    """Test that schema.sql defines the RPC functions the app calls"""
+    with open('schema.sql', 'r') as f:
+        content = f.read()
+    
+    required_functions = [
+        'get_client_checklist',
+        'get_client_schedule',
+        'set_assignment_completion',
+        'get_trainer_adherence',
+        'refresh_adherence',
+        'intern_catalog_items',
+        'prune_template_bodies',
+        'claim_job'
+    ]
+    
+    missing = []
+    for func in required_functions:
+        if f"CREATE OR REPLACE FUNCTION public.{func}(" not in content:
+            missing.append(func)
+    
+    if missing:
+        print(f"✗ Missing functions in schema: {', '.join(missing)}")
+        return False
+    else:
+        print(f"✓ All {len(required_functions)} required functions present in schema")
+        return True
+
+
 def test_rls_policies():
     """Test that RLS policies are defined"""
     with open('schema.sql', 'r') as f:
@@ -99,6 +133,30 @@ def test_rls_policies():
         return False
 
 
+def test_rls_policy_cost():
+    """Test that RLS policies avoid per-row subqueries"""
+    with open('schema.sql', 'r') as f:
+        content = f.read()
+    
+    policies = [
+        statement for statement in content.split(';')
+        if 'CREATE POLICY' in statement
+    ]
+    slow = []
+    for policy in policies:
+        name = policy.split('"')[1]
+        body = policy.replace('(SELECT auth.uid())', '')
+        if 'EXISTS' in body or 'auth.uid()' in body:
+            slow.append(name)
+    
+    if slow:
+        print(f"✗ Policies with per-row subqueries: {', '.join(slow)}")
+        return False
+    else:
+        print(f"✓ All {len(policies)} policies evaluate auth lookups once per statement")
+        return True
+
+
 def test_requirements():
     """Test that requirements.txt has necessary packages"""
     with open('requirements.txt', 'r') as f:
@@ -153,7 +211,9 @@ def run_all_tests():
         ("Import Tests", test_imports),
         ("App Structure", test_app_structure),
         ("Schema Structure", test_schema_structure),
+        ("Schema Functions", test_schema_functions),
         ("RLS Policies", test_rls_policies),
+        ("RLS Policy Cost", test_rls_policy_cost),
         ("Requirements", test_requirements),
         ("Environment Config", test_env_example),
     ]